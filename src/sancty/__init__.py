@@ -1,3 +1,54 @@
-from sancty.run import start_terminal
-from sancty.render import Renderer, ExternalError
-from sancty.read import Reader
+import importlib
+import typing
+
+# Modules are only imported once one of their names is used, so that importing a single part of sancty stays cheap
+_EXPORTS = {
+    'start_terminal': 'sancty.run',
+    'start_terminal_async': 'sancty.run_async',
+    'start_terminal_threaded': 'sancty.run_threaded',
+    'AsyncReader': 'sancty.run_async',
+    'AsyncRenderer': 'sancty.run_async',
+    'Renderer': 'sancty.render',
+    'ExternalError': 'sancty.render',
+    'Reader': 'sancty.read',
+    'DocumentRenderer': 'sancty.editor',
+    'Document': 'sancty.document',
+    'DocumentView': 'sancty.document',
+    'Insert': 'sancty.edits',
+    'Delete': 'sancty.edits',
+    'Split': 'sancty.edits',
+    'Join': 'sancty.edits',
+    'Replace': 'sancty.edits',
+    'Journal': 'sancty.journal',
+    'Instrument': 'sancty.instrument',
+    'serve': 'sancty.server',
+    'connect': 'sancty.server',
+}
+
+__all__ = list(_EXPORTS)
+
+if typing.TYPE_CHECKING:
+    from sancty.run import start_terminal
+    from sancty.run_async import start_terminal_async, AsyncReader, AsyncRenderer
+    from sancty.run_threaded import start_terminal_threaded
+    from sancty.render import Renderer, ExternalError
+    from sancty.read import Reader
+    from sancty.editor import DocumentRenderer
+    from sancty.document import Document, DocumentView
+    from sancty.edits import Insert, Delete, Split, Join, Replace
+    from sancty.journal import Journal
+    from sancty.instrument import Instrument
+    from sancty.server import serve, connect
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module 'sancty' has no attribute '{name}'")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *__all__])
@@ -0,0 +1,5 @@
+from sancty.bench.terminal import FakeTerminal, CountingStream
+from sancty.bench.workloads import WORKLOADS, make_workload
+from sancty.bench.runner import create_bench_renderer, run_values, run_workload, run_scaling, run_transport, \
+    run_wakeup, run_startup, run_sessions
+from sancty.bench.results import make_report, save_report, load_report, compare_reports
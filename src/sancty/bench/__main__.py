@@ -0,0 +1,68 @@
+import argparse
+from sancty.bench.runner import RENDERERS, run_workload, run_scaling, run_transport, run_wakeup, run_startup, \
+    run_sessions
+from sancty.bench.workloads import WORKLOADS
+from sancty.bench.results import make_report, save_report, load_report, compare_reports, format_results, \
+    format_comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sancty.bench',
+                                     description="Run the renderers headless on synthetic keystroke workloads.")
+    parser.add_argument('--renderer', choices=list(RENDERERS), action='append',
+                        help="renderer to benchmark, can be repeated (default: all)")
+    parser.add_argument('--workload', choices=list(WORKLOADS), action='append',
+                        help="workload to run, can be repeated (default: all)")
+    parser.add_argument('--keys', type=int, default=2000, help="keystrokes per workload")
+    parser.add_argument('--width', type=int, default=80)
+    parser.add_argument('--height', type=int, default=24)
+    parser.add_argument('--paint-mode', choices=['diff', 'full'], help="paint mode of the document renderer")
+    parser.add_argument('--viewport', action='store_true', help="only paint the rows that fit in the terminal")
+    parser.add_argument('--scaling', type=int, nargs='*', metavar='PARAGRAPHS',
+                        help="also measure typing at the end of documents of these sizes (default 10 100 1000)")
+    parser.add_argument('--transport', action='store_true',
+                        help="also measure the shm, manager and thread transports, and how soon the renderer "
+                             "wakes up for shm batches")
+    parser.add_argument('--startup', action='store_true',
+                        help="also measure the time from starting the editor on a file until it is painted")
+    parser.add_argument('--sessions', type=int, nargs='*', metavar='SESSIONS',
+                        help="also measure keys typed into this many sessions of a single server (default 100)")
+    parser.add_argument('--save', metavar='FILE', help="save the results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="compare the results to an earlier saved run")
+    args = parser.parse_args(argv)
+
+    renderers = args.renderer or list(RENDERERS)
+    workloads = args.workload or list(WORKLOADS)
+    results = []
+    for renderer in renderers:
+        options = {}
+        if renderer == 'document':
+            if args.paint_mode:
+                options['paint_mode'] = args.paint_mode
+            if args.viewport:
+                options['viewport'] = True
+        for workload in workloads:
+            results.append(run_workload(renderer, workload, args.keys, args.height, args.width, **options))
+        if args.scaling is not None:
+            sizes = args.scaling or (10, 100, 1000)
+            results += run_scaling(renderer, sizes, height=args.height, width=args.width, **options)
+    if args.transport:
+        results += [run_transport('shm'), run_transport('manager', batches=500), run_transport('thread'),
+                    run_wakeup(wait=False), run_wakeup(wait=True)]
+    if args.startup:
+        results += [run_startup('manager'), run_startup('shm'), run_startup('shm', 'forkserver'),
+                    run_startup('thread')]
+    if args.sessions is not None:
+        results += [run_sessions(sessions) for sessions in args.sessions or (100,)]
+    print(format_results(results))
+
+    report = make_report(results)
+    if args.save:
+        save_report(report, args.save)
+    if args.compare:
+        print()
+        print(format_comparison(compare_reports(load_report(args.compare), report)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import json
+import platform
+from importlib import metadata
+
+METRICS = ('p50_us', 'p90_us', 'p99_us', 'bytes_per_key')
+
+
+def run_key(result: dict) -> str:
+    if 'startup' in result:
+        return f"startup/{result['startup']}"
+    if 'sessions' in result:
+        return f"sessions/{result['sessions']}x{result['workers']}"
+    if 'wakeup' in result:
+        return f"wakeup/shm/{result['wakeup']}"
+    if 'transport' in result:
+        return f"transport/{result['transport']}"
+    if 'paragraphs' in result:
+        return f"scaling/{result['renderer']}/{result['paragraphs']}"
+    return f"{result['renderer']}/{result['workload']}/{result['width']}x{result['height']}"
+
+
+def make_report(results: list[dict]) -> dict:
+    try:
+        version = metadata.version('sancty')
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        'meta': {'sancty': version, 'python': platform.python_version(), 'machine': platform.machine()},
+        'results': {run_key(result): result for result in results},
+    }
+
+
+def save_report(report: dict, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(baseline: dict, current: dict, metrics=METRICS) -> list[tuple[str, str, float, float, float]]:
+    """(run, metric, baseline value, current value, current / baseline) for every run both reports contain."""
+    rows = []
+    for key, result in current['results'].items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        for metric in metrics:
+            if metric in result and metric in old:
+                ratio = result[metric] / old[metric] if old[metric] else float('inf')
+                rows.append((key, metric, old[metric], result[metric], ratio))
+    return rows
+
+
+def format_results(results: list[dict]) -> str:
+    lines = [f"{'run':<36} {'keys':>6} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>9} {'bytes/key':>10}"]
+    for result in results:
+        lines.append(f"{run_key(result):<36} {result['keys']:>6} {result['p50_us']:>9.1f} {result['p90_us']:>9.1f} "
+                     f"{result['p99_us']:>9.1f} {result['max_us']:>9.1f} {result['bytes_per_key']:>10.1f}")
+    return '\n'.join(lines)
+
+
+def format_comparison(rows) -> str:
+    lines = [f"{'run':<36} {'metric':<14} {'baseline':>10} {'current':>10} {'ratio':>7}"]
+    for key, metric, old, new, ratio in rows:
+        lines.append(f"{key:<36} {metric:<14} {old:>10.1f} {new:>10.1f} {ratio:>7.2f}")
+    return '\n'.join(lines)
@@ -0,0 +1,351 @@
+import os
+import sys
+import contextlib
+import random
+import statistics
+import tempfile
+from sancty.deps_types import tm
+from sancty.render import RendererProtocol, Renderer
+from sancty.editor import DocumentRenderer
+from sancty.messages import Resize
+from sancty.bench.terminal import FakeTerminal, CountingStream
+from sancty.bench.workloads import make_workload, typing, enter_key, BENCH_REPLACE_DICT
+
+RENDERERS = {
+    'document': DocumentRenderer,
+    'legacy': Renderer,
+}
+
+
+def create_bench_renderer(clss: RendererProtocol):
+    class BenchRendr(clss):
+        """Hands out one value at a time and measures how long it takes until the renderer asks for more.
+
+        The first warmup values are not measured, and the stream counts start over once they have been rendered.
+        """
+
+        def __init__(self, term, values, stream: CountingStream, warmup=0, replace_dict=None, **renderer_options):
+            super().__init__(term, replace_dict, **renderer_options)
+            self.values = values
+            self.stream = stream
+            self.warmup = warmup
+            self.next_index = 0
+            self.started = None
+            self.measure_start = tm.perf_counter()
+            self.latencies = []
+
+        def has_exited(self) -> bool:
+            return self.started is None and self.next_index >= len(self.values)
+
+        def is_resizing(self) -> bool:
+            return False
+
+        def update_values(self, values) -> tuple[bool, list]:
+            now = tm.perf_counter_ns()
+            if self.started is not None:
+                if self.next_index > self.warmup:
+                    self.latencies.append(now - self.started)
+                self.started = None
+            if self.next_index < len(self.values):
+                if self.next_index == self.warmup and self.warmup > 0:
+                    self.stream.bytes_written = 0
+                    self.stream.writes = 0
+                    self.measure_start = tm.perf_counter()
+                val = self.values[self.next_index]
+                self.next_index += 1
+                if isinstance(val, Resize):
+                    self.term.resize(val.height, val.width)
+                values.append(val)
+                self.started = tm.perf_counter_ns()
+            # Always report an empty queue, so that every value is painted before the next one is handed out
+            return True, values
+
+    return BenchRendr
+
+
+def percentile(ordered: list, fraction: float):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies_ns: list[int], stream: CountingStream, seconds: float) -> dict:
+    ordered = sorted(latencies_ns)
+    keys = len(ordered)
+    return {
+        'keys': keys,
+        'mean_us': statistics.fmean(ordered) / 1000 if ordered else 0,
+        'p50_us': percentile(ordered, 0.5) / 1000,
+        'p90_us': percentile(ordered, 0.9) / 1000,
+        'p99_us': percentile(ordered, 0.99) / 1000,
+        'max_us': ordered[-1] / 1000 if ordered else 0,
+        'bytes': stream.bytes_written,
+        'bytes_per_key': stream.bytes_written / keys if keys else 0,
+        'writes': stream.writes,
+        'seconds': seconds,
+    }
+
+
+def run_values(renderer_cls, values: list, height=24, width=80, warmup=0, replace_dict=None,
+               **renderer_options) -> dict:
+    """Render values headless and summarize the latency of every value after the first warmup values."""
+    term = FakeTerminal(height, width)
+    stream = CountingStream()
+    if replace_dict is None:
+        replace_dict = BENCH_REPLACE_DICT
+    with contextlib.redirect_stdout(stream):
+        renderer = create_bench_renderer(renderer_cls)(term, values, stream, warmup, replace_dict, **renderer_options)
+        renderer.print_terminal()
+    return summarize(renderer.latencies, stream, tm.perf_counter() - renderer.measure_start)
+
+
+def run_workload(renderer='document', workload='typing', keys=2000, height=24, width=80, seed=0,
+                 **renderer_options) -> dict:
+    values = make_workload(workload, FakeTerminal(height, width), keys, seed)
+    result = run_values(RENDERERS[renderer], values, height, width, **renderer_options)
+    result.update(renderer=renderer, workload=workload, width=width, height=height)
+    return result
+
+
+def run_scaling(renderer='document', sizes=(10, 100, 1000), probe_keys=300, height=24, width=80, seed=0,
+                **renderer_options) -> list[dict]:
+    """Latency of typing at the end of documents that already hold a number of paragraphs."""
+    curve = []
+    for size in sizes:
+        term = FakeTerminal(height, width)
+        prefill = []
+        for i in range(size):
+            prefill += typing(term, 40, random.Random(seed + i)) + [enter_key(term)]
+        probe = make_workload('typing', term, probe_keys, seed)
+        result = run_values(RENDERERS[renderer], prefill + probe, height, width, warmup=len(prefill),
+                            **renderer_options)
+        result.update(renderer=renderer, paragraphs=size)
+        curve.append(result)
+    return curve
+
+
+def run_transport(transport='shm', batches=2000, batch_size=4, seed=0) -> dict:
+    """Latency of putting a batch of keys on a transport queue and getting it off again, in a single process."""
+    values = make_workload('typing', FakeTerminal(), batches * batch_size, seed)
+    shm_transport = None
+    match transport:
+        case 'manager':
+            import multiprocessing as mp
+            manager = mp.Manager()
+            queue = manager.Queue()
+        case 'shm':
+            from sancty.shm import ShmTransport
+            manager = None
+            shm_transport = ShmTransport()
+            queue = shm_transport.queue
+        case 'thread':
+            from sancty.run_threaded import KeyQueue
+            manager = None
+            queue = KeyQueue()
+        case _:
+            raise ValueError(f"Unknown transport {transport}!")
+    latencies = []
+    start = tm.perf_counter()
+    try:
+        for i in range(batches):
+            batch = values[i * batch_size:(i + 1) * batch_size]
+            sent = tm.perf_counter_ns()
+            queue.put(batch)
+            queue.get(block=True)
+            latencies.append(tm.perf_counter_ns() - sent)
+    finally:
+        if shm_transport is not None:
+            shm_transport.close()
+        if manager is not None:
+            manager.shutdown()
+    result = summarize(latencies, CountingStream(), tm.perf_counter() - start)
+    result.update(transport=transport, batch_size=batch_size)
+    return result
+
+
+def put_stamped(queue, batches, seed):
+    rnd = random.Random(seed)
+    for _ in range(batches):
+        tm.sleep(rnd.uniform(0, 0.002))
+        queue.put([tm.monotonic_ns()])
+
+
+def run_wakeup(wait=True, start_method=None, batches=300, seed=0) -> dict:
+    """Latency of batches that another process puts on a shm transport at random intervals, until the idle renderer
+    loop takes them off. The renderer either waits on the queue itself, or sleeps 3 ms whenever it is empty.
+
+    The other process is started with start_method, like the processes of start_terminal.
+    """
+    import multiprocessing as mp
+    from sancty.shm import ShmTransport
+    from sancty.deps_types import QueueEmpty
+
+    ctx = mp.get_context(start_method)
+    shm_transport = ShmTransport(ctx=ctx)
+    queue = shm_transport.queue
+    latencies = []
+    producer = ctx.Process(target=put_stamped, args=(queue, batches, seed))
+    start = tm.perf_counter()
+    producer.start()
+    try:
+        while len(latencies) < batches:
+            try:
+                (sent,) = queue.get(block=False)
+            except QueueEmpty:
+                if wait:
+                    queue.wait(0.003)
+                else:
+                    tm.sleep(0.003)
+                continue
+            latencies.append(tm.monotonic_ns() - sent)
+    finally:
+        producer.join()
+        shm_transport.close()
+    result = summarize(latencies, CountingStream(), tm.perf_counter() - start)
+    wakeup = 'wait' if wait else 'sleep'
+    result.update(wakeup=wakeup if start_method is None else f'{wakeup}/{start_method}')
+    return result
+
+
+STARTUP_LINE = 'The first line of the startup benchmark.'
+
+
+def time_first_paint(argv, env, height=24, width=80, timeout=10.0) -> int:
+    """Nanoseconds from forking a process running argv on a new pseudo terminal until STARTUP_LINE is written to it.
+
+    The process is then sent CTRL+D until it exits, and killed if it has not exited by the timeout.
+    """
+    import pty
+    import fcntl
+    import select
+    import signal
+    import struct
+    import termios
+
+    started = tm.perf_counter_ns()
+    pid, fd = pty.fork()
+    if pid == 0:
+        fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack('HHHH', height, width, 0, 0))
+        os.execve(argv[0], argv, env)
+    painted = None
+    output = b''
+    deadline = tm.perf_counter() + timeout
+    next_exit = 0
+    try:
+        while tm.perf_counter() < deadline:
+            if select.select([fd], [], [], 0.01)[0]:
+                try:
+                    data = os.read(fd, 1 << 16)
+                except OSError:
+                    break
+                if not data:
+                    break
+                if painted is None:
+                    output += data
+                    if STARTUP_LINE.encode() in output:
+                        painted = tm.perf_counter_ns() - started
+            if painted is not None:
+                if os.waitpid(pid, os.WNOHANG)[0] != 0:
+                    pid = None
+                    break
+                # The reader may not be reading keys yet, in which case the terminal drops CTRL+D
+                if tm.perf_counter() >= next_exit:
+                    os.write(fd, b'\x04')
+                    next_exit = tm.perf_counter() + 0.1
+    finally:
+        if pid is not None:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        os.close(fd)
+    if painted is None:
+        raise TimeoutError(f"Nothing was painted within {timeout} seconds!")
+    return painted
+
+
+def run_startup(transport='manager', start_method=None, runs=5, height=24, width=80) -> dict:
+    """Time from starting Python on a file with start_terminal until the first line of the file is painted.
+
+    With transport 'thread', the editor is started with start_terminal_threaded instead.
+    """
+    # The processes import the same sancty as this one
+    package_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [package_parent, os.environ.get('PYTHONPATH')]))}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'startup.txt')
+        with open(path, 'w') as f:
+            f.write(STARTUP_LINE + '\n')
+        if transport == 'thread':
+            code = (f"from sancty.run_threaded import start_terminal_threaded; "
+                    f"start_terminal_threaded(open_path={path!r})")
+        else:
+            code = (f"from sancty.run import start_terminal; "
+                    f"start_terminal(open_path={path!r}, transport={transport!r}, start_method={start_method!r})")
+        start = tm.perf_counter()
+        latencies = [time_first_paint([sys.executable, '-c', code], env, height, width) for _ in range(runs)]
+    result = summarize(latencies, CountingStream(), tm.perf_counter() - start)
+    result.update(startup=transport if start_method is None else f'{transport}/{start_method}')
+    return result
+
+
+def run_sessions(sessions=100, workers=4, rounds=50, height=24, width=80, seed=0) -> dict:
+    """Latency of keys typed into many sessions of one server at once, and the memory the server takes per session.
+
+    Every round, one key of the typing workload is sent to every session, and the latency of a key is the time until
+    its session sent the frame that shows it.
+    """
+    import json
+    import socket
+    import signal
+    import selectors
+    import multiprocessing as mp
+    from sancty.server import serve, request_stats, encode_frame, HELLO, KEYS
+
+    term = FakeTerminal(height, width)
+    values = make_workload('typing', term, rounds, seed)
+    keys = [b'\r' if val.code == term.KEY_ENTER else str(val).encode() for val in values]
+    stream = CountingStream()
+    latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sancty.sock')
+        server = mp.get_context('fork').Process(target=serve, args=(path, workers))
+        server.start()
+        clients = []
+        try:
+            while not os.path.exists(path):
+                tm.sleep(0.01)
+            hello = encode_frame(HELLO, json.dumps({'kind': 'session', 'rows': height, 'cols': width}).encode())
+            for _ in range(sessions):
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(path)
+                client.sendall(hello)
+                client.recv(1 << 16)
+                client.setblocking(False)
+                clients.append(client)
+            start = tm.perf_counter()
+            with selectors.DefaultSelector() as selector:
+                for client in clients:
+                    selector.register(client, selectors.EVENT_READ)
+                for key in keys:
+                    sent = {}
+                    for client in clients:
+                        client.sendall(encode_frame(KEYS, key))
+                        sent[client] = tm.perf_counter_ns()
+                    while sent:
+                        for ready, _mask in selector.select(5.0):
+                            data = ready.fileobj.recv(1 << 16)
+                            stream.bytes_written += len(data)
+                            stream.writes += 1
+                            if ready.fileobj in sent:
+                                latencies.append(tm.perf_counter_ns() - sent.pop(ready.fileobj))
+            seconds = tm.perf_counter() - start
+            stats = request_stats(path)
+        finally:
+            for client in clients:
+                client.close()
+            # The server stops its workers when it is interrupted
+            os.kill(server.pid, signal.SIGINT)
+            server.join()
+    result = summarize(latencies, stream, seconds)
+    rss = stats['server_rss_bytes'] + sum(worker['rss_bytes'] for worker in stats['workers'])
+    result.update(sessions=sessions, workers=workers, rss_bytes=rss, rss_per_session_bytes=rss / sessions)
+    return result
@@ -0,0 +1,34 @@
+import io
+from blessed.terminal import WINSZ
+from sancty.deps_types import Terminal
+
+
+class FakeTerminal(Terminal):
+    """Terminal that writes to a StringIO and has whatever size it is given, for running renderers headless."""
+
+    def __init__(self, height=24, width=80, kind='xterm-256color'):
+        self.size = (height, width)
+        super().__init__(kind=kind, force_styling=True, stream=io.StringIO())
+
+    def _height_and_width(self):
+        height, width = self.size
+        return WINSZ(ws_row=height, ws_col=width, ws_xpixel=0, ws_ypixel=0)
+
+    def resize(self, height, width):
+        self.size = (height, width)
+
+
+class CountingStream(io.TextIOBase):
+    """Discards everything written to it, but counts the encoded bytes."""
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text) -> int:
+        self.bytes_written += len(text.encode())
+        self.writes += 1
+        return len(text)
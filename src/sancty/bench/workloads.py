@@ -0,0 +1,118 @@
+import random
+from blessed.keyboard import Keystroke
+from sancty.messages import Resize, Paste
+
+WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'render', 'terminal', 'sancty', 'a',
+         'paragraph', 'with', 'some', 'longer', 'words', 'in', 'it']
+WIDE_WORDS = ['日本語', 'テキスト', '世界', '한국어', '中文字符', '😀', '👍🏽', 'café', 'naïve']
+BENCH_REPLACE_DICT = {
+    "hi": "hello world ",
+    "sig": "Kind regards, Sancty",
+    "lorem": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. ",
+}
+
+
+def enter_key(term) -> Keystroke:
+    return Keystroke('\r', term.KEY_ENTER, 'KEY_ENTER')
+
+
+def backspace_key(term) -> Keystroke:
+    return Keystroke('\x7f', term.KEY_BACKSPACE, 'KEY_BACKSPACE')
+
+
+def keys_of(text) -> list[Keystroke]:
+    return [Keystroke(char) for char in text]
+
+
+def typing(term, keys: int, rnd: random.Random, words=WORDS, enter_every=60) -> list:
+    """Words separated by spaces, with an Enter after roughly every enter_every keys."""
+    values = []
+    while len(values) < keys:
+        values += keys_of(rnd.choice(words) + ' ')
+        # Words and their space take about 6 keys on average
+        if rnd.random() < 6 / enter_every:
+            values.append(enter_key(term))
+    return values[:keys]
+
+
+def enter_heavy(term, keys: int, rnd: random.Random) -> list:
+    return typing(term, keys, rnd, enter_every=6)
+
+
+def backspace_storm(term, keys: int, rnd: random.Random) -> list:
+    """Bursts of typing that are partially or entirely deleted again, also across paragraph boundaries."""
+    values = []
+    while len(values) < keys:
+        burst = typing(term, rnd.randint(5, 40), rnd, enter_every=15)
+        values += burst
+        values += [backspace_key(term)] * rnd.randint(1, len(burst) + 5)
+    return values[:keys]
+
+
+def wide_text(term, keys: int, rnd: random.Random) -> list:
+    """CJK, emoji (including modifiers) and combining characters mixed with plain words."""
+    return typing(term, keys, rnd, words=WIDE_WORDS + WORDS[:6])
+
+
+def resizes(term, keys: int, rnd: random.Random, every=50) -> list:
+    """Typing with a Resize to a random width every so many keys, the renderer sees the new size right away."""
+    height = term.height
+    values = []
+    for val in typing(term, keys, rnd):
+        values.append(val)
+        if len(values) % every == 0:
+            values.append(Resize(height, rnd.randint(20, 120)))
+    return values[:keys]
+
+
+def slash_commands(term, keys: int, rnd: random.Random) -> list:
+    """Typing with slash commands, some of which match BENCH_REPLACE_DICT and some of which never match."""
+    commands = [f'\\{key}' for key in BENCH_REPLACE_DICT] + ['\\nomatch ', '\\h ', '\\lorx ']
+    values = []
+    while len(values) < keys:
+        values += typing(term, rnd.randint(5, 30), rnd)
+        values += keys_of(rnd.choice(commands))
+    return values[:keys]
+
+
+def pastes(term, keys: int, rnd: random.Random, every=200, paste_chars=20000) -> list:
+    """Typing with a bracketed paste of many paragraphs every so many keys."""
+    values = []
+    for val in typing(term, keys, rnd):
+        values.append(val)
+        if len(values) % every == 0:
+            text = ''.join(rnd.choice(WORDS) + (' ' if rnd.random() < 0.9 else '\n') for _ in range(paste_chars // 6))
+            values.append(Paste(text))
+    return values[:keys]
+
+
+def cursor_edits(term, keys: int, rnd: random.Random) -> list:
+    """Typing interrupted by bursts of arrow keys, so that text is inserted and deleted in the middle of paragraphs
+    and of the document."""
+    moves = [Keystroke('\x1b[A', term.KEY_UP, 'KEY_UP'), Keystroke('\x1b[B', term.KEY_DOWN, 'KEY_DOWN'),
+             Keystroke('\x1b[D', term.KEY_LEFT, 'KEY_LEFT'), Keystroke('\x1b[C', term.KEY_RIGHT, 'KEY_RIGHT')]
+    values = []
+    while len(values) < keys:
+        values += typing(term, rnd.randint(5, 40), rnd, enter_every=20)
+        values += [rnd.choice(moves) for _ in range(rnd.randint(1, 10))]
+        if rnd.random() < 0.3:
+            values += [backspace_key(term)] * rnd.randint(1, 5)
+    return values[:keys]
+
+
+WORKLOADS = {
+    'typing': typing,
+    'enter': enter_heavy,
+    'backspace': backspace_storm,
+    'wide': wide_text,
+    'resize': resizes,
+    'slash': slash_commands,
+    'paste': pastes,
+    'cursor': cursor_edits,
+}
+
+
+def make_workload(name, term, keys: int, seed=0) -> list:
+    if name not in WORKLOADS:
+        raise ValueError(f"Unknown workload {name}!")
+    return WORKLOADS[name](term, keys, random.Random(seed))
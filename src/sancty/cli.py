@@ -1,5 +1,35 @@
-import sancty.run as sancty_run
+import os
+import argparse
 
 
-def run():
-    sancty_run.start_terminal()
+def run(argv=None):
+    parser = argparse.ArgumentParser(prog='sancty', description="Simple terminal text editor.")
+    parser.add_argument('file', nargs='?', help="file to open, which is created when it is saved if it does not exist")
+    parser.add_argument('-o', '--output', metavar='FILE', help="save to this file instead of to the opened file")
+    parser.add_argument('-j', '--journal', metavar='FILE',
+                        help="journal edits to this file, and recover the text from it if it already exists")
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help="serve editor sessions to clients that connect to this Unix domain socket")
+    parser.add_argument('--workers', type=int, default=4, help="renderer worker processes of the server")
+    parser.add_argument('--root', metavar='DIR',
+                        help="directory under which sessions of the server can open and save files (default: none)")
+    parser.add_argument('--connect', metavar='SOCKET', help="edit in a session of the server at this socket")
+    parser.add_argument('--stats', metavar='SOCKET',
+                        help="print the memory and key latency of every session of the server at this socket")
+    args = parser.parse_args(argv)
+
+    open_path = args.file if args.file is not None and os.path.exists(args.file) else None
+    save_path = args.output if args.output is not None else args.file
+    # The editor is only imported once the arguments are known to be valid, so that errors and --help are quick
+    if args.serve is not None or args.connect is not None or args.stats is not None:
+        import json
+        import sancty.server as sancty_server
+        if args.serve is not None:
+            sancty_server.serve(args.serve, workers=args.workers, root=args.root)
+        elif args.stats is not None:
+            print(json.dumps(sancty_server.request_stats(args.stats), indent=2))
+        else:
+            sancty_server.connect(args.connect, open_path=open_path, save_path=save_path)
+        return
+    import sancty.run as sancty_run
+    sancty_run.start_terminal(open_path=open_path, save_path=save_path, journal_path=args.journal)
@@ -1,5 +1,3 @@
-from sancty import patch_blessed
-import cwcwidth
 import time
 import queue
 import threading
@@ -7,14 +5,23 @@ import typing
 
 tm = time
 
-Terminal = patch_blessed.Terminal
 Queue = queue.Queue
 Event = threading.Event
 QueueEmpty = queue.Empty
 
-wcswidth = cwcwidth.wcswidth
-
 Optional = typing.Optional
 Callable = typing.Callable
 Protocol = typing.Protocol
 Generic = typing.Generic
+
+
+def __getattr__(name):
+    # Only modules that use the terminal pay for importing blessed and cwcwidth
+    match name:
+        case 'Terminal':
+            from sancty import patch_blessed
+            return patch_blessed.Terminal
+        case 'wcswidth':
+            import cwcwidth
+            return cwcwidth.wcswidth
+    raise AttributeError(f"module 'sancty.deps_types' has no attribute '{name}'")
@@ -0,0 +1,681 @@
+import sys
+import random
+from bisect import bisect_right
+from sancty.deps_types import Callable, Optional
+from sancty.width import char_width, display_width, cumulative_widths
+
+
+class _Paragraph:
+    """Node of a single paragraph, or an extent of span paragraphs of a source that have not been loaded yet.
+
+    The paragraphs of an extent are counted as one display row each, and their characters as their size in bytes.
+    """
+    __slots__ = ('text', 'lines', 'priority', 'left', 'right', 'count', 'chars', 'rows', 'source', 'first', 'span',
+                 'size')
+
+    def __init__(self, text, lines, priority):
+        self.text = text
+        self.lines = lines
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.source = None
+        self.first = 0
+        self.span = 1
+        self.count = 1
+        self.chars = len(text)
+        self.rows = len(lines)
+
+
+def _extent(source, first, span, priority) -> _Paragraph:
+    node = _Paragraph('', [], priority)
+    node.text = node.lines = None
+    node.source = source
+    node.first = first
+    node.span = span
+    start, end = source.span_offsets(first, span)
+    node.size = end - start
+    _update(node)
+    return node
+
+
+def _own_rows(node: _Paragraph) -> int:
+    return node.span if node.lines is None else len(node.lines)
+
+
+def _own_chars(node: _Paragraph) -> int:
+    # Without the newlines between the paragraphs of an extent
+    return node.size - node.span + 1 if node.lines is None else len(node.text)
+
+
+def _update(node: _Paragraph):
+    count = node.span
+    chars = _own_chars(node)
+    rows = _own_rows(node)
+    left = node.left
+    if left is not None:
+        count += left.count
+        chars += left.chars
+        rows += left.rows
+    right = node.right
+    if right is not None:
+        count += right.count
+        chars += right.chars
+        rows += right.rows
+    node.count = count
+    node.chars = chars
+    node.rows = rows
+
+
+def _merge(a: Optional[_Paragraph], b: Optional[_Paragraph]) -> Optional[_Paragraph]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+def _split(node: Optional[_Paragraph], k: int) -> tuple[Optional[_Paragraph], Optional[_Paragraph]]:
+    """Split off the first k paragraphs."""
+    if node is None:
+        return None, None
+    left_count = node.left.count if node.left is not None else 0
+    if k <= left_count:
+        first, node.left = _split(node.left, k)
+        _update(node)
+        return first, node
+    if k < left_count + node.span:
+        # Split inside an extent, the second part becomes a node of its own. It gets a priority of its own too,
+        # otherwise all paragraphs loaded from one extent would share a priority and form a chain
+        j = k - left_count
+        tail = _extent(node.source, node.first + j, node.span - j, random.random())
+        rest = _merge(tail, node.right)
+        node.right = None
+        node.span = j
+        start, end = node.source.span_offsets(node.first, j)
+        node.size = end - start
+        _update(node)
+        return node, rest
+    node.right, rest = _split(node.right, k - left_count - node.span)
+    _update(node)
+    return node, rest
+
+
+def _build(paragraphs: list, lo: int, hi: int, max_priority: float) -> Optional[_Paragraph]:
+    if lo >= hi:
+        return None
+    # Distribution of the maximum of hi - lo uniform priorities, given that it is below max_priority
+    priority = max_priority * random.random() ** (1 / (hi - lo))
+    mid = (lo + hi) // 2
+    text, lines = paragraphs[mid]
+    node = _Paragraph(text, lines, priority)
+    node.left = _build(paragraphs, lo, mid, priority)
+    node.right = _build(paragraphs, mid + 1, hi, priority)
+    _update(node)
+    return node
+
+
+def _first_difference(old_lines, new_lines) -> Optional[int]:
+    for i, (old, new) in enumerate(zip(old_lines, new_lines)):
+        if old != new:
+            return i
+    if len(old_lines) != len(new_lines):
+        return min(len(old_lines), len(new_lines))
+    return None
+
+
+def paragraphs_from_render(render_array: list, paragraph_ends: list) -> list[str]:
+    """Join a render array of wrapped lines back into paragraph texts."""
+    paragraphs = []
+    prev_pend = 0
+    for pend in paragraph_ends:
+        paragraphs.append(''.join(render_array[prev_pend:pend + 1]))
+        prev_pend = pend + 1
+    paragraphs.append(''.join(render_array[prev_pend:]))
+    return paragraphs
+
+
+class Document:
+    """Text document stored as a balanced tree (an implicit treap) of paragraphs.
+
+    Every node holds the text of one paragraph together with its wrapped display lines at the current width, and
+    keeps the paragraph, character and display row counts of its subtree. Paragraph lookup, insertion, deletion and
+    splitting are O(log n) in the number of paragraphs, as is mapping between paragraphs and display rows. A document
+    always contains at least one (possibly empty) paragraph; the last paragraph is the one being typed in.
+
+    A document can also be opened from a source like a MappedFile, whose paragraphs start out as extent nodes. A
+    paragraph is only loaded from the source (decoded and wrapped) once it is accessed, or once its display rows are
+    loaded with load_rows. Until then it is counted as a single display row. The paragraphs of the source are also
+    only counted as far as they are needed, so until the document is counted, len, rows and chars cover the paragraphs
+    counted so far. These always include the paragraph after any paragraph or row that was accessed.
+    """
+    width: int
+    damage: Optional[int]
+
+    def __init__(self, wrap_fn: Callable[[str, int], list[str]], width: int, paragraphs: list[str] = None,
+                 append_fn: Callable[[str, list[str], str, int], tuple[int, list[str]]] = None,
+                 reflow_fn: Callable[[list[str], int], list[list[str]]] = None):
+        self.wrap_fn = wrap_fn
+        self.append_fn = append_fn
+        self.reflow_fn = reflow_fn
+        self.width = width
+        self.damage = None
+        self.source = None
+        # Paragraphs of the source in the tree while it is still being counted, None once all of them are
+        self._counted: Optional[int] = None
+        self._root = None
+        self.replace_all([''] if not paragraphs else paragraphs)
+
+    def wrap(self, text) -> list[str]:
+        wrapped = self.wrap_fn(text, self.width)
+        return wrapped if len(wrapped) > 0 else ['']
+
+    def wrap_many(self, texts: list[str]) -> list[list[str]]:
+        """Wrapped lines of every text, with reflow_fn all at once."""
+        if self.reflow_fn is None:
+            return [self.wrap(text) for text in texts]
+        return [lines if len(lines) > 0 else [''] for lines in self.reflow_fn(texts, self.width)]
+
+    def _make_tree(self, paragraphs) -> Optional[_Paragraph]:
+        wrapped = list(zip(paragraphs, self.wrap_many(paragraphs)))
+        return _build(wrapped, 0, len(wrapped), 1.0)
+
+    def _grow(self):
+        """Add the paragraphs of the source that are counted next to the end of the tree."""
+        rows = self.rows if self._root is not None else 0
+        known, complete = self.source.count_paragraphs(self._counted + 1)
+        if known > self._counted:
+            tail = _extent(self.source, self._counted, known - self._counted, random.random())
+            self._root = _merge(self._root, tail)
+            self._add_damage(rows)
+        self._counted = None if complete else known
+
+    @property
+    def counted(self) -> bool:
+        """Whether all paragraphs of the source are counted, and with that the last paragraph is known."""
+        return self._counted is None
+
+    def count_to(self, i):
+        """Count paragraphs of the source until paragraph i is followed by another one, or all are counted."""
+        while self._counted is not None and i + 1 >= len(self):
+            self._grow()
+
+    def count_rows(self, row):
+        """Count paragraphs of the source until display row is followed by another one, or all are counted."""
+        while self._counted is not None and row + 1 >= self.rows:
+            self._grow()
+
+    def count_all(self):
+        while self._counted is not None:
+            self._grow()
+
+    def _find(self, i) -> _Paragraph:
+        """Node that holds paragraph i, which is an extent if the paragraph has not been loaded."""
+        self.count_to(i)
+        if not 0 <= i < len(self):
+            raise IndexError("paragraph index out of range")
+        node = self._root
+        while True:
+            left_count = node.left.count if node.left is not None else 0
+            if i < left_count:
+                node = node.left
+            elif i < left_count + node.span:
+                return node
+            else:
+                i -= left_count + node.span
+                node = node.right
+
+    def _load(self, i):
+        """Turn paragraph i, which is part of an extent, into a node of its own with its text and wrapped lines."""
+        first, rest = _split(self._root, i)
+        node, rest = _split(rest, 1)
+        node.text = node.source.paragraph(node.first)
+        node.lines = self.wrap(node.text)
+        node.source = None
+        node.priority = random.random()
+        _update(node)
+        self._root = _merge(_merge(first, node), rest)
+        # Until now it was shown as a single unwrapped line
+        if node.lines != [node.text]:
+            self._add_damage(self.row_of(i))
+
+    def _node(self, i) -> _Paragraph:
+        node = self._find(i)
+        if node.source is not None:
+            self._load(i)
+            node = self._find(i)
+        return node
+
+    def _add_damage(self, row):
+        if self.damage is None or row < self.damage:
+            self.damage = row
+
+    def take_damage(self) -> Optional[int]:
+        """First display row that changed since the last call, or None if nothing changed."""
+        damage = self.damage
+        self.damage = None
+        return damage
+
+    def __len__(self) -> int:
+        return self._root.count
+
+    @property
+    def rows(self) -> int:
+        return self._root.rows
+
+    @property
+    def chars(self) -> int:
+        return self._root.chars
+
+    def paragraph(self, i) -> str:
+        return self._node(i).text
+
+    def lines(self, i) -> list[str]:
+        return self._node(i).lines
+
+    def row_of(self, i) -> int:
+        """Display row at which paragraph i starts."""
+        self.count_to(i)
+        row = 0
+        node = self._root
+        while node is not None:
+            left_count = node.left.count if node.left is not None else 0
+            left_rows = node.left.rows if node.left is not None else 0
+            if i <= left_count:
+                if i == left_count:
+                    return row + left_rows
+                node = node.left
+            elif i < left_count + node.span:
+                return row + left_rows + i - left_count
+            else:
+                i -= left_count + node.span
+                row += left_rows + _own_rows(node)
+                node = node.right
+        return row
+
+    def char_offset(self, i) -> int:
+        """Number of characters in the paragraphs before paragraph i, which is loaded.
+
+        Paragraphs that have not been loaded are counted by their size in bytes.
+        """
+        if i < len(self):
+            self._node(i)
+        offset = 0
+        node = self._root
+        while node is not None:
+            left_count = node.left.count if node.left is not None else 0
+            left_chars = node.left.chars if node.left is not None else 0
+            if i <= left_count:
+                if i == left_count:
+                    return offset + left_chars
+                node = node.left
+            else:
+                i -= left_count + node.span
+                offset += left_chars + _own_chars(node)
+                node = node.right
+        return offset
+
+    def locate_row(self, row) -> tuple[int, int]:
+        """Paragraph containing display row, and the row within that paragraph."""
+        self.count_rows(row)
+        row = min(max(row, 0), self.rows - 1)
+        i = 0
+        node = self._root
+        while True:
+            left_count = node.left.count if node.left is not None else 0
+            left_rows = node.left.rows if node.left is not None else 0
+            if row < left_rows:
+                node = node.left
+            elif row < left_rows + _own_rows(node):
+                if node.lines is None:
+                    return i + left_count + row - left_rows, 0
+                return i + left_count, row - left_rows
+            else:
+                row -= left_rows + _own_rows(node)
+                i += left_count + node.span
+                node = node.right
+
+    def position(self, i, offset) -> tuple[int, int]:
+        """Display row and column of character offset in paragraph i, an offset at the end of a line that is not the
+        last of the paragraph is shown at the start of the next line."""
+        lines = self.lines(i)
+        row = self.row_of(i)
+        last = len(lines) - 1
+        for k, line in enumerate(lines):
+            if offset < len(line) or k == last:
+                # Characters that wrapping dropped (like those of a paragraph of only spaces) take up a column each
+                return row + k, display_width(line[:offset]) + max(offset - len(line), 0)
+            offset -= len(line)
+
+    def locate_position(self, row, col) -> tuple[int, int]:
+        """Paragraph and character offset shown closest to (but not after) display row and column."""
+        i, k = self.locate_row(row)
+        lines = self.lines(i)
+        offset = sum(len(line) for line in lines[:k])
+        line = lines[k]
+        p = bisect_right(cumulative_widths(line), col)
+        if p == len(line) and 0 < p and k < len(lines) - 1:
+            # The end of this line is the start of the next one
+            p -= 1
+        while 0 < p < len(line) and char_width(line[p]) == 0:
+            p -= 1
+        return i, min(offset + p, len(self.paragraph(i)))
+
+    def iter_paragraphs(self, start=0):
+        """Iterate over (text, lines) of all paragraphs starting at paragraph start.
+
+        Paragraphs that have not been loaded are read from the source without loading them, as a single line. The
+        source is counted further as the paragraphs counted so far run out.
+        """
+        i = start
+        while True:
+            for paragraph in self._iter_counted(i):
+                yield paragraph
+                i += 1
+            if self._counted is None:
+                return
+            self._grow()
+
+    def _iter_counted(self, start):
+        stack = []
+        node = self._root
+        i = start
+        skip = 0
+        while node is not None:
+            left_count = node.left.count if node.left is not None else 0
+            if i < left_count:
+                stack.append(node)
+                node = node.left
+            elif i < left_count + node.span:
+                stack.append(node)
+                skip = i - left_count
+                break
+            else:
+                i -= left_count + node.span
+                node = node.right
+        while stack:
+            node = stack.pop()
+            if node.lines is None:
+                for k in range(node.first + skip, node.first + node.span):
+                    text = node.source.paragraph(k)
+                    yield text, [text]
+                skip = 0
+            else:
+                yield node.text, node.lines
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def iter_lines(self, start_row=0):
+        """Iterate over display lines starting at display row start_row."""
+        self.count_rows(start_row)
+        if start_row >= self.rows:
+            return
+        i, row = self.locate_row(start_row)
+        for _text, lines in self.iter_paragraphs(i):
+            if row > 0:
+                yield from lines[row:]
+                row = 0
+            else:
+                yield from lines
+
+    def text(self) -> str:
+        return '\n'.join(text for text, _lines in self.iter_paragraphs())
+
+    def _path(self, i) -> list[_Paragraph]:
+        """Nodes from the root down to the node of paragraph i, which is loaded first."""
+        self._node(i)
+        path = []
+        node = self._root
+        while True:
+            path.append(node)
+            left_count = node.left.count if node.left is not None else 0
+            if i < left_count:
+                node = node.left
+            elif i == left_count:
+                return path
+            else:
+                i -= left_count + node.span
+                node = node.right
+
+    def _set_lines(self, i, path, start, lines):
+        """Replace the lines of paragraph i starting at start, path is the result of _path(i)."""
+        node = path[-1]
+        first = _first_difference(node.lines[start:], lines)
+        node.lines[start:] = lines
+        for parent in reversed(path):
+            _update(parent)
+        if first is not None:
+            self._add_damage(self.row_of(i) + start + first)
+
+    def set_paragraph(self, i, text):
+        path = self._path(i)
+        path[-1].text = text
+        self._set_lines(i, path, 0, self.wrap(text))
+
+    def extend_paragraph(self, i, text):
+        """Append text without newlines to paragraph i, with append_fn only its last lines are wrapped again."""
+        if self.append_fn is None:
+            self.set_paragraph(i, self.paragraph(i) + text)
+            return
+        path = self._path(i)
+        node = path[-1]
+        start, lines = self.append_fn(node.text, node.lines, text, self.width)
+        node.text += text
+        self._set_lines(i, path, start, lines if start > 0 or len(lines) > 0 else [''])
+
+    def insert_paragraphs(self, i, paragraphs: list[str]):
+        if not paragraphs:
+            return
+        self.count_to(i)
+        first, rest = _split(self._root, i)
+        self._root = _merge(_merge(first, self._make_tree(paragraphs)), rest)
+        self._add_damage(self.row_of(i))
+
+    def delete_paragraphs(self, i, count=1):
+        self.count_to(i + count - 1)
+        first, rest = _split(self._root, i)
+        _deleted, rest = _split(rest, count)
+        self._root = _merge(first, rest)
+        if self._root is None:
+            self._root = self._make_tree([''])
+        self._add_damage(self.row_of(min(i, len(self) - 1)))
+
+    def replace_all(self, paragraphs: list[str]):
+        self.source = None
+        self._counted = None
+        self._root = self._make_tree([''] if not paragraphs else paragraphs)
+        self._add_damage(0)
+
+    def clear(self):
+        self.replace_all([''])
+
+    def split_paragraph(self, i, offset):
+        """Break paragraph i in two at character offset."""
+        text = self.paragraph(i)
+        self.set_paragraph(i, text[:offset])
+        self.insert_paragraphs(i + 1, [text[offset:]])
+
+    def join_paragraphs(self, i):
+        """Join paragraph i with the paragraph that follows it."""
+        self.count_to(i)
+        if i + 1 >= len(self):
+            return
+        text = self.paragraph(i + 1)
+        self.delete_paragraphs(i + 1)
+        self.set_paragraph(i, self.paragraph(i) + text)
+
+    def insert_text(self, i, offset, text) -> tuple[int, int]:
+        """Insert text, which may contain newlines, at offset in paragraph i and return the position after it."""
+        current = self.paragraph(i)
+        parts = text.split('\n')
+        if len(parts) == 1:
+            if offset == len(current):
+                self.extend_paragraph(i, text)
+            else:
+                self.set_paragraph(i, current[:offset] + text + current[offset:])
+            return i, offset + len(text)
+        tail = current[offset:]
+        if offset == len(current):
+            if parts[0]:
+                self.extend_paragraph(i, parts[0])
+        else:
+            self.set_paragraph(i, current[:offset] + parts[0])
+        self.insert_paragraphs(i + 1, parts[1:-1] + [parts[-1] + tail])
+        return i + len(parts) - 1, len(parts[-1])
+
+    def append_text(self, text) -> tuple[int, int]:
+        self.count_all()
+        last = len(self) - 1
+        return self.insert_text(last, len(self.paragraph(last)), text)
+
+    def set_width(self, width):
+        self.width = width
+        loaded = [node for node in self._iter_nodes() if node.source is None]
+        for node, lines in zip(loaded, self.wrap_many([node.text for node in loaded])):
+            node.lines = lines
+        stack = []
+        node = self._root
+        # Post-order traversal, so every node is updated after its children
+        last = None
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+                continue
+            peek = stack[-1]
+            if peek.right is not None and last is not peek.right:
+                node = peek.right
+                continue
+            _update(peek)
+            last = stack.pop()
+        self._add_damage(0)
+
+    def open(self, source):
+        """Replace the text with the paragraphs of source, which are only counted and loaded once they are needed."""
+        self.source = source
+        self._root = None
+        self._counted = 0
+        self._grow()
+        self._add_damage(0)
+
+    def load_rows(self, start_row, count) -> bool:
+        """Load all paragraphs that are displayed in count rows starting at start_row, returns whether this changed
+        the number of rows."""
+        if self.source is None:
+            return False
+        rows = self.rows
+        self.count_rows(start_row + count)
+        row = start_row
+        while row < min(start_row + count, self.rows):
+            i, within = self.locate_row(row)
+            node = self._find(i)
+            if node.source is not None:
+                # Loading might change the rows of the paragraph, so it is located again
+                self._load(i)
+                continue
+            row += len(node.lines) - within
+        return self.rows != rows
+
+    def _iter_nodes(self):
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def memory_size(self) -> int:
+        """Approximate number of bytes held by the tree, the paragraphs and their lines."""
+        size = 0
+        for node in self._iter_nodes():
+            size += sys.getsizeof(node)
+            if node.lines is not None:
+                size += sys.getsizeof(node.text) + sys.getsizeof(node.lines) + sum(map(sys.getsizeof, node.lines))
+        return size
+
+    def snapshot(self) -> 'DocumentSnapshot':
+        """Text as it is now, which can still be written once the document changed (also from another thread).
+
+        This neither loads nor counts the paragraphs of the source.
+        """
+        pieces = []
+        for node in self._iter_nodes():
+            if node.source is None:
+                pieces.append(node.text)
+            else:
+                pieces.append((node.source.data, *node.source.span_offsets(node.first, node.span)))
+        if self._counted is not None:
+            # The paragraphs that have not been counted yet follow the tree, up to the end of the source
+            start = 0 if self._counted == 0 else self.source.newline_offset(self._counted - 1) + 1
+            pieces.append((self.source.data, start, self.source.size))
+        return DocumentSnapshot(pieces)
+
+    def write(self, stream, newline='\n'):
+        """Write the text encoded as UTF-8 to a binary stream, one paragraph at a time.
+
+        Paragraphs that have not been loaded are copied from the source as they are.
+        """
+        self.snapshot().write(stream, newline)
+
+    def to_render(self) -> tuple[list, list]:
+        """Render array of wrapped lines and the indices of the lines that end a paragraph."""
+        render_array = []
+        paragraph_ends = []
+        for _text, lines in self.iter_paragraphs():
+            render_array += lines
+            paragraph_ends.append(len(render_array) - 1)
+        paragraph_ends.pop(-1)
+        return render_array, paragraph_ends
+
+
+class DocumentSnapshot:
+    """Paragraphs of a document at one point in time: the text of loaded paragraphs, which never changes, and the
+    start and end offsets of the bytes of the others in the data of their source."""
+    __slots__ = ('pieces',)
+
+    def __init__(self, pieces: list):
+        self.pieces = pieces
+
+    def write(self, stream, newline='\n'):
+        separator = newline.encode()
+        for k, piece in enumerate(self.pieces):
+            if k > 0:
+                stream.write(separator)
+            if isinstance(piece, str):
+                stream.write(piece.encode())
+            else:
+                data, start, end = piece
+                stream.write(memoryview(data)[start:end])
+
+
+class DocumentView:
+    """Read-only view of a Document, for code that should be able to read all of it but not change it."""
+    __slots__ = ('_document',)
+
+    def __init__(self, document: Document):
+        self._document = document
+
+    def __len__(self) -> int:
+        self._document.count_all()
+        return len(self._document)
+
+    def paragraph(self, i) -> str:
+        return self._document.paragraph(i)
+
+    def __iter__(self):
+        return (text for text, _lines in self._document.iter_paragraphs())
+
+    def text(self) -> str:
+        return self._document.text()
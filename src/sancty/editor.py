@@ -0,0 +1,495 @@
+import typing
+from itertools import islice
+from sancty.deps_types import tm, Optional
+from sancty.document import Document, DocumentView, paragraphs_from_render
+from sancty.edits import Edit, Insert, Delete, Join, Replace
+from sancty.render import Renderer, ExternalError
+from sancty.reflow import close_pool
+from sancty.paint import PainterProtocol, FullPainter, DiffPainter
+from sancty.messages import Resize, Stamp, Paste
+from sancty.width import char_width
+
+# Opening, saving and journaling files is imported once it is used, so that starting the editor without them is quick
+if typing.TYPE_CHECKING:
+    from sancty.journal import Journal
+
+
+class DocumentRenderer(Renderer):
+    """Renderer that keeps its text in a Document instead of in a render array.
+
+    Wrapped display lines are derived from the document, and every edit only rewraps and repaints the display rows
+    starting at the first row it changed. With paint_mode 'diff' (the default) only the changed spans of those rows
+    are written, with 'full' all rows starting at the first changed row are cleared and printed again.
+
+    With coalesce, all input that is available is applied to the document before a single frame is painted, and
+    max_fps limits how often frames are painted at all. Without it, a frame is painted after every single value.
+
+    Text is typed, pasted and deleted at the cursor, a paragraph and character offset in it. The arrow keys move it by
+    a character or a display row, Home and End to the start and end of its display row. Cursor positions are mapped
+    to display rows and columns through the document tree, so moving and editing take the same time anywhere in the
+    document.
+
+    With viewport, the frame is never taller than the terminal. Only the display rows in the viewport are read from
+    the document and painted, starting at a scroll offset that is found through the row counts kept in the document
+    tree, so painting costs the same no matter how long the document is. The viewport follows the cursor at the end
+    of the document, until it is scrolled with Page Up/Page Down (a page) or Shift+Up/Shift+Down (a row). Any other
+    key brings the cursor back into view.
+
+    With open_path, the document starts out with the text of that file, which is memory-mapped and only loaded where
+    it is displayed or edited (so this is best combined with viewport), and the cursor at its start. Ctrl+S saves
+    the document to save_path, or to open_path if it is not given.
+
+    With journal_path, every edit is also appended to a Journal there. If a journal is already there, the document
+    is recovered from it instead, with the cursor at the last edit.
+
+    A resize, or replacing all of the text, wraps every paragraph again. Large texts are wrapped in parallel, on
+    reflow_workers processes once they hold reflow_min_chars characters (see Reflow).
+    """
+    document: Document
+    painter: PainterProtocol
+    cursor: tuple[int, int]
+    matching_slash: bool
+    slash_text: str
+
+    def __init__(self, term, replace_dict=None, special_slash_fn=None, replace_dict_add=True, overwrite=False,
+                 paint_mode='diff', sync_output=False, coalesce=True, max_fps: Optional[float] = None, instrument=None,
+                 paste_slash=False, viewport=False, open_path: Optional[str] = None,
+                 save_path: Optional[str] = None, slash_edit_fn=None, journal_path: Optional[str] = None,
+                 reflow_workers: Optional[int] = None, reflow_min_chars=1 << 18):
+        super().__init__(term, replace_dict, special_slash_fn, replace_dict_add, overwrite, instrument, paste_slash,
+                         slash_edit_fn, reflow_workers, reflow_min_chars)
+        self.document = Document(self.wrap_paragraph, self.term.width, append_fn=self.line_wrapper.append_wrap,
+                                 reflow_fn=self.reflow_paragraphs)
+        match paint_mode:
+            case 'diff':
+                self.painter = DiffPainter(self.term, sync_output=sync_output)
+            case 'full':
+                self.painter = FullPainter(self.term)
+            case _:
+                raise ValueError(f"Unknown paint mode {paint_mode}!")
+        self.coalesce = coalesce
+        self.frame_interval = 0 if max_fps is None else 1 / max_fps
+        self.last_paint = 0
+        self.viewport = viewport
+        # First display row of the painted frame, and the row the viewport was scrolled to (None to follow the cursor)
+        self.top = 0
+        self.scroll_to: Optional[int] = None
+        self.height = self.term.height
+        self.full_paint = False
+        # Frame row that the status line of the instrument was written over, which has to be painted again
+        self.status_row: Optional[int] = None
+        self.matching_slash = False
+        self.slash_text = '\\'
+        self.cursor = (0, 0)
+        # Column that vertical moves keep to, and the cursor position it was last used for
+        self.goal: Optional[tuple[tuple[int, int], int]] = None
+        self.save_path = open_path if save_path is None else save_path
+        self.newline = '\n'
+        if open_path is not None:
+            from sancty.mapped import MappedFile
+            source = MappedFile(open_path)
+            self.newline = source.newline
+            self.document.open(source)
+        self.journal: Optional['Journal'] = None
+        if journal_path is not None:
+            from sancty.journal import Journal
+            self.journal = Journal(journal_path)
+            cursor = self.journal.recover(self.document)
+            if cursor is None:
+                self.journal.start(open_path)
+            else:
+                self.cursor = cursor
+
+    def wrap_paragraph(self, text, width) -> list[str]:
+        return self.line_wrapper.wrap(text, width)
+
+    def reflow_paragraphs(self, texts, width) -> list[list[str]]:
+        return self.reflower.wrap(texts, width, lambda text: self.line_wrapper.wrap(text, width))
+
+    def print_terminal(self):
+        values = []
+        was_resizing = False
+        # An opened or recovered file is shown right away, instead of once the first key arrives
+        pending_paint = len(self.document) > 1 or self.document.chars > 0
+        try:
+            while not self.has_exited():
+                empty_queue, values = self.update_values(values)
+                if self.is_resizing():
+                    was_resizing = True
+                    if empty_queue:
+                        self.wait_values(0.003)
+                    continue
+                if was_resizing:
+                    if self.resize(self.term.height, self.term.width):
+                        pending_paint = True
+                    was_resizing = False
+                if len(values) > 0:
+                    if self.coalesce:
+                        while not empty_queue:
+                            received = len(values)
+                            empty_queue, values = self.update_values(values)
+                            if len(values) == received:
+                                break
+                        for val in values:
+                            self.handle_value(val)
+                        pending_paint = True
+                    else:
+                        for val in values:
+                            self.handle_value(val)
+                            self.paint()
+                    values = []
+                if pending_paint:
+                    wait = self.last_paint + self.frame_interval - tm.perf_counter()
+                    if wait <= 0:
+                        self.paint()
+                        pending_paint = False
+                    elif empty_queue:
+                        self.wait_values(min(wait, 0.003))
+                elif empty_queue:
+                    self.idle()
+                    self.wait_values(0.003)
+        except BaseException as bse:
+            self.exit_error(bse)
+        finally:
+            self.finish_terminal()
+
+    def idle(self):
+        """Compact the journal once it has grown large enough, while no values are waiting."""
+        if self.journal is not None and self.journal.compaction_due():
+            self.journal.compact(self.document, self.newline)
+
+    def exit_error(self, bse: BaseException):
+        """Exit after bse stopped printing the terminal, an ExternalError ends the program with it."""
+        self.do_exit()
+        print()
+        try:
+            raise bse
+        except ExternalError as vle:
+            print("External error...", flush=True)
+            raise SystemExit(vle)
+
+    def finish_terminal(self):
+        """Write out the report, the journal and stop the reflow pool, once printing the terminal has ended."""
+        self.instrument.dump()
+        if self.journal is not None:
+            self.journal.close()
+        close_pool()
+
+    def handle_value(self, val):
+        if isinstance(val, Resize):
+            self.resize(val.height, val.width)
+        elif isinstance(val, Stamp):
+            self.instrument.received(val)
+        elif isinstance(val, Paste):
+            self.scroll_to = None
+            self.paste(val.text)
+        elif self.viewport and val.code in (self.term.KEY_PGUP, self.term.KEY_PGDOWN, self.term.KEY_SUP,
+                                            self.term.KEY_SDOWN):
+            self.scroll_key(val.code)
+        elif val == '\x13':
+            self.save()
+        elif val and not val.is_sequence:
+            self.scroll_to = None
+            match val:
+                case "\\":
+                    if self.matching_slash:
+                        self.slash_text = "\\"
+                    self.matching_slash = True
+                case char if char.isspace():
+                    if self.matching_slash:
+                        self.matching_slash = False
+                        self.slash_text = "\\"
+                case _:
+                    if self.matching_slash:
+                        self.slash_text += val
+
+            self.insert_at_cursor(val)
+            if self.matching_slash:
+                self.check_slash_document()
+        elif val.is_sequence:
+            self.scroll_to = None
+            match val.code:
+                case self.term.KEY_BACKSPACE:
+                    self.backspace_document()
+                case self.term.KEY_DELETE:
+                    self.delete_document()
+                case self.term.KEY_ENTER:
+                    if self.matching_slash:
+                        self.matching_slash = False
+                        self.slash_text = "\\"
+                    self.insert_at_cursor('\n')
+                case (self.term.KEY_LEFT | self.term.KEY_RIGHT | self.term.KEY_UP | self.term.KEY_DOWN |
+                      self.term.KEY_HOME | self.term.KEY_END):
+                    self.move_key(val.code)
+
+    def move_key(self, code):
+        # Typing a slash command has to happen without moving in between
+        self.matching_slash = False
+        self.slash_text = "\\"
+        i, offset = self.cursor
+        text = self.document.paragraph(i)
+        match code:
+            case self.term.KEY_LEFT:
+                if offset > 0:
+                    offset -= 1
+                    while offset > 0 and char_width(text[offset]) == 0:
+                        offset -= 1
+                elif i > 0:
+                    i -= 1
+                    offset = len(self.document.paragraph(i))
+            case self.term.KEY_RIGHT:
+                if offset < len(text):
+                    offset += 1
+                    while offset < len(text) and char_width(text[offset]) == 0:
+                        offset += 1
+                elif i + 1 < len(self.document):
+                    i, offset = i + 1, 0
+            case self.term.KEY_UP | self.term.KEY_DOWN:
+                row, col = self.document.position(i, offset)
+                if self.goal is not None and self.goal[0] == self.cursor:
+                    col = self.goal[1]
+                row += -1 if code == self.term.KEY_UP else 1
+                if row < 0:
+                    offset = 0
+                elif row >= self.document.rows:
+                    i = len(self.document) - 1
+                    offset = len(self.document.paragraph(i))
+                else:
+                    i, offset = self.document.locate_position(row, col)
+                self.cursor = (i, offset)
+                self.goal = (self.cursor, col)
+                return
+            case self.term.KEY_HOME:
+                row, _col = self.document.position(i, offset)
+                i, offset = self.document.locate_position(row, 0)
+            case self.term.KEY_END:
+                row, _col = self.document.position(i, offset)
+                i, offset = self.document.locate_position(row, self.document.width)
+        self.cursor = (i, offset)
+
+    def log_edit(self, edit: Edit):
+        if self.journal is not None:
+            self.journal.append(edit)
+
+    def insert_at_cursor(self, text):
+        self.log_edit(Insert(*self.cursor, text))
+        self.cursor = self.document.insert_text(*self.cursor, text)
+
+    def cursor_to_end(self):
+        self.document.count_all()
+        last = len(self.document) - 1
+        self.cursor = (last, len(self.document.paragraph(last)))
+
+    def paste(self, text):
+        if self.paste_slash:
+            text = self.slash_trie.expand(text)
+        self.matching_slash = False
+        self.slash_text = "\\"
+        self.insert_at_cursor(text)
+
+    def backspace_document(self):
+        i, offset = self.cursor
+        text = self.document.paragraph(i)
+        if offset > 0:
+            before, self.slash_text, self.matching_slash = self.backspace(text[:offset], self.slash_text,
+                                                                          self.matching_slash)
+            self.log_edit(Delete(i, len(before), offset))
+            self.document.set_paragraph(i, before + text[offset:])
+            self.cursor = (i, len(before))
+        elif i > 0:
+            offset = len(self.document.paragraph(i - 1))
+            self.log_edit(Join(i - 1))
+            self.document.join_paragraphs(i - 1)
+            self.cursor = (i - 1, offset)
+
+    def delete_document(self):
+        i, offset = self.cursor
+        text = self.document.paragraph(i)
+        if offset < len(text):
+            end = offset + 1
+            while end < len(text) and char_width(text[end]) == 0:
+                end += 1
+            self.log_edit(Delete(i, offset, end))
+            self.document.set_paragraph(i, text[:offset] + text[end:])
+        elif i + 1 < len(self.document):
+            self.log_edit(Join(i))
+            self.document.join_paragraphs(i)
+
+    def check_slash_document(self):
+        try:
+            slash_match = self.slash_replace(self.slash_text)
+            if slash_match is None:
+                return
+            i, offset = self.cursor
+            text = self.document.paragraph(i)
+            before = text[:offset].removesuffix(self.slash_text)
+            if isinstance(slash_match, tuple) and slash_match:
+                if slash_match[0] == -1:
+                    self.apply_edit(Replace(['']))
+                elif slash_match[0] == -2:
+                    self.apply_edit(Replace(self.slash_trie.help_lines() + ['']))
+                else:
+                    self.log_edit(Delete(i, len(before), offset))
+                    self.document.set_paragraph(i, before + text[offset:])
+                    self.cursor = (i, len(before))
+                    edits = None
+                    if self.slash_edit_fn is not None:
+                        edits = self.slash_edit_fn(slash_match[0], DocumentView(self.document), self.cursor)
+                    if edits is not None:
+                        # Only the paragraphs that are edited are wrapped again
+                        for edit in edits:
+                            self.apply_edit(edit)
+                    else:
+                        render_array, paragraph_ends = self.document.to_render()
+                        new_render, new_paragraphs = self.special_slash_fn(slash_match[0], render_array,
+                                                                           paragraph_ends)
+                        self.apply_edit(Replace(paragraphs_from_render(new_render, new_paragraphs)))
+            else:
+                self.log_edit(Delete(i, len(before), offset))
+                self.log_edit(Insert(i, len(before), slash_match))
+                self.document.set_paragraph(i, before + slash_match + text[offset:])
+                self.cursor = (i, len(before) + len(slash_match))
+            self.slash_text = "\\"
+            self.matching_slash = False
+        except (ValueError, ArithmeticError, AttributeError, TypeError) as e:
+            print(e)
+            print("External slash error...", flush=True)
+            raise ExternalError(e)
+
+    def apply_edit(self, edit: Edit):
+        self.cursor = edit.apply(self.document, self.cursor)
+        self.log_edit(edit)
+
+    def save(self):
+        if self.save_path is not None:
+            from sancty.mapped import save_document
+            save_document(self.document, self.save_path, self.newline)
+            if self.journal is not None:
+                # The saved file holds all edits so far, so the journal starts over on top of it
+                self.journal.rebase(self.save_path)
+
+    def frame_rows(self) -> int:
+        """Rows the document takes up on screen, including a row for the cursor when the last line is full."""
+        if not self.document.counted:
+            # The last line is still to come
+            return self.document.rows
+        last_line = self.document.lines(len(self.document) - 1)[-1]
+        return self.document.rows + (1 if self.term.length(last_line) >= self.document.width else 0)
+
+    def cursor_position(self) -> tuple[int, int]:
+        """Frame row and column of the cursor."""
+        row, col = self.document.position(*self.cursor)
+        if col >= self.document.width:
+            # After a full line the cursor is shown at the start of the next row, which the frame has at its end
+            if row == self.document.rows - 1:
+                return row + 1, 0
+            return row, self.document.width - 1
+        return row, col
+
+    def viewport_rows(self, frame_rows, cursor_row) -> tuple[int, int]:
+        """First display row and number of rows of the part of the frame that is painted."""
+        if not self.viewport:
+            return 0, frame_rows
+        height = max(self.height, 1)
+        if self.scroll_to is None:
+            # Follow the cursor, scrolling no more than needed to show it
+            top = min(max(self.top, cursor_row - height + 1), cursor_row)
+        else:
+            top = self.scroll_to
+        top = min(max(top, 0), max(frame_rows - height, 0))
+        return top, min(frame_rows - top, height)
+
+    def scroll(self, rows):
+        """Scroll the viewport down by rows (up if negative), until the cursor is moved or the text is changed."""
+        frame_rows = self.frame_rows()
+        top, visible = self.viewport_rows(frame_rows, self.cursor_position()[0])
+        if top + rows + visible >= frame_rows and not self.document.counted:
+            self.document.count_rows(top + rows + visible)
+            frame_rows = self.frame_rows()
+        self.scroll_to = min(max(top + rows, 0), frame_rows - visible)
+
+    def scroll_key(self, code):
+        page = max(self.height - 1, 1)
+        match code:
+            case self.term.KEY_PGUP:
+                self.scroll(-page)
+            case self.term.KEY_PGDOWN:
+                self.scroll(page)
+            case self.term.KEY_SUP:
+                self.scroll(-1)
+            case self.term.KEY_SDOWN:
+                self.scroll(1)
+
+    def resize(self, height, width) -> bool:
+        """Adapt to a new terminal size, returns whether the frame has to be painted again."""
+        if width != self.document.width:
+            self.reflow(width)
+            return True
+        if self.viewport and height != self.height:
+            # The viewport changes size, but no display line changes
+            self.painter.reset(min(self.painter.cursor_row, height - 1))
+            self.height = height
+            self.full_paint = True
+            return True
+        return False
+
+    def reflow(self, width):
+        # The rows that are on screen now might have been reflowed by the terminal at the new width
+        displayed = 0
+        for k, line in enumerate(self.document.iter_lines(self.top)):
+            if k > self.painter.cursor_row:
+                break
+            displayed += max(1, -(-self.term.length(line) // width))
+        if self.viewport:
+            self.height = self.term.height
+            displayed = min(displayed, self.height)
+        self.painter.reset(max(displayed - 1, 0))
+        self.document.set_width(width)
+        self.instrument.count('rewraps')
+
+    def paint(self, from_row: Optional[int] = None):
+        self.last_paint = tm.perf_counter()
+        start = self.instrument.now()
+        frame_rows = self.frame_rows()
+        cursor_row, cursor_col = self.cursor_position()
+        top, visible = self.viewport_rows(frame_rows, cursor_row)
+        # Paragraphs that are not loaded take up a single row, until they are loaded because they are displayed
+        while self.document.load_rows(top, visible):
+            frame_rows = self.frame_rows()
+            cursor_row, cursor_col = self.cursor_position()
+            top, visible = self.viewport_rows(frame_rows, cursor_row)
+        damage = self.document.take_damage()
+        scrolled = top - self.top
+        self.top = top
+        if self.full_paint or (scrolled != 0 and not self.painter.scroll(scrolled)):
+            # Every row of the frame shows a different display row than before
+            self.full_paint = False
+            from_row = 0
+        elif scrolled > 0:
+            # The rows that scrolled into view at the bottom have not been painted yet
+            from_row = visible - scrolled if from_row is None else min(from_row, visible - scrolled)
+        if damage is not None:
+            damage = max(damage - top, 0)
+            from_row = damage if from_row is None else min(from_row, damage)
+        if self.status_row is not None:
+            status_row = max(self.status_row - max(scrolled, 0), 0)
+            from_row = status_row if from_row is None else min(from_row, status_row)
+            self.status_row = None
+        if top <= cursor_row < top + visible:
+            cursor = (cursor_row - top, cursor_col)
+        else:
+            # Scrolled away from the cursor, so it waits at the end of the frame
+            cursor = (visible - 1, self.term.length(next(self.document.iter_lines(top + visible - 1), '')))
+        if from_row is None:
+            bytes_before = self.painter.bytes_written
+            self.painter.move_cursor(cursor)
+            self.instrument.painted(start, self.painter.bytes_written - bytes_before)
+            return
+        from_row = min(from_row, self.painter.cursor_row, visible - 1)
+        rows = list(islice(self.document.iter_lines(top + from_row), visible - from_row))
+        if len(rows) < visible - from_row:
+            rows.append('')
+        bytes_before = self.painter.bytes_written
+        self.painter.paint(rows, from_row, cursor)
+        if self.instrument.enabled and self.record_paint(start, self.painter.bytes_written - bytes_before):
+            self.status_row = self.painter.forget_bottom()
@@ -0,0 +1,121 @@
+from sancty.document import Document
+
+
+def _check_position(document: Document, i, offset):
+    document.count_to(i)
+    if not 0 <= i < len(document):
+        raise ValueError(f"Edit of paragraph {i} is outside the document!")
+    if not 0 <= offset <= len(document.paragraph(i)):
+        raise ValueError(f"Edit at offset {offset} is outside paragraph {i}!")
+
+
+class Insert:
+    """Insert text, which may contain newlines, at a character offset in a paragraph."""
+    paragraph: int
+    offset: int
+    text: str
+
+    def __init__(self, paragraph, offset, text):
+        self.paragraph = paragraph
+        self.offset = offset
+        self.text = text
+
+    def apply(self, document: Document, cursor: tuple[int, int]) -> tuple[int, int]:
+        """Apply the edit to document and return where cursor ends up, text inserted at the cursor goes before it."""
+        _check_position(document, self.paragraph, self.offset)
+        end_i, end_offset = document.insert_text(self.paragraph, self.offset, self.text)
+        i, offset = cursor
+        if i == self.paragraph and offset >= self.offset:
+            return end_i, end_offset + offset - self.offset
+        if i > self.paragraph:
+            return i + end_i - self.paragraph, offset
+        return cursor
+
+    def __repr__(self):
+        return f"Insert({self.paragraph}, {self.offset}, {self.text!r})"
+
+
+class Delete:
+    """Delete the characters from start up to end in a paragraph."""
+    paragraph: int
+    start: int
+    end: int
+
+    def __init__(self, paragraph, start, end):
+        self.paragraph = paragraph
+        self.start = start
+        self.end = end
+
+    def apply(self, document: Document, cursor: tuple[int, int]) -> tuple[int, int]:
+        _check_position(document, self.paragraph, self.end)
+        if not 0 <= self.start <= self.end:
+            raise ValueError(f"Delete from {self.start} to {self.end} is not a range!")
+        text = document.paragraph(self.paragraph)
+        document.set_paragraph(self.paragraph, text[:self.start] + text[self.end:])
+        i, offset = cursor
+        if i == self.paragraph and offset > self.start:
+            return i, offset - (min(offset, self.end) - self.start)
+        return cursor
+
+    def __repr__(self):
+        return f"Delete({self.paragraph}, {self.start}, {self.end})"
+
+
+class Split(Insert):
+    """Break a paragraph in two at a character offset."""
+
+    def __init__(self, paragraph, offset):
+        super().__init__(paragraph, offset, '\n')
+
+    def __repr__(self):
+        return f"Split({self.paragraph}, {self.offset})"
+
+
+class Join:
+    """Join a paragraph with the paragraph that follows it."""
+    paragraph: int
+
+    def __init__(self, paragraph):
+        self.paragraph = paragraph
+
+    def apply(self, document: Document, cursor: tuple[int, int]) -> tuple[int, int]:
+        document.count_to(self.paragraph)
+        if not 0 <= self.paragraph < len(document) - 1:
+            raise ValueError(f"Paragraph {self.paragraph} has no paragraph after it to join!")
+        length = len(document.paragraph(self.paragraph))
+        document.join_paragraphs(self.paragraph)
+        i, offset = cursor
+        if i == self.paragraph + 1:
+            return self.paragraph, length + offset
+        if i > self.paragraph + 1:
+            return i - 1, offset
+        return cursor
+
+    def __repr__(self):
+        return f"Join({self.paragraph})"
+
+
+class Replace:
+    """Replace all paragraphs, which moves the cursor to the end."""
+    paragraphs: list[str]
+
+    def __init__(self, paragraphs):
+        self.paragraphs = paragraphs
+
+    def apply(self, document: Document, cursor: tuple[int, int]) -> tuple[int, int]:
+        document.replace_all(self.paragraphs)
+        last = len(document) - 1
+        return last, len(document.paragraph(last))
+
+    def __repr__(self):
+        return f"Replace({len(self.paragraphs)} paragraphs)"
+
+
+Edit = Insert | Delete | Join | Replace
+
+
+def apply_edits(document: Document, edits: list[Edit], cursor: tuple[int, int]) -> tuple[int, int]:
+    """Apply edits in order, each to the document as the edits before it left it, and return the moved cursor."""
+    for edit in edits:
+        cursor = edit.apply(document, cursor)
+    return cursor
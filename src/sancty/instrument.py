@@ -0,0 +1,196 @@
+import json
+from sancty.deps_types import tm, Optional
+from sancty.messages import Stamp
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers, like an HDR histogram.
+
+    Every power of two is split into 2 ** (sub_bits - 1) buckets, so recorded values are reported with a relative
+    error of at most 2 ** (1 - sub_bits). Recording is O(1) and memory only grows with the range of the values.
+    """
+
+    def __init__(self, sub_bits=5):
+        self.sub_bits = sub_bits
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.sub_bits - 1)) + (value >> shift)
+
+    def bucket_value(self, bucket: int) -> int:
+        """Highest value that falls into bucket."""
+        half = 1 << (self.sub_bits - 1)
+        if bucket < 2 * half:
+            return bucket
+        shift = bucket // half - 1
+        return ((bucket - shift * half + 1) << shift) - 1
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        bucket = self.bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, int(fraction * self.count + 0.5))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, scale=1.0) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.mean() / scale,
+            'min': (self.min or 0) / scale,
+            'p50': self.percentile(0.5) / scale,
+            'p90': self.percentile(0.9) / scale,
+            'p99': self.percentile(0.99) / scale,
+            'p999': self.percentile(0.999) / scale,
+            'max': (self.max or 0) / scale,
+        }
+
+
+class NullInstrument:
+    """Stands in for an Instrument when instrumentation is disabled, every hook does nothing."""
+    enabled = False
+
+    def now(self) -> int:
+        return 0
+
+    def count(self, name: str, amount=1):
+        pass
+
+    def dequeued(self, values: list):
+        pass
+
+    def received(self, stamp: Stamp, painted=False):
+        pass
+
+    def painted(self, start: int, bytes_written: int):
+        pass
+
+    def status_due(self) -> bool:
+        return False
+
+    def dump(self):
+        pass
+
+
+NULL_INSTRUMENT = NullInstrument()
+
+# Histograms of durations, recorded in nanoseconds
+STAGES = ('read_to_send', 'send_to_dequeue', 'dequeue_to_paint', 'key_to_paint', 'paint')
+
+
+class Instrument(NullInstrument):
+    """Collects timings of keys from the moment they were read until they were painted.
+
+    The reader adds a Stamp to every batch it sends (see Reader's stamp option), holding the monotonic time at which
+    every key in it was read, the time it was sent and the queue size at that moment. The renderer adds the time the
+    batch was dequeued and the time of the first paint after it was handled. Besides the histograms of these stages
+    and of paint durations, counters of keys, batches, frames, bytes written and rewraps are kept.
+
+    The report is written as JSON to path when dump is called, and with status_interval (in seconds) a summary is
+    shown on the bottom line of the terminal at most that often.
+    """
+    enabled = True
+
+    def __init__(self, path: Optional[str] = None, status_interval: Optional[float] = None):
+        self.path = path
+        self.status_interval = status_interval
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.queue_depth = Histogram()
+        self.counters = {'keys': 0, 'batches': 0, 'frames': 0, 'bytes': 0, 'rewraps': 0}
+        self.pending: list[Stamp] = []
+        self.last_status = 0
+
+    def now(self) -> int:
+        return tm.monotonic_ns()
+
+    def count(self, name: str, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def dequeued(self, values: list):
+        if values and isinstance(values[-1], Stamp):
+            values[-1].dequeued = tm.monotonic_ns()
+
+    def received(self, stamp: Stamp, painted=False):
+        self.counters['batches'] += 1
+        self.counters['keys'] += len(stamp.read)
+        self.queue_depth.record(stamp.queue_size)
+        read_to_send = self.histograms['read_to_send']
+        for read in stamp.read:
+            read_to_send.record(stamp.sent - read)
+        if stamp.dequeued is not None:
+            self.histograms['send_to_dequeue'].record(stamp.dequeued - stamp.sent)
+        if painted:
+            self.complete(stamp, tm.monotonic_ns())
+        else:
+            self.pending.append(stamp)
+
+    def complete(self, stamp: Stamp, now: int):
+        if stamp.dequeued is not None:
+            self.histograms['dequeue_to_paint'].record(now - stamp.dequeued)
+        key_to_paint = self.histograms['key_to_paint']
+        for read in stamp.read:
+            key_to_paint.record(now - read)
+
+    def painted(self, start: int, bytes_written: int):
+        now = tm.monotonic_ns()
+        if bytes_written > 0:
+            self.histograms['paint'].record(now - start)
+            self.counters['frames'] += 1
+            self.counters['bytes'] += bytes_written
+        for stamp in self.pending:
+            self.complete(stamp, now)
+        self.pending.clear()
+
+    def status_due(self) -> bool:
+        if self.status_interval is None:
+            return False
+        now = tm.monotonic()
+        if now - self.last_status < self.status_interval:
+            return False
+        self.last_status = now
+        return True
+
+    def status_line(self) -> str:
+        key_to_paint = self.histograms['key_to_paint']
+        paint = self.histograms['paint']
+        return (f"keys {self.counters['keys']} key->paint p50 {key_to_paint.percentile(0.5) / 1e3:.0f}us "
+                f"p99 {key_to_paint.percentile(0.99) / 1e3:.0f}us paint p50 {paint.percentile(0.5) / 1e3:.0f}us "
+                f"queue max {self.queue_depth.max or 0} bytes {self.counters['bytes']} "
+                f"rewraps {self.counters['rewraps']}")
+
+    def report(self) -> dict:
+        return {
+            'stages_us': {stage: histogram.summary(scale=1e3) for stage, histogram in self.histograms.items()},
+            'queue_depth': self.queue_depth.summary(),
+            'counters': dict(self.counters),
+        }
+
+    def dump(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,296 @@
+import os
+import struct
+import threading
+import zlib
+from sancty.deps_types import tm, Optional
+from sancty.document import Document, DocumentSnapshot
+from sancty.edits import Edit, Insert, Delete, Join, Replace
+from sancty.mapped import MappedFile, save_document
+
+_MAGIC = b'SNCJ'
+_HEADER = struct.Struct('<4sIQqH')
+_RECORD = struct.Struct('<BI')
+_CRC = struct.Struct('<I')
+_INSERT = struct.Struct('<II')
+_DELETE = struct.Struct('<III')
+_JOIN = struct.Struct('<I')
+
+_KIND_INSERT = 0
+_KIND_DELETE = 1
+_KIND_JOIN = 2
+_KIND_REPLACE = 3
+
+
+def encode_edit(edit: Edit) -> bytes:
+    """Record of a single edit, with a checksum so that a record that was only partly written is recognized."""
+    match edit:
+        case Insert():
+            kind, payload = _KIND_INSERT, _INSERT.pack(edit.paragraph, edit.offset) + edit.text.encode('utf-8')
+        case Delete():
+            kind, payload = _KIND_DELETE, _DELETE.pack(edit.paragraph, edit.start, edit.end)
+        case Join():
+            kind, payload = _KIND_JOIN, _JOIN.pack(edit.paragraph)
+        case Replace():
+            kind, payload = _KIND_REPLACE, '\n'.join(edit.paragraphs).encode('utf-8')
+        case _:
+            raise ValueError(f"Cannot journal {edit}!")
+    record = _RECORD.pack(kind, len(payload)) + payload
+    return record + _CRC.pack(zlib.crc32(record))
+
+
+def decode_edit(kind, payload) -> Edit:
+    if kind == _KIND_INSERT:
+        return Insert(*_INSERT.unpack_from(payload), bytes(payload[_INSERT.size:]).decode('utf-8'))
+    if kind == _KIND_DELETE:
+        return Delete(*_DELETE.unpack(payload))
+    if kind == _KIND_JOIN:
+        return Join(*_JOIN.unpack(payload))
+    if kind == _KIND_REPLACE:
+        return Replace(bytes(payload).decode('utf-8').split('\n'))
+    raise ValueError(f"Unknown journal record kind {kind}!")
+
+
+def read_records(data, start) -> tuple[list[Edit], int]:
+    """Edits of the complete records in data from offset start, and the offset where those records end."""
+    edits = []
+    end = len(data)
+    pos = start
+    while pos + _RECORD.size <= end:
+        kind, length = _RECORD.unpack_from(data, pos)
+        record_end = pos + _RECORD.size + length
+        if record_end + _CRC.size > end or _CRC.unpack_from(data, record_end)[0] != zlib.crc32(data[pos:record_end]):
+            break
+        edits.append(decode_edit(kind, data[pos + _RECORD.size:record_end]))
+        pos = record_end + _CRC.size
+    return edits, pos
+
+
+def _edit_position(edit: Edit) -> tuple[int, int]:
+    """Position that applying edit moves to where the edit ended."""
+    match edit:
+        case Insert():
+            return edit.paragraph, edit.offset
+        case Delete():
+            return edit.paragraph, edit.end
+        case Join():
+            return edit.paragraph + 1, 0
+    return 0, 0
+
+
+class Journal:
+    """Append-only log of the edits made to a document, on top of a base text file.
+
+    The base is the file the document was opened from or last saved to, or a snapshot of the document that was
+    written when the log was compacted, and is recognized by its size and modification time. Edits are encoded into
+    a buffer in memory, which a background thread writes out and syncs to disk with a single fsync once sync_interval
+    seconds passed since the first edit in it, or once it holds sync_bytes. After a crash, recover opens the base
+    (memory-mapped, like any opened file) and replays the edits in the log, so it takes time proportional to the log
+    and not to the document. Once the log grows past compact_bytes, compact takes a snapshot of the document, which
+    the background thread writes to a new snapshot file before it starts an empty log on top of it. Edits appended
+    in the meantime are kept in memory until they can go into that new log.
+    """
+    path: str
+    base_path: Optional[str]
+    size: int
+
+    def __init__(self, path, sync_interval=0.05, sync_bytes=1 << 16, compact_bytes=1 << 23):
+        self.path = os.path.abspath(path)
+        self.sync_interval = sync_interval
+        self.sync_bytes = sync_bytes
+        self.compact_bytes = compact_bytes
+        self.base_path = None
+        # Snapshots are numbered, so that a new one never replaces the one the log on disk is based on
+        self.generation = 0
+        self.size = 0
+        self._file = None
+        self._pending = bytearray()
+        self._pending_since: Optional[float] = None
+        # Snapshot to compact the log to, and the edits that were made before it was taken
+        self._compaction: Optional[tuple[DocumentSnapshot, str, bytes]] = None
+        self._compacting = False
+        self._closed = False
+        self._condition = threading.Condition()
+        # Held while taking the buffer and writing it, so that buffers are written in order
+        self._file_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _header(self, base_path) -> bytes:
+        if base_path is None:
+            size, mtime = 0, 0
+        else:
+            stat = os.stat(base_path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        path = b'' if base_path is None else os.fsencode(base_path)
+        header = _HEADER.pack(_MAGIC, self.generation, size, mtime, len(path)) + path
+        return header + _CRC.pack(zlib.crc32(header))
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name='sancty-journal', daemon=True)
+            self._thread.start()
+
+    def start(self, base_path: Optional[str] = None):
+        """Start an empty log on top of base_path (or an empty document), replacing any log at path."""
+        with self._file_lock:
+            self._write_log(None if base_path is None else os.path.abspath(base_path))
+        self._start_thread()
+
+    def _write_log(self, base_path):
+        """Replace the log with one that only has a header, which is synced before it replaces the old one."""
+        header = self._header(base_path)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'ab')
+        old_base = self.base_path
+        self.base_path = base_path
+        self.size = len(header)
+        if old_base is not None and old_base != base_path and self._is_snapshot(old_base):
+            os.unlink(old_base)
+
+    def _is_snapshot(self, path) -> bool:
+        return path.startswith(self.path + '.') and path.endswith('.snapshot')
+
+    def recover(self, document: Document) -> Optional[tuple[int, int]]:
+        """Rebuild document from the log at path if there is one, and return the position of the last edit in it.
+
+        A record at the end that was only partly written is cut off, new edits are appended after the others.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size + _CRC.size or data[:4] != _MAGIC:
+            raise ValueError(f"{self.path} is not a journal!")
+        _magic, generation, size, mtime, path_length = _HEADER.unpack_from(data)
+        header_end = _HEADER.size + path_length
+        if _CRC.unpack_from(data, header_end)[0] != zlib.crc32(data[:header_end]):
+            raise ValueError(f"Header of journal {self.path} is damaged!")
+        base_path = os.fsdecode(data[_HEADER.size:header_end]) if path_length else None
+        if base_path is None:
+            document.clear()
+        else:
+            stat = os.stat(base_path)
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                raise ValueError(f"Base {base_path} of journal {self.path} has changed since it was written!")
+            document.open(MappedFile(base_path))
+
+        edits, end = read_records(data, header_end + _CRC.size)
+        cursor = None
+        for edit in edits:
+            cursor = edit.apply(document, _edit_position(edit))
+        if cursor is None:
+            cursor = (0, 0)
+
+        self.generation = generation
+        self.base_path = base_path
+        self.size = end
+        self._file = open(self.path, 'r+b')
+        self._file.truncate(end)
+        self._file.seek(end)
+        self._start_thread()
+        return cursor
+
+    def append(self, edit: Edit):
+        record = encode_edit(edit)
+        with self._condition:
+            self._pending += record
+            if self._pending_since is None:
+                self._pending_since = tm.monotonic()
+                self._condition.notify()
+            elif len(self._pending) >= self.sync_bytes:
+                self._condition.notify()
+
+    def _flush_due(self) -> bool:
+        return self._pending_since is not None and (len(self._pending) >= self.sync_bytes or
+                                                    tm.monotonic() - self._pending_since >= self.sync_interval)
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._flush_due() and self._compaction is None:
+                    wait = None
+                    if self._pending_since is not None:
+                        wait = max(self._pending_since + self.sync_interval - tm.monotonic(), 0)
+                    self._condition.wait(wait)
+                if self._closed:
+                    return
+            self.sync()
+
+    def sync(self):
+        """Write and sync all edits that were appended, after finishing a compaction that is under way."""
+        with self._file_lock:
+            self._finish_compaction()
+            with self._condition:
+                data = bytes(self._pending)
+                self._pending.clear()
+                self._pending_since = None
+            if data and self._file is not None:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.size += len(data)
+
+    def compaction_due(self) -> bool:
+        return (self._compaction is None and not self._compacting and
+                self.size + len(self._pending) >= self.compact_bytes)
+
+    def compact(self, document: Document, newline='\n'):
+        """Have the background thread write document as it is now to a new snapshot and start a log on top of it.
+
+        The snapshot is written with newline, which should be the one of the opened file, as the paragraphs that were
+        not loaded keep their line endings. The calling thread only takes the snapshot, it does not wait for any file
+        to be written.
+        """
+        snapshot = document.snapshot()
+        with self._condition:
+            before = self._compaction[2] if self._compaction is not None else b''
+            self._compaction = (snapshot, newline, before + bytes(self._pending))
+            self._pending.clear()
+            self._pending_since = None
+            self._condition.notify()
+        self._start_thread()
+
+    def _finish_compaction(self):
+        """Write the snapshot of a compaction that is under way, while holding the file lock."""
+        with self._condition:
+            if self._compaction is None:
+                return
+            snapshot, newline, before = self._compaction
+            self._compaction = None
+            self._compacting = True
+        try:
+            # The edits made before the snapshot are synced first, so that they survive a crash while it is written
+            if before and self._file is not None:
+                self._file.write(before)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.size += len(before)
+            self.generation += 1
+            snapshot_path = f'{self.path}.{self.generation}.snapshot'
+            save_document(snapshot, snapshot_path, newline)
+            self._write_log(snapshot_path)
+        finally:
+            self._compacting = False
+
+    def rebase(self, base_path: str):
+        """Start an empty log on top of base_path, once the document was saved to it."""
+        self.sync()
+        with self._file_lock:
+            self._write_log(os.path.abspath(base_path))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
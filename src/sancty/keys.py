@@ -0,0 +1,96 @@
+import os
+import re
+from blessed.keyboard import Keystroke
+from sancty.deps_types import Terminal
+
+
+class KeyDecoder:
+    """Decodes text read from a terminal into keys, like repeated calls of Terminal.inkey, in a single pass.
+
+    The key sequences of the terminal are compiled once into a single pattern, longest first, so that every sequence
+    is found with one match. Runs of characters that cannot start a sequence are split into keys without matching.
+    """
+
+    def __init__(self, term: Terminal):
+        self.term = term
+        self.codes = term._keycodes
+        self.keymap = term._keymap
+        self.prefixes = term._keymap_prefixes
+        sequences = sorted(self.keymap, key=len, reverse=True)
+        self.sequence = re.compile('|'.join(map(re.escape, sequences)))
+        starts = ''.join(sorted({sequence[0] for sequence in sequences}))
+        self.plain = re.compile(f'[^{re.escape(starts)}]+')
+        self.paste_begin = getattr(term, 'KEY_PASTE_BEGIN', None)
+
+    def decode(self, text: str, final=False) -> tuple[list[Keystroke], str]:
+        """Keys of text, and the rest of text that is left undecoded.
+
+        Decoding stops at a proper prefix of a sequence at the end of text (like a lone escape, which might be
+        followed by the rest of the sequence) unless final, and right after a key that starts a bracketed paste, so
+        that the pasted text is not decoded into keys.
+        """
+        keys = []
+        pos = 0
+        end = len(text)
+        while pos < end:
+            plain = self.plain.match(text, pos)
+            if plain is not None:
+                keys += map(Keystroke, plain.group())
+                pos = plain.end()
+                continue
+            if not final and text[pos:] in self.prefixes:
+                break
+            match = self.sequence.match(text, pos)
+            if match is None:
+                keys.append(Keystroke(text[pos]))
+                pos += 1
+                continue
+            sequence = match.group()
+            code = self.keymap[sequence]
+            keys.append(Keystroke(ucs=sequence, code=code, name=self.codes[code]))
+            pos = match.end()
+            if code == self.paste_begin:
+                break
+        return keys, text[pos:]
+
+
+def read_keys(term: Terminal, decoder: KeyDecoder, timeout=None, esc_delay=0.35) -> list[Keystroke]:
+    """All keys that are available within timeout seconds, read with as few reads as possible.
+
+    Everything that is available is read at once and decoded in a single pass. Text that was buffered with
+    Terminal.ungetch comes first, and text that is left undecoded is buffered again. A sequence that is incomplete
+    at the end is given esc_delay seconds to complete, after which it is decoded as it is, like Terminal.inkey does.
+    """
+    text = ''
+    while term._keyboard_buf:
+        text += term._keyboard_buf.pop()
+    if not text and not term.kbhit(timeout=timeout):
+        return []
+    text += _read_available(term)
+    keys, rest = decoder.decode(text)
+    while rest and not keys and term.kbhit(timeout=esc_delay):
+        keys, rest = decoder.decode(rest + _read_available(term))
+    if rest and not keys:
+        keys, rest = decoder.decode(rest, final=True)
+    term.ungetch(rest)
+    return keys
+
+
+def read_text(term: Terminal) -> str:
+    """Text that was buffered with Terminal.ungetch, followed by all text that is available, without waiting."""
+    text = ''
+    while term._keyboard_buf:
+        text += term._keyboard_buf.pop()
+    return text + _read_available(term)
+
+
+def _read_available(term: Terminal) -> str:
+    if term._keyboard_fd is None:
+        return ''
+    text = ''
+    while term.kbhit(timeout=0):
+        data = os.read(term._keyboard_fd, 1 << 16)
+        if not data:
+            break
+        text += term._keyboard_decoder.decode(data, final=False)
+    return text
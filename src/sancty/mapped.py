@@ -0,0 +1,128 @@
+import os
+import mmap
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_right
+from sancty.document import Document, DocumentSnapshot
+
+
+class MappedFile:
+    """Read-only memory map of a text file, of which paragraphs (lines) are decoded one at a time.
+
+    The index of the paragraphs is built in two levels, chunk by chunk and only as far as it is needed. The number of
+    newlines in every chunk is counted first, which is enough to know the number of paragraphs and in which chunk a
+    paragraph starts. The offsets of the newlines in a chunk are only found once a paragraph in it is read. Bytes that
+    are not valid UTF-8 are decoded as replacement characters, and a file that uses '\\r\\n' gets that as its newline.
+    """
+    newline: str
+
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # Empty files cannot be mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self.size = size
+        # Number of newlines up to the end of every chunk that has been counted
+        self._counts: list[int] = []
+        # Offsets of the newlines in a chunk, for the chunks that have been read from
+        self._ends: dict[int, array] = {}
+        first = self.newline_offset(0)
+        self.newline = '\r\n' if first is not None and first > 0 and self.data[first - 1] == ord('\r') else '\n'
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def _count_chunks(self, newlines=None):
+        """Count newlines in chunks until more than newlines of them are counted, or all of them without newlines."""
+        chunks = -(-self.size // self.chunk_size)
+        while len(self._counts) < chunks and (newlines is None or not self._counts or self._counts[-1] <= newlines):
+            start = len(self._counts) * self.chunk_size
+            total = self._counts[-1] if self._counts else 0
+            self._counts.append(total + self.data[start:start + self.chunk_size].count(b'\n'))
+
+    def _chunk_ends(self, chunk) -> array:
+        ends = self._ends.get(chunk)
+        if ends is None:
+            ends = self._ends[chunk] = array('q')
+            end = min((chunk + 1) * self.chunk_size, self.size)
+            offset = self.data.find(b'\n', chunk * self.chunk_size, end)
+            while offset != -1:
+                ends.append(offset)
+                offset = self.data.find(b'\n', offset + 1, end)
+        return ends
+
+    def newline_offset(self, k):
+        """Offset of the k-th newline, or None if there are not that many."""
+        self._count_chunks(k)
+        if not self._counts or self._counts[-1] <= k:
+            return None
+        chunk = bisect_right(self._counts, k)
+        before = self._counts[chunk - 1] if chunk > 0 else 0
+        return self._chunk_ends(chunk)[k - before]
+
+    def count_paragraphs(self, at_least) -> tuple[int, bool]:
+        """Count chunks until at least at_least paragraphs are known to be complete, or all chunks are counted.
+
+        Returns the number of paragraphs that are known, and whether that is all of them.
+        """
+        self._count_chunks(at_least - 1)
+        if len(self._counts) < -(-self.size // self.chunk_size):
+            return self._counts[-1], False
+        return (self._counts[-1] if self._counts else 0) + 1, True
+
+    def __len__(self) -> int:
+        self._count_chunks()
+        return (self._counts[-1] if self._counts else 0) + 1
+
+    def offsets(self, i) -> tuple[int, int]:
+        """Byte offsets of the start and end of paragraph i, without its newline."""
+        start = 0 if i == 0 else self.newline_offset(i - 1) + 1
+        end = self.newline_offset(i)
+        if end is None:
+            return start, self.size
+        if self.newline == '\r\n' and end > start and self.data[end - 1] == ord('\r'):
+            end -= 1
+        return start, end
+
+    def span_offsets(self, first, count) -> tuple[int, int]:
+        """Byte offsets of the start of paragraph first and the end of the paragraph count - 1 after it."""
+        return self.offsets(first)[0], self.offsets(first + count - 1)[1]
+
+    def raw(self, first, count) -> memoryview:
+        """Bytes of count paragraphs starting at paragraph first, with the newlines between them."""
+        start, end = self.span_offsets(first, count)
+        return memoryview(self.data)[start:end]
+
+    def paragraph(self, i) -> str:
+        start, end = self.offsets(i)
+        return self.data[start:end].decode('utf-8', errors='replace')
+
+
+def save_document(document: Document | DocumentSnapshot, path, newline='\n'):
+    """Write the text of document to path through a temporary file next to it, which then replaces path.
+
+    The text is streamed out, so it is never held in memory as a whole.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            document.write(f, newline)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            # The temporary file is only readable by its owner, a new file gets the usual permissions
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
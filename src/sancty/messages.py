@@ -0,0 +1,39 @@
+class Resize:
+    """Sent by a reader once the terminal has settled on a new size."""
+    height: int
+    width: int
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+
+    def __repr__(self):
+        return f"Resize({self.height}, {self.width})"
+
+
+class Paste:
+    """Sent by a reader for a bracketed paste, with all of the pasted text and newlines as '\\n'."""
+    text: str
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f"Paste({len(self.text)} chars)"
+
+
+class Stamp:
+    """Sent by a reader at the end of a batch when stamping is enabled, with the monotonic times of its keys."""
+    read: list[int]
+    sent: int
+    queue_size: int
+    dequeued: int | None
+
+    def __init__(self, read, sent, queue_size):
+        self.read = read
+        self.sent = sent
+        self.queue_size = queue_size
+        self.dequeued = None
+
+    def __repr__(self):
+        return f"Stamp({len(self.read)} keys, sent {self.sent})"
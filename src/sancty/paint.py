@@ -0,0 +1,198 @@
+import sys
+from sancty.deps_types import Terminal, Protocol, Optional
+from sancty.width import char_width
+
+SYNC_BEGIN = '\x1b[?2026h'
+SYNC_END = '\x1b[?2026l'
+
+
+class PainterProtocol(Protocol):
+    term: Terminal
+    cursor_row: int
+    bytes_written: int
+
+    def paint(self, rows: list[str], from_row: int, cursor: tuple[int, int]) -> None:
+        """Paint frame rows starting at from_row, with the frame ending after the last of these rows."""
+
+    def reset(self, cursor_row: int) -> None:
+        """Forget the painted frame, the cursor is now cursor_row rows below the top of the frame."""
+
+    def move_cursor(self, cursor: tuple[int, int]) -> None:
+        """Move the cursor to a row and column of the painted frame."""
+
+    def scroll(self, rows: int) -> bool:
+        """Move the painted frame up by rows, returns False if the whole frame has to be painted again instead."""
+
+    def forget_bottom(self) -> int:
+        """Forget the bottom row of the terminal, which was written over, returns the row to paint again from."""
+
+
+class FullPainter(PainterProtocol):
+    """Clears everything starting at the first changed row and prints all rows after it."""
+
+    def __init__(self, term, stream=None):
+        self.term = term
+        self.stream = sys.stdout if stream is None else stream
+        self.cursor_row = 0
+        self.end_row = 1
+        self.bytes_written = 0
+
+    def paint(self, rows: list[str], from_row: int, cursor: tuple[int, int]) -> None:
+        move_up = self.cursor_row - from_row
+        move_up = '' if move_up <= 0 else self.term.move_up(move_up)
+        start = self.term.clear_bol + move_up + self.term.move_x(0)
+        print(start, end='', flush=True, file=self.stream)
+
+        text = self.term.clear_eos + "\n\r".join(rows)
+        print(text, end='', flush=True, file=self.stream)
+        self.cursor_row = from_row + len(rows) - 1
+        self.end_row = from_row + len(rows)
+        self.bytes_written += len(start.encode()) + len(text.encode())
+        if cursor != (self.cursor_row, self.term.length(rows[-1])):
+            self.move_cursor(cursor)
+
+    def move_cursor(self, cursor: tuple[int, int]) -> None:
+        row, col = cursor
+        move = ''
+        if row < self.cursor_row:
+            move = self.term.move_up(self.cursor_row - row)
+        elif row > self.cursor_row:
+            move = self.term.move_down(row - self.cursor_row)
+        move += self.term.move_x(col)
+        print(move, end='', flush=True, file=self.stream)
+        self.cursor_row = row
+        self.bytes_written += len(move.encode())
+
+    def reset(self, cursor_row: int) -> None:
+        self.cursor_row = cursor_row
+        self.end_row = cursor_row + 1
+
+    def scroll(self, rows: int) -> bool:
+        return False
+
+    def forget_bottom(self) -> int:
+        # Everything below the frame is cleared when it is painted, only its last row can be on the bottom row
+        return self.end_row - 1
+
+
+class DiffPainter(PainterProtocol):
+    """Keeps the last painted frame and only writes the spans of rows that changed, in a single write.
+
+    With sync_output, every write is wrapped in synchronized output mode (DEC private mode 2026), so that
+    terminals that support it show each frame at once.
+    """
+    frame: list[Optional[str]]
+
+    def __init__(self, term, stream=None, sync_output=False):
+        self.term = term
+        self.stream = sys.stdout if stream is None else stream
+        self.sync_output = sync_output
+        self.frame = []
+        self.cursor_row = 0
+        self.cursor_col = 0
+        # Rows below the top of the frame that exist on screen, moving down further requires new lines
+        self.created_rows = 1
+        self.width = term.width
+        self.clear = False
+        self.pending = []
+        self.bytes_written = 0
+
+    def reset(self, cursor_row: int) -> None:
+        self.frame = []
+        self.cursor_row = cursor_row
+        self.cursor_col = 0
+        self.created_rows = cursor_row + 1
+        self.clear = True
+
+    def scroll(self, rows: int) -> bool:
+        # Only when the frame reaches the bottom of the terminal do new lines there scroll the whole frame up
+        if self.clear or not 0 < rows < self.created_rows or self.created_rows != self.term.height:
+            return False
+        self.move_to(self.pending, self.created_rows - 1, 0)
+        self.pending.append('\n' * rows)
+        del self.frame[:rows]
+        return True
+
+    def forget_bottom(self) -> int:
+        # The bottom row is the last row on screen once the frame reached it, otherwise it is below the frame
+        row = self.created_rows - 1
+        if row < len(self.frame):
+            self.frame[row] = None
+        return row
+
+    def move_to(self, out: list, row: int, col: int):
+        if row < self.cursor_row:
+            out.append(self.term.move_up(self.cursor_row - row))
+        elif row > self.cursor_row:
+            existing = min(row, self.created_rows - 1)
+            if existing > self.cursor_row:
+                out.append(self.term.move_down(existing - self.cursor_row))
+            if row > existing:
+                out.append('\n\r' * (row - existing))
+                self.cursor_col = 0
+                self.created_rows = row + 1
+        # After writing up to the last column the cursor is waiting to wrap, so its column is not reliable
+        if col != self.cursor_col or self.cursor_col >= self.width:
+            out.append('\r' if col == 0 else self.term.move_x(col))
+        self.cursor_row = row
+        self.cursor_col = col
+
+    def common_prefix(self, old: str, new: str) -> int:
+        if '\x1b' in old or '\x1b' in new:
+            return 0
+        n = min(len(old), len(new))
+        p = 0
+        while p < n and old[p] == new[p]:
+            p += 1
+        # Never start writing in the middle of a character that is combined with the one before it
+        while 0 < p < len(new) and char_width(new[p]) == 0:
+            p -= 1
+        return p
+
+    def move_cursor(self, cursor: tuple[int, int]) -> None:
+        out = self.pending
+        self.pending = []
+        self.move_to(out, *cursor)
+        self.write(out)
+
+    def paint(self, rows: list[str], from_row: int, cursor: tuple[int, int]) -> None:
+        out = self.pending
+        self.pending = []
+        self.width = width = self.term.width
+        if self.clear:
+            self.move_to(out, 0, 0)
+            out.append(self.term.clear_eos)
+            self.clear = False
+        old_frame = self.frame
+        for k, new in enumerate(rows):
+            row = from_row + k
+            old = old_frame[row] if row < len(old_frame) else None
+            if new == old:
+                continue
+            p = 0 if old is None else self.common_prefix(old, new)
+            self.move_to(out, row, self.term.length(new[:p]))
+            out.append(new[p:])
+            new_length = self.term.length(new)
+            # What a row showed is not known when it was not part of the frame or was forgotten
+            if new_length < width and (old is None or new_length < self.term.length(old)):
+                out.append(self.term.clear_eol)
+            self.cursor_col = new_length
+        end_row = from_row + len(rows)
+        if end_row < len(old_frame):
+            self.move_to(out, end_row, 0)
+            out.append(self.term.clear_eos)
+        del old_frame[from_row:]
+        old_frame.extend(rows)
+
+        self.move_to(out, *cursor)
+        self.write(out)
+
+    def write(self, out: list):
+        if not out:
+            return
+        text = ''.join(out)
+        if self.sync_output:
+            text = SYNC_BEGIN + text + SYNC_END
+        self.stream.write(text)
+        self.stream.flush()
+        self.bytes_written += len(text.encode())
@@ -1,5 +1,15 @@
+import os
+from bisect import bisect_right
+from collections import OrderedDict
 from blessed import sequences, terminal
+from blessed.keyboard import get_leading_prefixes
 from cwcwidth import wcswidth
+from sancty.width import has_control, text_width, display_width, cumulative_widths
+
+BRACKETED_PASTE_ON = '\x1b[?2004h'
+BRACKETED_PASTE_OFF = '\x1b[?2004l'
+PASTE_BEGIN = '\x1b[200~'
+PASTE_END = '\x1b[201~'
 
 
 class PatchedSequence(sequences.Sequence):
@@ -7,6 +17,100 @@ class PatchedSequence(sequences.Sequence):
         return wcswidth(self.padd(strip=True))
 
 
+class PatchedTextWrapper(sequences.SequenceTextWrapper):
+    """SequenceTextWrapper that measures chunks without sequences directly, instead of parsing them first."""
+
+    def chunk_length(self, chunk: str) -> int:
+        if has_control(chunk):
+            return sequences.Sequence(chunk, self.term).length()
+        return display_width(chunk)
+
+    def chunk_blank(self, chunk: str) -> bool:
+        if has_control(chunk):
+            return sequences.Sequence(chunk, self.term).strip() == ''
+        return chunk.strip() == ''
+
+    def _wrap_chunks(self, chunks):
+        lines = []
+        if self.width <= 0 or not isinstance(self.width, int):
+            raise ValueError(
+                "invalid width {0!r}({1!r}) (must be integer > 0)"
+                .format(self.width, type(self.width)))
+
+        drop_whitespace = self.drop_whitespace
+        chunks.reverse()
+        while chunks:
+            cur_line = []
+            cur_len = 0
+            indent = self.subsequent_indent if lines else self.initial_indent
+            width = self.width - len(indent)
+            if drop_whitespace and lines and self.chunk_blank(chunks[-1]):
+                del chunks[-1]
+            while chunks:
+                chunk_len = self.chunk_length(chunks[-1])
+                if cur_len + chunk_len > width:
+                    break
+                cur_line.append(chunks.pop())
+                cur_len += chunk_len
+            if chunks and self.chunk_length(chunks[-1]) > width:
+                self._handle_long_word(chunks, cur_line, cur_len, width)
+            if drop_whitespace and cur_line and self.chunk_blank(cur_line[-1]):
+                del cur_line[-1]
+            if cur_line:
+                lines.append(indent + ''.join(cur_line))
+        return lines
+
+    def _handle_long_word(self, reversed_chunks, cur_line, cur_len, width):
+        chunk = reversed_chunks[-1]
+        if not self.break_long_words or has_control(chunk):
+            return super()._handle_long_word(reversed_chunks, cur_line, cur_len, width)
+        space_left = 1 if width < 1 else width - cur_len
+        # Prefix widths never decrease, so the longest prefix that fits can be found by bisection
+        idx = bisect_right(cumulative_widths(chunk), space_left)
+        cur_line.append(chunk[:idx])
+        reversed_chunks[-1] = chunk[idx:]
+
+
 class Terminal(terminal.Terminal):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Bracketed paste markers are keys of their own, instead of an escape followed by text
+        self.KEY_PASTE_BEGIN = max(self._keycodes) + 1
+        self.KEY_PASTE_END = self.KEY_PASTE_BEGIN + 1
+        self._keycodes[self.KEY_PASTE_BEGIN] = 'KEY_PASTE_BEGIN'
+        self._keycodes[self.KEY_PASTE_END] = 'KEY_PASTE_END'
+        keymap = [*self._keymap.items(), (PASTE_BEGIN, self.KEY_PASTE_BEGIN), (PASTE_END, self.KEY_PASTE_END)]
+        # Longer sequences have to be tried first
+        self._keymap = OrderedDict(sorted(keymap, key=lambda item: len(item[0]), reverse=True))
+        self._keymap_prefixes = get_leading_prefixes(self._keymap)
+
+    def read_paste(self, timeout=1.0) -> str:
+        """Read the text of a bracketed paste that has started, all at once and without decoding any keys in it.
+
+        Reading stops at the end marker, or when nothing arrived for timeout seconds.
+        """
+        text = ''
+        while self._keyboard_buf:
+            text += self._keyboard_buf.pop()
+        end = text.find(PASTE_END)
+        while end == -1 and self.kbhit(timeout=timeout):
+            searched = max(0, len(text) - len(PASTE_END))
+            text += self._keyboard_decoder.decode(os.read(self._keyboard_fd, 1 << 16), final=False)
+            end = text.find(PASTE_END, searched)
+        if end == -1:
+            return text
+        self.ungetch(text[end + len(PASTE_END):])
+        return text[:end]
+
     def length(self, text: str) -> int:
-        return PatchedSequence(text, self).length()
+        if has_control(text):
+            return PatchedSequence(text, self).length()
+        return text_width(text)
+
+    def wrap(self, text, width=None, **kwargs):
+        width = self.width if width is None else width
+        wrapper = PatchedTextWrapper(width=width, term=self, **kwargs)
+        lines = []
+        for line in text.splitlines():
+            lines.extend(iter(wrapper.wrap(line)) if line.strip() else ('',))
+        return lines
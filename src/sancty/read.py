@@ -1,4 +1,8 @@
-from sancty.deps_types import Terminal, tm, Protocol
+import signal
+from sancty.deps_types import Terminal, tm, Protocol, Optional, Callable
+from sancty.messages import Resize, Stamp, Paste
+from sancty.patch_blessed.terminal import BRACKETED_PASTE_ON, BRACKETED_PASTE_OFF
+from sancty.keys import KeyDecoder, read_keys
 
 
 class ReaderProtocol(Protocol):
@@ -25,56 +29,186 @@ class ReaderProtocol(Protocol):
         """Get size of sent print buffer."""
 
 
+class BatchPolicyProtocol(Protocol):
+    def timeout(self, now: int, pending: int) -> float:
+        """Seconds to wait for the next key at most."""
+
+    def added(self, now: int, pending: int) -> None:
+        """A key was added to the pending batch."""
+
+    def due(self, now: int, pending: int, idle: bool) -> bool:
+        """Pending batch should be sent now."""
+
+    def sent(self, now: int, queue_size: Callable[[], int]) -> None:
+        """Pending batch was sent."""
+
+
+class LatencyBatchPolicy(BatchPolicyProtocol):
+    """Sends keys at most max_latency seconds (of wall time) after the first of them was read.
+
+    Keys that are available at once are always sent together, up to max_batch of them. While the renderer keeps up,
+    a batch is sent as soon as no more keys are immediately available. When batches pile up in the queue, every
+    unconsumed batch makes the reader wait lag_step seconds longer for more keys, so that fewer and larger batches
+    are sent. The queue size is measured at most once every lag_interval seconds.
+    """
+    first_read: Optional[int] = None
+    lag: int = 0
+    lag_measured: int = 0
+
+    def __init__(self, max_latency=0.01, max_batch=256, lag_step=0.001, lag_interval=0.05, idle_timeout=0.005):
+        self.max_latency = int(max_latency * 1e9)
+        self.max_batch = max_batch
+        self.lag_step = int(lag_step * 1e9)
+        self.lag_interval = int(lag_interval * 1e9)
+        self.idle_timeout = idle_timeout
+
+    def target_latency(self) -> int:
+        return min(self.max_latency, self.lag * self.lag_step)
+
+    def timeout(self, now: int, pending: int) -> float:
+        if pending == 0:
+            return self.idle_timeout
+        return max(0.0, min(self.idle_timeout, (self.first_read + self.target_latency() - now) / 1e9))
+
+    def added(self, now: int, pending: int) -> None:
+        if pending == 1:
+            self.first_read = now
+
+    def due(self, now: int, pending: int, idle: bool) -> bool:
+        if pending == 0:
+            return False
+        age = now - self.first_read
+        return pending >= self.max_batch or age >= self.max_latency or (idle and age >= self.target_latency())
+
+    def sent(self, now: int, queue_size: Callable[[], int]) -> None:
+        self.first_read = None
+        if now - self.lag_measured >= self.lag_interval:
+            self.lag = queue_size()
+            self.lag_measured = now
+
+
 class Reader(ReaderProtocol):
+    resize_time: Optional[float] = None
+    batch_policy: BatchPolicyProtocol
 
-    def __init__(self, term):
+    def __init__(self, term, resize_debounce=0.05, resize_poll_interval=0.25,
+                 batch_policy: Optional[BatchPolicyProtocol] = None, stamp=False, bracketed_paste=True, esc_delay=0.35):
         self.term = term
+        # All keys that are available are read and decoded at once
+        self.key_decoder = KeyDecoder(term)
+        self.esc_delay = esc_delay
+        self.bracketed_paste = bracketed_paste
+        # With stamp, every batch ends with a Stamp holding the times its keys were read (see sancty.instrument)
+        self.stamp = stamp
+        self.read_times = []
+        self.resize_debounce = resize_debounce
+        self.resize_poll_interval = resize_poll_interval
+        self.resize_signal = False
+        self.batch_policy = LatencyBatchPolicy() if batch_policy is None else batch_policy
 
     def read_terminal(self) -> None:
         with self.term.raw():
-            current_time = 0
             values = []
-            i = 0
-            wait_time = 15000
-            hw = (self.term.height, self.term.width)
+            policy = self.batch_policy
+            previous_handler = self.watch_resize()
+            if self.bracketed_paste:
+                print(BRACKETED_PASTE_ON, end='', flush=True)
             try:
                 while not self.has_exited():
-                    new_hw = (self.term.height, self.term.width)
-                    if new_hw != hw:
-                        self.resizing_set()
-                        hw = new_hw
-                        tm.sleep(0.05)
-                    else:
-                        self.resizing_clear()
-                    if not self.resizing:
-                        start_time = tm.process_time_ns()
-                        val = self.term.inkey(timeout=0.005)
-
-                        if val == chr(3) or val == chr(4) or val.code == self.term.KEY_ESCAPE:
-                            break
-                        if not val == '':
+                    if values and self.resize_started():
+                        # Keys read before a resize do not wait for it to settle, and are sent before it
+                        self.send_batch(values)
+                        values = []
+                        policy.sent(tm.monotonic_ns(), self.queue_size)
+                    if not self.resize_pending():
+                        keys = read_keys(self.term, self.key_decoder,
+                                         timeout=policy.timeout(tm.monotonic_ns(), len(values)),
+                                         esc_delay=self.esc_delay)
+                        now = tm.monotonic_ns()
+                        quit_key = False
+                        for val in keys:
+                            if val == chr(3) or val == chr(4) or val.code == self.term.KEY_ESCAPE:
+                                quit_key = True
+                                break
+                            if val.code == self.term.KEY_PASTE_BEGIN:
+                                val = self.read_paste()
                             values.append(val)
+                            policy.added(now, len(values))
+                            if self.stamp:
+                                self.read_times.append(now)
+                            if policy.due(now, len(values), False):
+                                self.send_batch(values)
+                                values = []
+                                policy.sent(now, self.queue_size)
+                        if quit_key:
+                            break
 
-                        current_time += tm.process_time_ns() - start_time
-
-                        if i % 1000 == 0:
-                            wait_time = 15000 + self.queue_size() * 1e4
-                        if current_time > wait_time and len(values) > 0:
-                            self.send_values(values)
+                        if policy.due(now, len(values), not keys):
+                            self.send_batch(values)
                             values = []
-                            current_time = 0
-                        i += 1
+                            policy.sent(now, self.queue_size)
                     else:
                         tm.sleep(0.003)
-                    # if i % 1000 == 0:
-                    #     with self.term.location(x=0, y=term.height - 3):
-                    #         print(term.clear_eol + str(i) + ':' + str(len(values)) + f':qs{render_queue.qsize()}', end='',
-                    #               flush=True)
                 self.exit_set()
             except BaseException as bse:
                 self.exit_set()
                 print()
                 raise bse
+            finally:
+                if self.bracketed_paste:
+                    print(BRACKETED_PASTE_OFF, end='', flush=True)
+                if self.resize_signal:
+                    signal.signal(signal.SIGWINCH, previous_handler)
+
+    def read_paste(self) -> Paste:
+        text = self.term.read_paste()
+        return Paste(text.replace('\r\n', '\n').replace('\r', '\n'))
+
+    def watch_resize(self):
+        """Get notified of resizes by SIGWINCH, or fall back to polling the size if that is not possible."""
+        try:
+            previous_handler = signal.signal(signal.SIGWINCH, self.on_resize_signal)
+            self.resize_signal = True
+            return previous_handler
+        except (AttributeError, ValueError):
+            # No SIGWINCH on this platform, or not running in the main thread
+            self.resize_signal = False
+            self.hw = (self.term.height, self.term.width)
+            self.resize_polled = tm.perf_counter()
+            return None
+
+    def on_resize_signal(self, _signum, _frame):
+        self.resize_time = tm.perf_counter()
+
+    def resize_started(self) -> bool:
+        """Whether a resize has started, which has not been sent yet."""
+        if self.resize_time is None:
+            if not self.resize_signal and tm.perf_counter() - self.resize_polled > self.resize_poll_interval:
+                self.resize_polled = tm.perf_counter()
+                if (self.term.height, self.term.width) != self.hw:
+                    self.resize_time = self.resize_polled
+        return self.resize_time is not None
+
+    def resize_pending(self) -> bool:
+        """Whether a resize has started and the size has not been stable for the debounce window yet."""
+        if not self.resize_started():
+            return False
+        if not self.resizing:
+            self.resizing_set()
+        if tm.perf_counter() - self.resize_time < self.resize_debounce:
+            return True
+        self.resize_time = None
+        self.hw = (self.term.height, self.term.width)
+        # The renderer gets the new size before it is told resizing is done, so it only reflows once
+        self.send_values([Resize(*self.hw)])
+        self.resizing_clear()
+        return False
+
+    def send_batch(self, values):
+        if self.stamp:
+            values.append(Stamp(self.read_times, tm.monotonic_ns(), self.queue_size()))
+            self.read_times = []
+        self.send_values(values)
 
     def has_exited(self) -> bool:
         return self.exited
@@ -0,0 +1,93 @@
+import os
+import typing
+from sancty.deps_types import Optional, Callable
+from sancty.wrap import LineWrapper, _SPECIAL
+
+# Processes are only imported once a reflow is large enough to need them
+if typing.TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# Shared by every renderer in this process, and only started once a reflow is large enough to need it
+_pool: Optional['ProcessPoolExecutor'] = None
+_pool_workers = 0
+# Plain text is wrapped without a terminal, see _wrap_chunk
+_plain_wrapper = LineWrapper(None)
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _get_pool(workers) -> 'ProcessPoolExecutor':
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        close_pool()
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context())
+        _pool_workers = workers
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _wrap_chunk(texts: list[str], width: int) -> list[Optional[list[str]]]:
+    """Wrapped lines of every text, or None for texts with control characters, which need a terminal to wrap."""
+    return [None if _SPECIAL.search(text) is not None else _plain_wrapper.wrap(text, width) for text in texts]
+
+
+class Reflow:
+    """Wraps many paragraphs at once, like on a resize or when all of the text is replaced.
+
+    Paragraphs wrap independently of each other, so once they hold at least min_chars characters in total they are
+    split into chunks of consecutive paragraphs, which are wrapped in parallel on a pool of worker processes (threads
+    would share a single interpreter lock). The pool has a worker for every available core and is started the first
+    time it is needed. With fewer characters, or a single worker, paragraphs are wrapped in this process with the
+    wrap function that is passed, as before. So are they in daemonic processes, which cannot start a pool.
+    """
+
+    def __init__(self, workers: Optional[int] = None, min_chars=1 << 18, chunks_per_worker=4):
+        self.workers = available_cores() if workers is None else workers
+        self.min_chars = min_chars
+        self.chunks_per_worker = chunks_per_worker
+
+    def chunks(self, texts: list[str], total: int) -> list[tuple[int, int]]:
+        """Ranges of consecutive texts with about the same number of characters."""
+        target = max(total // (self.workers * self.chunks_per_worker), 1)
+        ranges = []
+        start = 0
+        size = 0
+        for k, text in enumerate(texts):
+            size += len(text)
+            if size >= target:
+                ranges.append((start, k + 1))
+                start = k + 1
+                size = 0
+        if start < len(texts):
+            ranges.append((start, len(texts)))
+        return ranges
+
+    def wrap(self, texts: list[str], width: int, wrap_fn: Callable[[str], list[str]]) -> list[list[str]]:
+        """Wrapped lines of every text in texts at width, in order. wrap_fn wraps a single text in this process."""
+        if self.workers <= 1 or len(texts) < 2:
+            return [wrap_fn(text) for text in texts]
+        total = sum(map(len, texts))
+        if total < self.min_chars:
+            return [wrap_fn(text) for text in texts]
+        import multiprocessing as mp
+        if mp.current_process().daemon:
+            return [wrap_fn(text) for text in texts]
+        ranges = self.chunks(texts, total)
+        pool = _get_pool(self.workers)
+        wrapped = []
+        for chunk in pool.map(_wrap_chunk, [texts[start:end] for start, end in ranges], [width] * len(ranges)):
+            wrapped += chunk
+        return [wrap_fn(text) if lines is None else lines for text, lines in zip(texts, wrapped)]
@@ -1,4 +1,12 @@
-from sancty.deps_types import Optional, Terminal, tm, wcswidth, Protocol, Callable
+from sancty.deps_types import Optional, Terminal, tm, Protocol, Callable
+from sancty.wrap import WrapCache, LineWrapper
+from sancty.width import char_width
+from sancty.slash import SlashTrie, SlashNode
+from sancty.messages import Resize, Stamp, Paste
+from sancty.document import Document, DocumentView, paragraphs_from_render
+from sancty.edits import Edit, apply_edits
+from sancty.instrument import NULL_INSTRUMENT, NullInstrument
+from sancty.reflow import Reflow, close_pool
 
 
 class ReplaceRender:
@@ -27,6 +35,7 @@ class RendererProtocol(Protocol):
     term: Terminal
     replace_dict: dict[str, tuple[int, str] | str]
     special_slash_fn: Callable[[int, list, list], tuple[list, list]]
+    slash_edit_fn: Optional[Callable[[int, DocumentView, tuple[int, int]], Optional[list[Edit]]]]
 
     def print_terminal(self) -> None:
         """Blocking print loop."""
@@ -40,6 +49,9 @@ class RendererProtocol(Protocol):
     def update_values(self, values) -> tuple[bool, list]:
         """Update print buffer."""
 
+    def wait_values(self, timeout) -> None:
+        """Wait at most timeout seconds for more values."""
+
     def render_current(self, render_array, paragraph_ends, val=None, rewrap=False,
                        replace: Optional[ReplaceRender] = None) -> tuple[list, list]:
         """Perform printing operation."""
@@ -50,6 +62,9 @@ class RendererProtocol(Protocol):
     def check_slash(self, slash_text, render_array, paragraph_ends) -> tuple[str, list, Optional[ReplaceRender]]:
         """Check if there is a slash match."""
 
+    def special_slash_edit(self, control_num, render_array, paragraph_ends) -> tuple[list, list]:
+        """Perform a special slash command on the text."""
+
     def backspace(self, current_text, slash_text, matching_slash, width_deleted=False) -> tuple[str, str, bool]:
         """Perform backspace operation on text."""
 
@@ -67,7 +82,10 @@ class ExternalError(Exception):
 
 class Renderer(RendererProtocol):
 
-    def __init__(self, term, replace_dict=None, special_slash_fn=None, replace_dict_add=True, overwrite=False):
+    def __init__(self, term, replace_dict=None, special_slash_fn=None, replace_dict_add=True, overwrite=False,
+                 instrument: Optional[NullInstrument] = None, paste_slash=False,
+                 slash_edit_fn: Optional[Callable[[int, DocumentView, tuple[int, int]], Optional[list[Edit]]]] = None,
+                 reflow_workers: Optional[int] = None, reflow_min_chars=1 << 18):
         if replace_dict is None:
             self.replace_dict = default_replace_dict
         elif replace_dict_add:
@@ -96,8 +114,22 @@ class Renderer(RendererProtocol):
             self.special_slash_fn = default_special_slash_fn
         else:
             self.special_slash_fn = special_slash_fn
+        # Returns the edits for a special slash command, or None to leave it to special_slash_fn
+        self.slash_edit_fn = slash_edit_fn
+
+        self.slash_trie = SlashTrie(self.replace_dict)
+        # Trie node of the last slash text that was looked up, so that typing one more character is a single step
+        self.slash_node: Optional[SlashNode] = self.slash_trie.root
+        self.slash_node_text = '\\'
 
         self.term = term
+        self.wrap_cache = WrapCache()
+        self.line_wrapper = LineWrapper(term)
+        # Full rewraps of texts of at least reflow_min_chars are spread over reflow_workers processes
+        self.reflower = Reflow(reflow_workers, reflow_min_chars)
+        self.instrument = NULL_INSTRUMENT if instrument is None else instrument
+        # Whether slash commands in pasted text are expanded
+        self.paste_slash = paste_slash
 
     def print_terminal(self):
         values = []
@@ -112,7 +144,7 @@ class Renderer(RendererProtocol):
                 if self.is_resizing():
                     was_resizing = True
                     if empty_queue:
-                        tm.sleep(0.003)
+                        self.wait_values(0.003)
                     continue
                 if was_resizing:
                     render_array, paragraph_ends = self.render_current(render_array, paragraph_ends, rewrap=True)
@@ -121,6 +153,22 @@ class Renderer(RendererProtocol):
                     render_array = ['']
                 if len(values) > 0:
                     val = values.pop(0)
+                    if isinstance(val, Resize):
+                        if val.width != self.wrap_cache.width:
+                            render_array, paragraph_ends = self.render_current(render_array, paragraph_ends,
+                                                                               rewrap=True)
+                        continue
+                    if isinstance(val, Paste):
+                        matching_slash = False
+                        slash_text = "\\"
+                        render_array, paragraph_ends = self.render_current(
+                            render_array, paragraph_ends, replace=self.paste_render(val.text, render_array,
+                                                                                    paragraph_ends))
+                        continue
+                    if isinstance(val, Stamp):
+                        # Every value before the stamp has been rendered already
+                        self.instrument.received(val, painted=True)
+                        continue
                     if val and not val.is_sequence:
                         match val:
                             case "\\":
@@ -164,7 +212,7 @@ class Renderer(RendererProtocol):
                     if len(val) > 0:
                         pass
                 else:
-                    tm.sleep(0.003)
+                    self.wait_values(0.003)
         except BaseException as bse:
             self.do_exit()
             print()
@@ -173,6 +221,9 @@ class Renderer(RendererProtocol):
             except ExternalError as vle:
                 print("External error...", flush=True)
                 raise SystemExit(vle)
+        finally:
+            self.instrument.dump()
+            close_pool()
 
     def has_exited(self) -> bool:
         return True
@@ -184,61 +235,128 @@ class Renderer(RendererProtocol):
         values = []
         return False, values
 
+    def wait_values(self, timeout) -> None:
+        tm.sleep(timeout)
+
     def render_current(self, render_array, paragraph_ends, val=None, rewrap=False,
                        replace: Optional[ReplaceRender] = None) -> tuple[list, list]:
         new_paragraphs = paragraph_ends
         move_up = -1
+        width = self.term.width
+        start = self.instrument.now()
         if rewrap or replace is not None:
-            final_k = len(render_array) - 1
-            for k, line in enumerate(render_array):
+            self.instrument.count('rewraps')
+            cached_rows = self.wrap_cache.rows(render_array, width)
+            if cached_rows is not None:
+                move_up += cached_rows - 1 + len(self.line_wrapper.wrap(render_array[-1] + 'a', width))
+            else:
+                final_k = len(render_array) - 1
+                for k, line in enumerate(render_array):
 
-                if k == final_k or len(line) == 0:
-                    line += 'a'
-                move_up += len(self.term.wrap(line, width=self.term.width, drop_whitespace=False))
+                    if k == final_k or len(line) == 0:
+                        line += 'a'
+                    move_up += len(self.line_wrapper.wrap(line, width))
 
+            if width != self.wrap_cache.width:
+                self.wrap_cache.reset(width)
             if replace is not None:
                 render_array = replace.new_render
                 paragraph_ends = replace.new_paragraphs
-            wrapped = []
-            new_paragraphs = []
-            prev_pend = 0
-            for i, pend in enumerate(paragraph_ends):
-                paragraph = render_array[prev_pend:pend + 1]
-                par_wrap = self.term.wrap(''.join(paragraph), drop_whitespace=False)
-                wrapped += (par_wrap if len(par_wrap) > 0 else [''])
-                new_paragraphs.append(len(wrapped) - 1)
-                prev_pend = pend + 1
-            if len(render_array) > prev_pend:
-                final_paragraph = render_array[prev_pend:]
-                par_wrap = self.term.wrap(''.join(final_paragraph), drop_whitespace=False)
-                wrapped += (par_wrap if len(par_wrap) > 0 else [''])
+
+            def wrap_fn(text):
+                return self.line_wrapper.wrap(text, width)
+
+            clean = self.wrap_cache.clean_paragraphs(render_array, paragraph_ends, width)
+            if clean > 0:
+                prev_pend = paragraph_ends[clean - 1] + 1
+                wrapped = render_array[:prev_pend]
+                new_paragraphs = paragraph_ends[:clean]
             else:
-                wrapped += ['']
+                prev_pend = 0
+                wrapped = []
+                new_paragraphs = []
+            stable = clean
+            paragraphs = []
+            for pend in paragraph_ends[clean:]:
+                paragraphs.append(render_array[prev_pend:pend + 1])
+                prev_pend = pend + 1
+            # Paragraphs that are not cached are wrapped all at once, which happens in parallel for large texts
+            par_wraps = self.wrap_cache.wrap_all([''.join(paragraph) for paragraph in paragraphs] + [''.join(
+                render_array[prev_pend:])], lambda texts: self.reflower.wrap(texts, width, wrap_fn))
+            for paragraph, par_wrap in zip(paragraphs, par_wraps):
+                par_wrap = par_wrap if len(par_wrap) > 0 else ['']
+                # A paragraph that wraps to itself will keep doing so until it is edited again
+                if stable == len(new_paragraphs) and par_wrap == paragraph:
+                    stable += 1
+                wrapped += par_wrap
+                new_paragraphs.append(len(wrapped) - 1)
+            wrapped += (par_wraps[-1] if len(par_wraps[-1]) > 0 else [''])
 
             render_array = wrapped
+            self.wrap_cache.store(render_array, new_paragraphs, stable, width)
         else:
+            if width != self.wrap_cache.width:
+                self.wrap_cache.reset(width)
+            else:
+                self.wrap_cache.touch(len(render_array) - 1)
             last_line = render_array.pop(-1)
             if val is not None:
                 last_line += val
 
-            wrapped: list[str] = self.term.wrap(last_line, drop_whitespace=False)
+            wrapped: list[str] = self.line_wrapper.wrap(last_line, width)
             if len(wrapped) == 0:
                 wrapped = ['']
             render_array += wrapped
 
         move_up = '' if move_up <= 0 else self.term.move_up(move_up)
-        print(self.term.clear_bol + move_up + self.term.move_x(0), end='',
-              flush=True)
+        start_text = self.term.clear_bol + move_up + self.term.move_x(0)
+        print(start_text, end='', flush=True)
 
-        print(self.term.clear_eos + "\n\r".join(wrapped), end='',
-              flush=True)
+        text = self.term.clear_eos + "\n\r".join(wrapped)
+        print(text, end='', flush=True)
 
+        if self.instrument.enabled:
+            self.record_paint(start, len(start_text.encode()) + len(text.encode()))
         return render_array, new_paragraphs
 
+    def record_paint(self, start, bytes_written) -> bool:
+        """Record a paint, returns whether the status line was written over the bottom row of the terminal."""
+        instrument = self.instrument
+        instrument.painted(start, bytes_written)
+        if not instrument.status_due():
+            return False
+        with self.term.location(0, self.term.height - 1):
+            print(self.term.clear_eol + instrument.status_line(), end='', flush=True)
+        return True
+
+    def paste_render(self, text, render_array, paragraph_ends) -> ReplaceRender:
+        """Unwrapped render array with the pasted text appended, so that it is wrapped and painted only once."""
+        if self.paste_slash:
+            text = self.slash_trie.expand(text)
+        paragraphs = paragraphs_from_render(render_array, paragraph_ends)
+        pasted = text.split('\n')
+        paragraphs[-1] += pasted[0]
+        paragraphs += pasted[1:]
+        return ReplaceRender(paragraphs, list(range(len(paragraphs) - 1)))
+
+    def slash_node_of(self, text) -> Optional[SlashNode]:
+        """Trie node of slash text, or None if no key starts with it."""
+        if text != self.slash_node_text:
+            if text[:-1] == self.slash_node_text and text[-1] != '\\':
+                self.slash_node = self.slash_trie.step(self.slash_node, text[-1])
+            else:
+                self.slash_node = self.slash_trie.find(text.lstrip('\\'))
+            self.slash_node_text = text
+        return self.slash_node
+
     def slash_replace(self, text) -> str | tuple[int, str]:
-        actual_text = text.lstrip('\\')
-        if actual_text in self.replace_dict.keys():
-            return self.replace_dict[actual_text]
+        node = self.slash_node_of(text)
+        if node is not None and node.key is not None:
+            return node.value
+
+    def slash_completions(self, text, limit=10) -> list[str]:
+        """Keys that the slash text could still be completed to."""
+        return self.slash_trie.completions(text.lstrip('\\'), limit)
 
     def check_slash(self, slash_text, render_array, paragraph_ends) -> tuple[str, list, Optional[ReplaceRender]]:
         try:
@@ -254,11 +372,11 @@ class Renderer(RendererProtocol):
                         new_render = ['']
                         new_paragraphs = []
                     elif slash_match[0] == -2:
-                        new_render = [f'{key} : {value[-1] if isinstance(value, tuple) else value}\n' for key, value in
-                                      self.replace_dict.items()]
+                        new_render = self.slash_trie.help_lines(end='\n')
                         new_paragraphs = [i for i in range(len(new_render))]
                     else:
-                        new_render, new_paragraphs = self.special_slash_fn(slash_match[0], new_render, new_paragraphs)
+                        new_render, new_paragraphs = self.special_slash_edit(slash_match[0], new_render,
+                                                                             new_paragraphs)
                 else:
                     new_render[-1] += slash_match
                 slash_text = "\\"
@@ -271,6 +389,19 @@ class Renderer(RendererProtocol):
             print("External slash error...", flush=True)
             raise ExternalError(e)
 
+    def special_slash_edit(self, control_num, render_array, paragraph_ends) -> tuple[list, list]:
+        """Apply the edits of slash_edit_fn to the text with the cursor at its end, or else call special_slash_fn."""
+        if self.slash_edit_fn is not None:
+            # Paragraphs are not wrapped here, the render array is wrapped again as a whole anyway
+            document = Document(lambda text, _width: [text], 1, paragraphs_from_render(render_array, paragraph_ends))
+            last = len(document) - 1
+            cursor = (last, len(document.paragraph(last)))
+            edits = self.slash_edit_fn(control_num, DocumentView(document), cursor)
+            if edits is not None:
+                apply_edits(document, edits, cursor)
+                return document.to_render()
+        return self.special_slash_fn(control_num, render_array, paragraph_ends)
+
     def backspace(self, current_text, slash_text, matching_slash, width_deleted=False) -> tuple[str, str, bool]:
         text_len = len(current_text)
         prev_prev = ''
@@ -292,9 +423,9 @@ class Renderer(RendererProtocol):
                     slash_text = "\\"
                 elif matching_slash:
                     slash_text = slash_text[:-1]
-            if not width_deleted and wcswidth(prev) != 0:
+            if not width_deleted and char_width(prev) != 0:
                 width_deleted = True
-            if wcswidth(prev_prev) == 0 or (wcswidth(prev) == 0 and not width_deleted):
+            if char_width(prev_prev) == 0 or (char_width(prev) == 0 and not width_deleted):
                 current_text, slash_text, matching_slash = self.backspace(current_text, slash_text, matching_slash,
                                                                           width_deleted=width_deleted)
 
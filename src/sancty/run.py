@@ -1,8 +1,15 @@
+import os
+import sys
 from sancty.deps_types import Queue, Event, QueueEmpty, Terminal, Callable
 from sancty.read import Reader, ReaderProtocol
-from sancty.render import Renderer, RendererProtocol
+from sancty.render import RendererProtocol
+from sancty.editor import DocumentRenderer
+from sancty.instrument import Instrument
 import multiprocessing as mp
 
+# Imported once by the forkserver, so that the processes it forks start with them already imported
+FORKSERVER_PRELOAD = ['sancty.run', 'sancty.read', 'sancty.editor', 'sancty.shm', 'blessed']
+
 
 def create_process_reader(clss: ReaderProtocol):
     class ProcessReadr(clss):
@@ -10,8 +17,8 @@ def create_process_reader(clss: ReaderProtocol):
         exit_event: Event
         resizing_event: Event
 
-        def __init__(self, term, render_queue, exit_event, resizing_event):
-            super().__init__(term)
+        def __init__(self, term, render_queue, exit_event, resizing_event, **reader_options):
+            super().__init__(term, **reader_options)
             self.exit_event = exit_event
             self.render_queue = render_queue
             self.resizing_event = resizing_event
@@ -47,11 +54,13 @@ def create_process_renderer(clss: RendererProtocol):
         resizing: Event
 
         def __init__(self, term, render_queue, exit_event, resizing, replace_dict=None, special_slash_fn=None,
-                     replace_dict_add=True, overwrite=False):
-            super().__init__(term, replace_dict, special_slash_fn, replace_dict_add, overwrite)
+                     replace_dict_add=True, overwrite=False, **renderer_options):
+            super().__init__(term, replace_dict, special_slash_fn, replace_dict_add, overwrite, **renderer_options)
             self.render_queue = render_queue
             self.exit_event = exit_event
             self.resizing = resizing
+            # A shared memory queue can be waited on, a manager queue cannot without taking values off it
+            self.queue_wait = getattr(render_queue, 'wait', None)
 
         def has_exited(self) -> bool:
             return self.exit_event.is_set()
@@ -62,60 +71,119 @@ def create_process_renderer(clss: RendererProtocol):
         def update_values(self, values) -> tuple[bool, list]:
             try:
                 new_values = self.render_queue.get(block=False)
+                self.instrument.dequeued(new_values)
                 values += new_values
                 return False, values
             except QueueEmpty:
                 return True, values
 
+        def wait_values(self, timeout) -> None:
+            if self.queue_wait is not None:
+                self.queue_wait(timeout)
+            else:
+                super().wait_values(timeout)
+
         def do_exit(self):
             self.exit_event.set()
 
     return ProcessRendr
 
 
-def reader_process_start(term, reader, render_queue, exit_event, resizing):
+def process_terminal(term) -> Terminal:
+    """The terminal of the parent if this process was forked from it, otherwise a new one.
+
+    A terminal cannot be pickled, so processes that are not forked get None. Multiprocessing closes stdin in every
+    process it starts, but the terminal itself is still inherited as file descriptor 0, where the keyboard is read.
+    """
+    if term is not None:
+        return term
+    sys.__stdin__ = open(0, closefd=False)
+    return Terminal()
+
+
+def reader_process_start(term, reader, render_queue, exit_event, resizing, reader_options):
     if reader is not None:
         reader_cls = create_process_reader(reader)
     else:
         reader_cls = create_process_reader(Reader)
 
-    # term = Terminal()
+    term = process_terminal(term)
     print("\n" * 20 + term.move_x(0) + term.move_up(20))
-    reader_inst: ReaderProtocol = reader_cls(term, render_queue, exit_event, resizing)
+    reader_inst: ReaderProtocol = reader_cls(term, render_queue, exit_event, resizing, **reader_options)
     reader_inst.read_terminal()
 
 
 def render_process_start(term, renderer, render_queue, exit_event, resizing, replace_dict, special_slash_fn,
-                         replace_dict_add, overwrite):
+                         replace_dict_add, overwrite, renderer_options):
     if renderer is not None:
         renderer_cls = create_process_renderer(renderer)
     else:
-        renderer_cls = create_process_renderer(Renderer)
+        renderer_cls = create_process_renderer(DocumentRenderer)
 
+    term = process_terminal(term)
     renderer_inst: RendererProtocol = renderer_cls(term, render_queue, exit_event, resizing, replace_dict,
-                                                   special_slash_fn, replace_dict_add, overwrite)
+                                                   special_slash_fn, replace_dict_add, overwrite, **renderer_options)
     renderer_inst.print_terminal()
 
 
 def start_terminal(renderer=None, reader=None, replace_dict: dict[str, str | tuple[int, str]] = None,
                    special_slash_fn: Callable[[int, list, list], tuple[list, list]] = None,
-                   replace_dict_add: bool = True, overwrite: bool = False, welcome_message="Welcome to Sancty Text!"):
-
-    render_queue = mp.Manager().Queue()
-    exit_event = mp.Manager().Event()
-    resizing = mp.Manager().Event()
+                   replace_dict_add: bool = True, overwrite: bool = False, welcome_message="Welcome to Sancty Text!",
+                   renderer_options: dict = None, transport='manager', reader_options: dict = None,
+                   instrument: Instrument = None, open_path: str = None, save_path: str = None,
+                   start_method: str = None, journal_path: str = None):
+    if renderer_options is None:
+        renderer_options = {}
+    if reader_options is None:
+        reader_options = {}
+    if instrument is not None:
+        reader_options = {**reader_options, 'stamp': True}
+        renderer_options = {**renderer_options, 'instrument': instrument}
+    if open_path is not None or save_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'open_path': open_path, 'save_path': save_path}
+    if journal_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'journal_path': journal_path}
+
+    ctx = mp.get_context(start_method)
+    if ctx.get_start_method() == 'forkserver':
+        ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+
+    manager = None
+    shm_transport = None
+    match transport:
+        case 'manager':
+            # A single manager server process holds the queue and both events
+            manager = ctx.Manager()
+            render_queue = manager.Queue()
+            exit_event = manager.Event()
+            resizing = manager.Event()
+        case 'shm':
+            from sancty.shm import ShmTransport
+            shm_transport = ShmTransport(ctx=ctx)
+            render_queue = shm_transport.queue
+            exit_event = shm_transport.exit_event
+            resizing = shm_transport.resizing_event
+        case _:
+            raise ValueError(f"Unknown transport {transport}!")
 
     term = Terminal()
 
     print(welcome_message)
     print("Press 'ESC', 'CTRL+C' or 'CTRL+D' to quit. "
           "Type \\help for a list of '\\\\' commands (also clears all text).")
+    if open_path is not None or save_path is not None:
+        print(f"Press 'CTRL+S' to save to {open_path if save_path is None else save_path}.")
+    if journal_path is not None and os.path.exists(journal_path):
+        print(f"Recovering the text from {journal_path}.")
     # print("\n" * 20 + term.move_x(0) + term.move_up(20))
 
-    input_process = mp.Process(target=reader_process_start, args=(term, reader, render_queue, exit_event, resizing,))
-    render_process = mp.Process(target=render_process_start, args=(term, renderer, render_queue, exit_event, resizing,
-                                                                   replace_dict, special_slash_fn, replace_dict_add,
-                                                                   overwrite,))
+    # Only forked processes can share the terminal of this process
+    child_term = term if ctx.get_start_method() == 'fork' else None
+    input_process = ctx.Process(target=reader_process_start, args=(child_term, reader, render_queue, exit_event,
+                                                                   resizing, reader_options,))
+    render_process = ctx.Process(target=render_process_start, args=(child_term, renderer, render_queue, exit_event,
+                                                                    resizing, replace_dict, special_slash_fn,
+                                                                    replace_dict_add, overwrite, renderer_options,))
 
     processes = []
 
@@ -126,3 +194,8 @@ def start_terminal(renderer=None, reader=None, replace_dict: dict[str, str | tup
 
     for process in processes:
         process.join()
+
+    if manager is not None:
+        manager.shutdown()
+    if shm_transport is not None:
+        shm_transport.close()
@@ -0,0 +1,257 @@
+import os
+import asyncio
+import signal
+from sancty.deps_types import Terminal, Callable, Optional, tm
+from sancty.read import Reader, ReaderProtocol
+from sancty.keys import read_keys, read_text
+from sancty.editor import DocumentRenderer
+from sancty.messages import Resize, Paste
+from sancty.instrument import Instrument
+from sancty.patch_blessed.terminal import BRACKETED_PASTE_ON, BRACKETED_PASTE_OFF, PASTE_END
+
+
+def create_async_reader(clss: ReaderProtocol):
+    class AsyncReadr(clss):
+        render_queue: asyncio.Queue
+        exit_event: asyncio.Event
+        resizing_event: asyncio.Event
+
+        def __init__(self, term, render_queue, exit_event, resizing_event, **reader_options):
+            super().__init__(term, **reader_options)
+            self.render_queue = render_queue
+            self.exit_event = exit_event
+            self.resizing_event = resizing_event
+            self.settle_handle = None
+            # Text of a bracketed paste that has started but not ended yet
+            self.paste_text: Optional[str] = None
+            self.paste_handle = None
+
+        async def read_terminal_async(self) -> None:
+            if self.term._keyboard_fd is None:
+                raise ValueError("Reading requires stdin and stdout to be a terminal!")
+            loop = asyncio.get_running_loop()
+            loop.add_reader(self.term._keyboard_fd, self.read_available)
+            loop.add_signal_handler(signal.SIGWINCH, self.on_resize)
+            if self.bracketed_paste:
+                print(BRACKETED_PASTE_ON, end='', flush=True)
+            try:
+                await self.exit_event.wait()
+            finally:
+                if self.bracketed_paste:
+                    print(BRACKETED_PASTE_OFF, end='', flush=True)
+                loop.remove_reader(self.term._keyboard_fd)
+                loop.remove_signal_handler(signal.SIGWINCH)
+                if self.settle_handle is not None:
+                    self.settle_handle.cancel()
+                if self.paste_handle is not None:
+                    self.paste_handle.cancel()
+                self.exit_set()
+
+        def on_resize(self):
+            if not self.resizing:
+                self.resizing_set()
+            # Every signal restarts the debounce window
+            if self.settle_handle is not None:
+                self.settle_handle.cancel()
+            self.settle_handle = asyncio.get_running_loop().call_later(self.resize_debounce, self.resize_settled)
+
+        def resize_settled(self):
+            self.settle_handle = None
+            self.send_values([Resize(self.term.height, self.term.width)])
+            self.resizing_clear()
+
+        def read_available(self):
+            values = []
+            # Text after a paste is left buffered in the terminal, so reading goes on until no keys are left
+            while not self.has_exited():
+                now = tm.monotonic_ns()
+                if self.paste_text is not None:
+                    paste = self.read_paste_available()
+                    if paste is None:
+                        # The rest of the paste is read once it arrives, without blocking the loop until then
+                        break
+                    values.append(paste)
+                    if self.stamp:
+                        self.read_times.append(now)
+                    continue
+                keys = read_keys(self.term, self.key_decoder, timeout=0, esc_delay=self.esc_delay)
+                if not keys:
+                    break
+                for val in keys:
+                    if val == chr(3) or val == chr(4) or val.code == self.term.KEY_ESCAPE:
+                        self.exit_set()
+                        break
+                    if val.code == self.term.KEY_PASTE_BEGIN:
+                        # Decoding stops at the start of a paste, so this is the last key
+                        self.paste_text = ''
+                        break
+                    values.append(val)
+                    if self.stamp:
+                        self.read_times.append(now)
+            if values:
+                self.send_batch(values)
+
+        def read_paste_available(self, final=False) -> Optional[Paste]:
+            """The paste that has started once its end marker was read, or None if it has not arrived yet.
+
+            Like Terminal.read_paste, a paste also ends when nothing arrived for a second, or when final.
+            """
+            searched = max(0, len(self.paste_text) - len(PASTE_END))
+            self.paste_text += read_text(self.term)
+            end = self.paste_text.find(PASTE_END, searched)
+            if self.paste_handle is not None:
+                self.paste_handle.cancel()
+                self.paste_handle = None
+            if end == -1:
+                if not final:
+                    self.paste_handle = asyncio.get_running_loop().call_later(1.0, self.paste_timed_out)
+                    return None
+                end = len(self.paste_text)
+            self.term.ungetch(self.paste_text[end + len(PASTE_END):])
+            text = self.paste_text[:end]
+            self.paste_text = None
+            return Paste(text.replace('\r\n', '\n').replace('\r', '\n'))
+
+        def paste_timed_out(self):
+            self.paste_handle = None
+            if self.stamp:
+                self.read_times.append(tm.monotonic_ns())
+            self.send_batch([self.read_paste_available(final=True)])
+
+        def has_exited(self):
+            return self.exit_event.is_set()
+
+        def resizing_set(self):
+            self.resizing_event.set()
+            self.resizing = True
+
+        def resizing_clear(self):
+            self.resizing_event.clear()
+            self.resizing = False
+
+        def send_values(self, values):
+            self.render_queue.put_nowait(values)
+
+        def queue_size(self) -> int:
+            return self.render_queue.qsize()
+
+        def exit_set(self):
+            self.exit_event.set()
+            self.exited = True
+            # Wake up the renderer so it notices the exit
+            self.render_queue.put_nowait([])
+
+    return AsyncReadr
+
+
+def create_async_renderer(clss: type[DocumentRenderer]):
+    # The loop below handles and paints values one at a time, which only a DocumentRenderer can do
+    if not issubclass(clss, DocumentRenderer):
+        raise TypeError(f"The asyncio runtime needs a DocumentRenderer, not {clss.__name__}!")
+
+    class AsyncRendr(clss):
+        render_queue: asyncio.Queue
+        exit_event: asyncio.Event
+        resizing: asyncio.Event
+
+        def __init__(self, term, render_queue, exit_event, resizing, replace_dict=None, special_slash_fn=None,
+                     replace_dict_add=True, overwrite=False, **renderer_options):
+            super().__init__(term, replace_dict, special_slash_fn, replace_dict_add, overwrite, **renderer_options)
+            self.render_queue = render_queue
+            self.exit_event = exit_event
+            self.resizing = resizing
+
+        async def print_terminal_async(self) -> None:
+            try:
+                while not self.has_exited():
+                    values = await self.render_queue.get()
+                    self.instrument.dequeued(values)
+                    _empty_queue, values = self.update_values(values)
+                    if not values:
+                        # Only woken up to notice the exit
+                        continue
+                    if self.coalesce:
+                        wait = self.last_paint + self.frame_interval - tm.perf_counter()
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                            _empty_queue, values = self.update_values(values)
+                        for val in values:
+                            self.handle_value(val)
+                        self.paint()
+                    else:
+                        for val in values:
+                            self.handle_value(val)
+                            self.paint()
+                    if self.render_queue.empty():
+                        self.idle()
+            except BaseException as bse:
+                self.exit_error(bse)
+            finally:
+                self.do_exit()
+                self.finish_terminal()
+
+        def has_exited(self) -> bool:
+            return self.exit_event.is_set()
+
+        def is_resizing(self) -> bool:
+            return self.resizing.is_set()
+
+        def update_values(self, values) -> tuple[bool, list]:
+            try:
+                while True:
+                    new_values = self.render_queue.get_nowait()
+                    self.instrument.dequeued(new_values)
+                    values += new_values
+            except asyncio.QueueEmpty:
+                return True, values
+
+        def do_exit(self):
+            self.exit_event.set()
+
+    return AsyncRendr
+
+
+AsyncReader = create_async_reader(Reader)
+AsyncRenderer = create_async_renderer(DocumentRenderer)
+
+
+async def start_terminal_async(renderer=None, reader=None, replace_dict: dict[str, str | tuple[int, str]] = None,
+                               special_slash_fn: Callable[[int, list, list], tuple[list, list]] = None,
+                               replace_dict_add: bool = True, overwrite: bool = False,
+                               welcome_message="Welcome to Sancty Text!", renderer_options: dict = None,
+                               reader_options: dict = None, instrument: Instrument = None, open_path: str = None,
+                               save_path: str = None, journal_path: str = None):
+    if renderer_options is None:
+        renderer_options = {}
+    if reader_options is None:
+        reader_options = {}
+    if instrument is not None:
+        reader_options = {**reader_options, 'stamp': True}
+        renderer_options = {**renderer_options, 'instrument': instrument}
+    if open_path is not None or save_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'open_path': open_path, 'save_path': save_path}
+    if journal_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'journal_path': journal_path}
+    reader_cls = create_async_reader(reader) if reader is not None else AsyncReader
+    renderer_cls = create_async_renderer(renderer) if renderer is not None else AsyncRenderer
+
+    render_queue = asyncio.Queue()
+    exit_event = asyncio.Event()
+    resizing = asyncio.Event()
+
+    term = Terminal()
+
+    print(welcome_message)
+    print("Press 'ESC', 'CTRL+C' or 'CTRL+D' to quit. "
+          "Type \\help for a list of '\\\\' commands (also clears all text).")
+    if open_path is not None or save_path is not None:
+        print(f"Press 'CTRL+S' to save to {open_path if save_path is None else save_path}.")
+    if journal_path is not None and os.path.exists(journal_path):
+        print(f"Recovering the text from {journal_path}.")
+    print("\n" * 20 + term.move_x(0) + term.move_up(20))
+
+    reader_inst = reader_cls(term, render_queue, exit_event, resizing, **reader_options)
+    renderer_inst = renderer_cls(term, render_queue, exit_event, resizing, replace_dict, special_slash_fn,
+                                 replace_dict_add, overwrite, **renderer_options)
+    with term.raw():
+        await asyncio.gather(reader_inst.read_terminal_async(), renderer_inst.print_terminal_async())
@@ -0,0 +1,185 @@
+import os
+import threading
+from collections import deque
+from sancty.deps_types import Event, QueueEmpty, Terminal, Callable, Optional
+from sancty.read import Reader, ReaderProtocol
+from sancty.render import RendererProtocol
+from sancty.editor import DocumentRenderer
+from sancty.instrument import Instrument
+
+
+class KeyQueue:
+    """Bounded queue of key batches between the threads of a single process.
+
+    Batches are handed over by reference, so they are never copied or pickled. Putting a batch into a full queue waits
+    until there is room again, and waiting for a batch wakes up as soon as one is put, instead of polling for it.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.batches = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, values):
+        with self.condition:
+            while len(self.batches) >= self.capacity and not self.closed:
+                self.condition.wait()
+            self.batches.append(values)
+            self.condition.notify_all()
+
+    def get(self, block=True, timeout: Optional[float] = None) -> list:
+        with self.condition:
+            if block:
+                self.condition.wait_for(lambda: self.batches, timeout)
+            if not self.batches:
+                raise QueueEmpty
+            values = self.batches.popleft()
+            self.condition.notify_all()
+            return values
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait at most timeout seconds until a batch can be taken or the queue was closed."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.batches or self.closed, timeout)
+
+    def qsize(self) -> int:
+        return len(self.batches)
+
+    def close(self):
+        """Wake up every thread that is waiting, after which putting never waits."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def create_thread_reader(clss: ReaderProtocol):
+    class ThreadReadr(clss):
+        render_queue: KeyQueue
+        exit_event: Event
+        resizing_event: Event
+
+        def __init__(self, term, render_queue, exit_event, resizing_event, **reader_options):
+            super().__init__(term, **reader_options)
+            self.exit_event = exit_event
+            self.render_queue = render_queue
+            self.resizing_event = resizing_event
+
+        def has_exited(self):
+            return self.exit_event.is_set()
+
+        def resizing_set(self):
+            self.resizing_event.set()
+            self.resizing = True
+
+        def resizing_clear(self):
+            self.resizing_event.clear()
+            self.resizing = False
+
+        def send_values(self, values):
+            self.render_queue.put(values)
+
+        def queue_size(self) -> int:
+            return self.render_queue.qsize()
+
+        def exit_set(self):
+            self.exit_event.set()
+            self.exited = True
+            self.render_queue.close()
+
+    return ThreadReadr
+
+
+def create_thread_renderer(clss: RendererProtocol):
+    class ThreadRendr(clss):
+        render_queue: KeyQueue
+        exit_event: Event
+        resizing: Event
+
+        def __init__(self, term, render_queue, exit_event, resizing, replace_dict=None, special_slash_fn=None,
+                     replace_dict_add=True, overwrite=False, **renderer_options):
+            super().__init__(term, replace_dict, special_slash_fn, replace_dict_add, overwrite, **renderer_options)
+            self.render_queue = render_queue
+            self.exit_event = exit_event
+            self.resizing = resizing
+
+        def has_exited(self) -> bool:
+            return self.exit_event.is_set()
+
+        def is_resizing(self) -> bool:
+            return self.resizing.is_set()
+
+        def update_values(self, values) -> tuple[bool, list]:
+            try:
+                new_values = self.render_queue.get(block=False)
+                self.instrument.dequeued(new_values)
+                values += new_values
+                return False, values
+            except QueueEmpty:
+                return True, values
+
+        def wait_values(self, timeout) -> None:
+            self.render_queue.wait(timeout)
+
+        def do_exit(self):
+            self.exit_event.set()
+            self.render_queue.close()
+
+    return ThreadRendr
+
+
+ThreadReader = create_thread_reader(Reader)
+ThreadRenderer = create_thread_renderer(DocumentRenderer)
+
+
+def start_terminal_threaded(renderer=None, reader=None, replace_dict: dict[str, str | tuple[int, str]] = None,
+                            special_slash_fn: Callable[[int, list, list], tuple[list, list]] = None,
+                            replace_dict_add: bool = True, overwrite: bool = False,
+                            welcome_message="Welcome to Sancty Text!", renderer_options: dict = None,
+                            reader_options: dict = None, instrument: Instrument = None, open_path: str = None,
+                            save_path: str = None, journal_path: str = None, queue_capacity=1024):
+    """Run the editor in this process, with the reader in the calling thread and the renderer in a thread of its own.
+
+    Called from the main thread, the reader is notified of resizes by SIGWINCH, otherwise it polls the size.
+    """
+    if renderer_options is None:
+        renderer_options = {}
+    if reader_options is None:
+        reader_options = {}
+    if instrument is not None:
+        reader_options = {**reader_options, 'stamp': True}
+        renderer_options = {**renderer_options, 'instrument': instrument}
+    if open_path is not None or save_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'open_path': open_path, 'save_path': save_path}
+    if journal_path is not None:
+        renderer_options = {'viewport': True, **renderer_options, 'journal_path': journal_path}
+    reader_cls = create_thread_reader(reader) if reader is not None else ThreadReader
+    renderer_cls = create_thread_renderer(renderer) if renderer is not None else ThreadRenderer
+
+    render_queue = KeyQueue(queue_capacity)
+    exit_event = Event()
+    resizing = Event()
+
+    term = Terminal()
+
+    print(welcome_message)
+    print("Press 'ESC', 'CTRL+C' or 'CTRL+D' to quit. "
+          "Type \\help for a list of '\\\\' commands (also clears all text).")
+    if open_path is not None or save_path is not None:
+        print(f"Press 'CTRL+S' to save to {open_path if save_path is None else save_path}.")
+    if journal_path is not None and os.path.exists(journal_path):
+        print(f"Recovering the text from {journal_path}.")
+    print("\n" * 20 + term.move_x(0) + term.move_up(20))
+
+    reader_inst: ReaderProtocol = reader_cls(term, render_queue, exit_event, resizing, **reader_options)
+    renderer_inst: RendererProtocol = renderer_cls(term, render_queue, exit_event, resizing, replace_dict,
+                                                   special_slash_fn, replace_dict_add, overwrite, **renderer_options)
+    render_thread = threading.Thread(target=renderer_inst.print_terminal, name='sancty-renderer')
+    render_thread.start()
+    try:
+        reader_inst.read_terminal()
+    finally:
+        # The renderer might still be waiting for the reader, which has stopped
+        exit_event.set()
+        render_queue.close()
+        render_thread.join()
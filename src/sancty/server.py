@@ -0,0 +1,650 @@
+import io
+import os
+import sys
+import json
+import codecs
+import socket
+import struct
+import signal
+import selectors
+import contextlib
+import multiprocessing as mp
+from blessed.terminal import WINSZ
+from sancty.deps_types import Terminal, tm, Optional, Callable
+from sancty.editor import DocumentRenderer
+from sancty.render import ExternalError
+from sancty.reflow import close_pool
+from sancty.messages import Resize, Paste
+from sancty.instrument import Histogram
+from sancty.keys import KeyDecoder
+from sancty.patch_blessed.terminal import BRACKETED_PASTE_ON, BRACKETED_PASTE_OFF, PASTE_END
+
+# Frames sent by clients, a kind and the length of the payload that follows
+_FRAME = struct.Struct('<BI')
+_SIZE = struct.Struct('<HH')
+HELLO = ord('H')
+KEYS = ord('K')
+SIZE = ord('Z')
+
+# Messages between the server and its workers, which are sent over sequenced packet sockets and need no framing
+_NEW_SESSION = b'S'
+_CLOSED = b'C'
+_STATS = b'Q'
+_REPORT = b'R'
+_STOP = b'X'
+_MAX_MESSAGE = 1 << 20
+
+
+def encode_frame(kind: int, payload: bytes = b'') -> bytes:
+    return _FRAME.pack(kind, len(payload)) + payload
+
+
+class FrameReader:
+    """Splits the bytes of a stream into frames, however they arrive.
+
+    A frame header with a payload longer than max_length raises ValueError, so that a client cannot make the frame
+    it is sending be buffered without bound.
+    """
+
+    def __init__(self, max_length=_MAX_MESSAGE):
+        self.buffer = bytearray()
+        self.max_length = max_length
+
+    def feed(self, data) -> list[tuple[int, bytes]]:
+        self.buffer += data
+        frames = []
+        pos = 0
+        while len(self.buffer) - pos >= _FRAME.size:
+            kind, length = _FRAME.unpack_from(self.buffer, pos)
+            if length > self.max_length:
+                raise ValueError(f"Frame of {length} bytes is longer than {self.max_length} bytes!")
+            end = pos + _FRAME.size + length
+            if end > len(self.buffer):
+                break
+            frames.append((kind, bytes(self.buffer[pos + _FRAME.size:end])))
+            pos = end
+        del self.buffer[:pos]
+        return frames
+
+
+def parse_hello(kind: int, payload: bytes) -> dict:
+    """Hello a client sent as its first frame, raises ValueError if it is not a valid one."""
+    if kind != HELLO:
+        raise ValueError("Expected a hello!")
+    try:
+        hello = json.loads(payload)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid hello: {e}!")
+    if not isinstance(hello, dict):
+        raise ValueError("A hello must be an object!")
+    for name in ('rows', 'cols'):
+        size = hello.get(name, 1)
+        if not isinstance(size, int) or isinstance(size, bool) or not 0 < size < 1 << 16:
+            raise ValueError(f"Invalid {name} in hello!")
+    for name in ('open_path', 'save_path'):
+        if not isinstance(hello.get(name), (str, type(None))):
+            raise ValueError(f"Invalid {name} in hello!")
+    return hello
+
+
+def confine_paths(hello: dict, root: Optional[str]) -> dict:
+    """Hello with the paths a client asked for resolved under root, raises ValueError if any of them is outside it.
+
+    The server opens and saves files with its own privileges, so without a root clients cannot name any file at all.
+    """
+    paths = {name: hello.get(name) for name in ('open_path', 'save_path') if hello.get(name) is not None}
+    if not paths:
+        return hello
+    if root is None:
+        raise ValueError("This server does not open or save files!")
+    root = os.path.realpath(root)
+    for name, path in paths.items():
+        # Symbolic links are resolved first, so that they cannot point out of root
+        resolved = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, resolved]) != root:
+            raise ValueError(f"{path} is outside of {root}!")
+        paths[name] = resolved
+    return {**hello, **paths}
+
+
+def resident_bytes() -> Optional[int]:
+    """Resident memory of this process, where /proc is available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class SessionTerminal(Terminal):
+    """Terminal of a session, which has the size its client reports and is written to through the session."""
+
+    def __init__(self, height, width, kind='xterm-256color'):
+        self.size = (height, width)
+        super().__init__(kind=kind, force_styling=True, stream=io.StringIO())
+
+    def _height_and_width(self):
+        height, width = self.size
+        return WINSZ(ws_row=height, ws_col=width, ws_xpixel=0, ws_ypixel=0)
+
+
+class SessionReader:
+    """Decodes the keyboard input a client sends into the values a Reader would send, without a terminal to read.
+
+    A prefix of a key sequence (like a lone escape) at the end of the input is only decoded as keys of its own once
+    no more input arrived for esc_delay seconds. A bracketed paste becomes a single Paste once its end arrived.
+    """
+    deadline: Optional[float]
+
+    def __init__(self, term: Terminal, esc_delay=0.035):
+        self.term = term
+        self.esc_delay = esc_delay
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.key_decoder = KeyDecoder(term)
+        self.text = ''
+        self.paste: Optional[list[str]] = None
+        self.deadline = None
+        self.exited = False
+
+    def feed(self, data: bytes, now: float) -> list:
+        self.text += self.decoder.decode(data)
+        return self.decode(now, final=False)
+
+    def expire(self, now: float) -> list:
+        if self.deadline is None or now < self.deadline:
+            return []
+        return self.decode(now, final=True)
+
+    def decode(self, now, final) -> list:
+        values = []
+        text = self.text
+        self.deadline = None
+        while text and not self.exited:
+            if self.paste is not None:
+                end = text.find(PASTE_END)
+                if end == -1:
+                    # Only what cannot be the start of the end marker is part of the paste for sure
+                    keep = next((k for k in range(min(len(text), len(PASTE_END) - 1), 0, -1)
+                                 if PASTE_END.startswith(text[-k:])), 0)
+                    self.paste.append(text[:len(text) - keep])
+                    text = text[len(text) - keep:]
+                    break
+                self.paste.append(text[:end])
+                text = text[end + len(PASTE_END):]
+                pasted = ''.join(self.paste)
+                self.paste = None
+                values.append(Paste(pasted.replace('\r\n', '\n').replace('\r', '\n')))
+                continue
+            keys, text = self.key_decoder.decode(text, final)
+            for key in keys:
+                if key == chr(3) or key == chr(4) or key.code == self.term.KEY_ESCAPE:
+                    self.exited = True
+                    break
+                if key.code == self.term.KEY_PASTE_BEGIN:
+                    self.paste = []
+                else:
+                    values.append(key)
+            if self.paste is None:
+                # What is left is the start of a sequence that might still be completed
+                if text and not self.exited:
+                    self.deadline = now + self.esc_delay
+                break
+        self.text = text
+        return values
+
+
+class Session:
+    """A client connection with the text, renderer and key decoder of its editor.
+
+    The renderer writes to a buffer while it handles the session's values and paints, which is then sent to the
+    client. For every value, the time from receiving it to sending the frame that shows it is recorded.
+    """
+    renderer: DocumentRenderer
+
+    def __init__(self, session_id, sock: socket.socket, hello: dict, renderer_args: tuple, renderer_options: dict,
+                 welcome_message: str):
+        self.id = session_id
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.term = SessionTerminal(hello.get('rows', 24), hello.get('cols', 80))
+        self.frames = FrameReader()
+        self.reader = SessionReader(self.term)
+        self.output = io.StringIO()
+        self.outgoing = bytearray()
+        self.values = []
+        self.received: list[int] = []
+        self.latency = Histogram()
+        self.keys = 0
+        self.closed = False
+        options = dict(renderer_options)
+        if hello.get('open_path') is not None or hello.get('save_path') is not None:
+            options = {'viewport': True, **options, 'open_path': hello.get('open_path'),
+                       'save_path': hello.get('save_path')}
+        # The painter keeps writing to the stream that is stdout while it is created
+        with contextlib.redirect_stdout(self.output):
+            lines = [welcome_message, "Press 'ESC', 'CTRL+C' or 'CTRL+D' to quit. "
+                                      "Type \\help for a list of '\\\\' commands (also clears all text)."]
+            if options.get('save_path') is not None or options.get('open_path') is not None:
+                lines.append(f"Press 'CTRL+S' to save to {options.get('save_path') or options.get('open_path')}.")
+            # The client terminal is in raw mode, where a newline does not return to the start of the line
+            print('\r\n'.join(lines) + '\r\n' + '\n' * 20 + self.term.move_x(0) + self.term.move_up(20) +
+                  BRACKETED_PASTE_ON, end='')
+            self.renderer = DocumentRenderer(self.term, *renderer_args, **options)
+            if len(self.renderer.document) > 1 or self.renderer.document.chars > 0:
+                self.renderer.paint()
+        self.take_output()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def receive(self):
+        try:
+            data = self.sock.recv(1 << 16)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.closed = True
+            return
+        now = tm.monotonic()
+        try:
+            for kind, payload in self.frames.feed(data):
+                if kind == KEYS:
+                    self.add(self.reader.feed(payload, now))
+                elif kind == SIZE:
+                    height, width = _SIZE.unpack(payload)
+                    self.term.size = (height, width)
+                    self.add([Resize(height, width)])
+        except Exception as e:
+            self.fail(e)
+            return
+        if self.reader.exited:
+            self.close()
+
+    def add(self, values):
+        self.values += values
+        self.received += [tm.monotonic_ns()] * len(values)
+
+    def expire(self, now):
+        try:
+            self.add(self.reader.expire(now))
+        except Exception as e:
+            self.fail(e)
+            return
+        if self.reader.exited:
+            self.close()
+
+    def render(self):
+        """Handle all values that were received and paint a single frame for them."""
+        if not self.values or self.closed:
+            return
+        try:
+            with contextlib.redirect_stdout(self.output):
+                for val in self.values:
+                    self.renderer.handle_value(val)
+                self.renderer.paint()
+        except Exception as e:
+            self.fail(e)
+            return
+        self.values = []
+        self.take_output()
+        self.send()
+        now = tm.monotonic_ns()
+        for received in self.received:
+            self.latency.record(now - received)
+        self.keys += len(self.received)
+        self.received = []
+
+    def take_output(self):
+        text = self.output.getvalue()
+        if text:
+            self.outgoing += text.encode('utf-8')
+            self.output.seek(0)
+            self.output.truncate()
+
+    def send(self):
+        while self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.outgoing.clear()
+                self.closed = True
+                return
+            del self.outgoing[:sent]
+
+    def fail(self, e: Exception):
+        """Close this session because handling its input failed, and tell its client why."""
+        self.values = []
+        self.received = []
+        self.take_output()
+        self.outgoing += f"\r\nSession stopped: {e!r}\r\n".encode()
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.outgoing += BRACKETED_PASTE_OFF.encode()
+        self.closed = True
+        self.sock.setblocking(True)
+        with contextlib.suppress(OSError):
+            self.sock.sendall(self.outgoing)
+        self.outgoing.clear()
+
+    def stats(self) -> dict:
+        document = self.renderer.document
+        memory = (document.memory_size() + sum(map(sys.getsizeof, self.renderer.painter.frame)) +
+                  len(self.outgoing) + sys.getsizeof(self.reader.text))
+        return {
+            'id': self.id,
+            'keys': self.keys,
+            'paragraphs': len(document),
+            'memory_bytes': memory,
+            'latency_us': self.latency.summary(scale=1e3),
+        }
+
+
+class Worker:
+    """Serves the sessions the server hands to it, in a single thread that waits for any of them to have input.
+
+    Values that arrive together for a session are handled at once and painted as a single frame.
+    """
+
+    def __init__(self, control: socket.socket, renderer_args: tuple, renderer_options: dict, welcome_message: str):
+        self.control = control
+        self.renderer_args = renderer_args
+        self.renderer_options = renderer_options
+        self.welcome_message = welcome_message
+        self.sessions: dict[int, Session] = {}
+        self.selector = selectors.DefaultSelector()
+
+    def run(self):
+        self.selector.register(self.control, selectors.EVENT_READ)
+        running = True
+        while running:
+            deadlines = [s.reader.deadline for s in self.sessions.values() if s.reader.deadline is not None]
+            timeout = None if not deadlines else max(min(deadlines) - tm.monotonic(), 0)
+            touched = set()
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.control:
+                    running = self.control_ready()
+                    continue
+                session: Session = key.data
+                if mask & selectors.EVENT_WRITE:
+                    session.send()
+                if mask & selectors.EVENT_READ:
+                    session.receive()
+                touched.add(session)
+            if deadlines:
+                now = tm.monotonic()
+                for session in self.sessions.values():
+                    if session.reader.deadline is not None and session.reader.deadline <= now:
+                        session.expire(now)
+                        touched.add(session)
+            for session in touched:
+                session.render()
+                if session.closed:
+                    self.remove(session)
+                else:
+                    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if session.outgoing else 0)
+                    self.selector.modify(session, events, session)
+        for session in list(self.sessions.values()):
+            session.close()
+            self.remove(session)
+        close_pool()
+
+    def control_ready(self) -> bool:
+        """Handle a message from the server, and return False once the server is gone."""
+        try:
+            message, fds, _flags, _address = socket.recv_fds(self.control, _MAX_MESSAGE, 1)
+        except OSError:
+            return False
+        if not message or message == _STOP:
+            return False
+        kind, payload = message[:1], message[1:]
+        if kind == _NEW_SESSION:
+            hello = json.loads(payload)
+            sock = socket.socket(fileno=fds[0])
+            try:
+                session = Session(hello['id'], sock, hello, self.renderer_args, self.renderer_options,
+                                  self.welcome_message)
+            except Exception as e:
+                with contextlib.suppress(OSError):
+                    sock.sendall(f"Could not start the session: {e}\r\n".encode())
+                sock.close()
+                self.control.send(_CLOSED)
+                return True
+            self.sessions[session.id] = session
+            session.send()
+            self.selector.register(session, selectors.EVENT_READ | (selectors.EVENT_WRITE if session.outgoing else 0),
+                                   session)
+        elif kind == _STATS:
+            report = {'pid': os.getpid(), 'rss_bytes': resident_bytes(),
+                      'sessions': [session.stats() for session in self.sessions.values()]}
+            self.control.send(_REPORT + json.dumps(report).encode())
+        return True
+
+    def remove(self, session: Session):
+        self.selector.unregister(session)
+        session.sock.close()
+        del self.sessions[session.id]
+        with contextlib.suppress(OSError):
+            self.control.send(_CLOSED)
+
+
+def worker_start(control, renderer_args, renderer_options, welcome_message):
+    # Stopping the server is up to the server process, which closes the control socket
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Worker(control, renderer_args, renderer_options, welcome_message).run()
+
+
+class StatsRequest:
+    """A client that asked for stats, which waits for the report of every worker and then for its reply to be sent."""
+
+    def __init__(self, conn: socket.socket, workers: int):
+        self.conn = conn
+        self.reports: list[Optional[dict]] = [None] * workers
+        self.outgoing = bytearray()
+
+    def report(self, worker: int, report: dict) -> bool:
+        """Add the report of a worker, returns whether all workers have reported and the reply is ready."""
+        self.reports[worker] = report
+        if any(report is None for report in self.reports):
+            return False
+        sessions = [session for report in self.reports for session in report['sessions']]
+        stats = {'server_rss_bytes': resident_bytes(), 'workers': self.reports, 'session_count': len(sessions)}
+        self.outgoing += json.dumps(stats).encode()
+        return True
+
+    def send(self) -> bool:
+        """Send as much of the reply as the client takes, returns whether it is done with."""
+        try:
+            sent = self.conn.send(self.outgoing)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+        del self.outgoing[:sent]
+        return not self.outgoing
+
+
+def serve(path: str, workers: int = 4, renderer_options: dict = None,
+          replace_dict: dict[str, str | tuple[int, str]] = None,
+          special_slash_fn: Callable[[int, list, list], tuple[list, list]] = None, replace_dict_add: bool = True,
+          overwrite: bool = False, welcome_message="Welcome to Sancty Text!", start_method: str = None,
+          root: str = None):
+    """Serve editor sessions to clients that connect to a Unix domain socket at path, until interrupted.
+
+    Every session is handed to the worker process that serves the fewest sessions, which keeps its text and renders
+    it. A client that sends a stats hello instead gets a JSON report of the memory and key latency of every session.
+    Only the user running the server can connect to the socket. Sessions can only open and save files under root, and
+    none at all without it.
+
+    Sessions wrap their paragraphs in their worker, unless renderer_options set reflow_workers. A pool for every worker
+    starts workers times the available cores processes, which compete for the same cores, and a worker that waits
+    for its pool holds up its other sessions either way.
+    """
+    renderer_options = {'reflow_workers': 1, **(renderer_options or {})}
+    renderer_args = (replace_dict, special_slash_fn, replace_dict_add, overwrite)
+    ctx = mp.get_context(start_method)
+    controls = []
+    processes = []
+    for _ in range(workers):
+        server_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Workers are not daemonic, so they can start the pool of a parallel reflow. They are stopped below instead
+        process = ctx.Process(target=worker_start, args=(worker_end, renderer_args, renderer_options,
+                                                          welcome_message))
+        process.start()
+        worker_end.close()
+        controls.append(server_end)
+        processes.append(process)
+    loads = [0] * workers
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The socket is created with the permissions the umask leaves, so no other user can connect before it is listening
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(128)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    for k, control in enumerate(controls):
+        selector.register(control, selectors.EVENT_READ, k)
+    next_id = 0
+    # Stats requests that still wait for the report of a worker
+    stats_requests: list[StatsRequest] = []
+    try:
+        while True:
+            for key, _mask in selector.select():
+                if key.fileobj is listener:
+                    conn, _address = listener.accept()
+                    # The hello is read as it arrives, so a slow client does not hold up the others
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ, FrameReader())
+                elif isinstance(key.data, FrameReader):
+                    conn = key.fileobj
+                    try:
+                        data = conn.recv(1 << 16)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError:
+                        data = b''
+                    try:
+                        frames = key.data.feed(data)
+                        if not frames and data:
+                            continue
+                        hello = confine_paths(parse_hello(*frames[0]), root) if frames else None
+                    except ValueError as e:
+                        hello = None
+                        with contextlib.suppress(OSError):
+                            conn.send(f"{e}\r\n".encode())
+                    selector.unregister(conn)
+                    if hello is None:
+                        conn.close()
+                    elif hello.get('kind') == 'stats':
+                        # Workers report through the selector, and the reply is sent once the client can take it
+                        request = StatsRequest(conn, workers)
+                        stats_requests.append(request)
+                        for control in controls:
+                            control.send(_STATS)
+                    else:
+                        worker = loads.index(min(loads))
+                        hello['id'] = next_id
+                        next_id += 1
+                        conn.setblocking(True)
+                        socket.send_fds(controls[worker], [_NEW_SESSION + json.dumps(hello).encode()],
+                                        [conn.fileno()])
+                        loads[worker] += 1
+                        conn.close()
+                elif isinstance(key.data, StatsRequest):
+                    if key.data.send():
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                else:
+                    message = key.fileobj.recv(_MAX_MESSAGE)
+                    if message == _CLOSED:
+                        loads[key.data] -= 1
+                    elif message[:1] == _REPORT:
+                        # Every worker answers requests in the order they were sent
+                        request = next(r for r in stats_requests if r.reports[key.data] is None)
+                        if request.report(key.data, json.loads(message[1:])):
+                            stats_requests.remove(request)
+                            selector.register(request.conn, selectors.EVENT_WRITE, request)
+                    elif not message:
+                        raise ExternalError(f"Worker {key.data} stopped!")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for key in list(selector.get_map().values()):
+            if isinstance(key.data, (FrameReader, StatsRequest)):
+                key.fileobj.close()
+        for request in stats_requests:
+            request.conn.close()
+        selector.close()
+        listener.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        # Forked workers hold the server end of the control sockets of the ones before them, so closing is not enough
+        for control in controls:
+            with contextlib.suppress(OSError):
+                control.send(_STOP)
+            control.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def request_stats(path: str) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(encode_frame(HELLO, json.dumps({'kind': 'stats'}).encode()))
+        data = b''
+        while chunk := sock.recv(1 << 16):
+            data += chunk
+    return json.loads(data)
+
+
+def connect(path: str, open_path: str = None, save_path: str = None):
+    """Run a session of the server at path in this terminal, until the session ends."""
+    term = Terminal()
+    if term._keyboard_fd is None:
+        raise ValueError("Connecting requires stdin and stdout to be a terminal!")
+    resized = []
+    hello = {'kind': 'session', 'rows': term.height, 'cols': term.width,
+             'open_path': None if open_path is None else os.path.abspath(open_path),
+             'save_path': None if save_path is None else os.path.abspath(save_path)}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(encode_frame(HELLO, json.dumps(hello).encode()))
+        previous_handler = signal.signal(signal.SIGWINCH, lambda _signum, _frame: resized.append(True))
+        out_fd = sys.stdout.fileno()
+        try:
+            with term.raw():
+                with selectors.DefaultSelector() as selector:
+                    selector.register(term._keyboard_fd, selectors.EVENT_READ)
+                    selector.register(sock, selectors.EVENT_READ)
+                    while True:
+                        ready = selector.select(0.05)
+                        if resized:
+                            resized.clear()
+                            sock.sendall(encode_frame(SIZE, _SIZE.pack(term.height, term.width)))
+                        for key, _mask in ready:
+                            if key.fileobj is sock:
+                                data = sock.recv(1 << 16)
+                                if not data:
+                                    return
+                                while data:
+                                    data = data[os.write(out_fd, data):]
+                            else:
+                                sock.sendall(encode_frame(KEYS, os.read(term._keyboard_fd, 1 << 16)))
+        finally:
+            signal.signal(signal.SIGWINCH, previous_handler)
+            print()
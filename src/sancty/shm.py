@@ -0,0 +1,226 @@
+import pickle
+import struct
+import contextlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from blessed.keyboard import Keystroke
+from sancty.deps_types import tm, QueueEmpty
+
+_WRITE_POS = 0
+_READ_POS = 8
+_PUT_COUNT = 16
+_GET_COUNT = 24
+_FLAGS = 32
+_DATA = 64
+
+_U64 = struct.Struct('<Q')
+_RECORD = struct.Struct('<I')
+_KEY = struct.Struct('<HBH')
+_PICKLED = struct.Struct('<I')
+
+_KIND_KEY = 0
+_KIND_PICKLED = 1
+_NO_CODE = 0xFFFF
+_MORE_FRAGMENTS = 1 << 31
+
+EXIT_FLAG = 0
+RESIZING_FLAG = 1
+
+
+def encode_values(values) -> bytes:
+    """Encode a list of Keystrokes compactly, anything else in the list is pickled."""
+    encoded = bytearray()
+    for val in values:
+        if isinstance(val, Keystroke) and (val.code is None or val.code < _NO_CODE):
+            text = str(val).encode('utf-8')
+            name = val.name.encode('ascii') if val.name is not None else b''
+            encoded.append(_KIND_KEY)
+            encoded += _KEY.pack(_NO_CODE if val.code is None else val.code, len(name), len(text))
+            encoded += name
+            encoded += text
+        else:
+            pickled = pickle.dumps(val)
+            encoded.append(_KIND_PICKLED)
+            encoded += _PICKLED.pack(len(pickled))
+            encoded += pickled
+    return bytes(encoded)
+
+
+def decode_values(encoded) -> list:
+    values = []
+    pos = 0
+    end = len(encoded)
+    while pos < end:
+        kind = encoded[pos]
+        pos += 1
+        if kind == _KIND_KEY:
+            code, name_len, text_len = _KEY.unpack_from(encoded, pos)
+            pos += _KEY.size
+            name = bytes(encoded[pos:pos + name_len]).decode('ascii') if name_len else None
+            pos += name_len
+            text = bytes(encoded[pos:pos + text_len]).decode('utf-8')
+            pos += text_len
+            values.append(Keystroke(text, None if code == _NO_CODE else code, name))
+        else:
+            (length,) = _PICKLED.unpack_from(encoded, pos)
+            pos += _PICKLED.size
+            values.append(pickle.loads(encoded[pos:pos + length]))
+            pos += length
+    return values
+
+
+class ShmQueue:
+    """Lock-free single producer, single consumer ring buffer of value batches in shared memory.
+
+    Offers the put/get/qsize subset of Queue used by the process reader and renderer, and wait, with which the
+    renderer blocks until a batch arrives instead of sleeping for a fixed time. The producer only ever writes the
+    write position and the consumer only the read position, each after the data they guard. Batches that do not fit
+    in the buffer at once are written in fragments as the consumer makes room.
+
+    Shared memory has nothing to block on, so the producer also releases the wakeup semaphore, which holds at most a
+    single release, whenever it wrote to the ring.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, wakeup):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = shm.size - _DATA
+        self.wakeup = wakeup
+        self._partial = bytearray()
+
+    def __getstate__(self):
+        return self.shm.name, self.wakeup
+
+    def __setstate__(self, state):
+        name, wakeup = state
+        # Child processes share the resource tracker of the process that created the block, which unlinks it
+        self.__init__(shared_memory.SharedMemory(name=name), wakeup)
+
+    def _get(self, offset) -> int:
+        return _U64.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        _U64.pack_into(self.buf, offset, value)
+
+    def _write(self, pos, data):
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buf[_DATA + start:_DATA + start + first] = data[:first]
+        if first < len(data):
+            self.buf[_DATA:_DATA + len(data) - first] = data[first:]
+
+    def _read(self, pos, length) -> bytes:
+        start = pos % self.capacity
+        first = min(length, self.capacity - start)
+        data = bytes(self.buf[_DATA + start:_DATA + start + first])
+        if first < length:
+            data += bytes(self.buf[_DATA:_DATA + length - first])
+        return data
+
+    def put(self, values, block=True):
+        encoded = encode_values(values)
+        max_fragment = self.capacity // 2 - _RECORD.size
+        write_pos = self._get(_WRITE_POS)
+        start = 0
+        while True:
+            fragment = encoded[start:start + max_fragment]
+            more = start + max_fragment < len(encoded)
+            needed = _RECORD.size + len(fragment)
+            while write_pos + needed - self._get(_READ_POS) > self.capacity:
+                if not block:
+                    raise BufferError("Shared memory queue is full!")
+                tm.sleep(0.0005)
+            self._write(write_pos, _RECORD.pack(len(fragment) | (_MORE_FRAGMENTS if more else 0)))
+            self._write(write_pos + _RECORD.size, fragment)
+            write_pos += needed
+            self._set(_WRITE_POS, write_pos)
+            # Released too many times only means that the consumer has not woken up yet
+            with contextlib.suppress(ValueError):
+                self.wakeup.release()
+            start += max_fragment
+            if not more:
+                break
+        self._set(_PUT_COUNT, self._get(_PUT_COUNT) + 1)
+
+    def get(self, block=False):
+        while True:
+            read_pos = self._get(_READ_POS)
+            if read_pos == self._get(_WRITE_POS):
+                if not block:
+                    raise QueueEmpty
+                self.wait(0.01)
+                continue
+            (header,) = _RECORD.unpack(self._read(read_pos, _RECORD.size))
+            length = header & ~_MORE_FRAGMENTS
+            self._partial += self._read(read_pos + _RECORD.size, length)
+            self._set(_READ_POS, read_pos + _RECORD.size + length)
+            if not header & _MORE_FRAGMENTS:
+                encoded = bytes(self._partial)
+                self._partial.clear()
+                self._set(_GET_COUNT, self._get(_GET_COUNT) + 1)
+                return decode_values(encoded)
+
+    def wait(self, timeout: float) -> bool:
+        """Wait at most timeout seconds until a batch can be taken."""
+        deadline = tm.perf_counter() + timeout
+        while self._get(_READ_POS) == self._get(_WRITE_POS):
+            remaining = deadline - tm.perf_counter()
+            # A release can be left over from a batch that was taken without waiting, so the ring is checked again
+            if remaining <= 0 or not self.wakeup.acquire(timeout=remaining):
+                return self._get(_READ_POS) != self._get(_WRITE_POS)
+        return True
+
+    def qsize(self) -> int:
+        # The put count is written after the write position, so for a moment it can lag behind the get count
+        return max(self._get(_PUT_COUNT) - self._get(_GET_COUNT), 0)
+
+
+class ShmEvent:
+    """Event-like flag stored in a single byte of shared memory."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, index: int):
+        self.shm = shm
+        self.index = index
+
+    def __getstate__(self):
+        return self.shm.name, self.index
+
+    def __setstate__(self, state):
+        name, index = state
+        self.__init__(shared_memory.SharedMemory(name=name), index)
+
+    def set(self):
+        self.shm.buf[_FLAGS + self.index] = 1
+
+    def clear(self):
+        self.shm.buf[_FLAGS + self.index] = 0
+
+    def is_set(self) -> bool:
+        return self.shm.buf[_FLAGS + self.index] == 1
+
+
+class ShmTransport:
+    """A ShmQueue for the rendered values and the exit and resizing events, all in one shared memory block.
+
+    The wakeup semaphore of the queue is created by ctx, which has to be the context that starts the processes.
+    """
+    queue: ShmQueue
+    exit_event: ShmEvent
+    resizing_event: ShmEvent
+
+    def __init__(self, capacity=1 << 20, ctx=None):
+        if ctx is None:
+            ctx = mp.get_context()
+        self.shm = shared_memory.SharedMemory(create=True, size=_DATA + capacity)
+        self.shm.buf[:_DATA] = bytes(_DATA)
+        # A semaphore that holds at most one release, and none to start with
+        wakeup = ctx.BoundedSemaphore(1)
+        wakeup.acquire()
+        self.queue = ShmQueue(self.shm, wakeup)
+        self.exit_event = ShmEvent(self.shm, EXIT_FLAG)
+        self.resizing_event = ShmEvent(self.shm, RESIZING_FLAG)
+
+    def close(self):
+        self.queue.buf = None
+        self.shm.close()
+        self.shm.unlink()
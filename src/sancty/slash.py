@@ -0,0 +1,93 @@
+from sancty.deps_types import Optional
+
+
+class SlashNode:
+    __slots__ = ('children', 'key', 'value')
+
+    def __init__(self):
+        self.children: dict[str, SlashNode] = {}
+        # Key that ends at this node, if any
+        self.key: Optional[str] = None
+        self.value = None
+
+
+class SlashTrie:
+    """Prefix trie of the keys of a replace dict, walked one typed character at a time.
+
+    Advancing from one node to the next costs the same no matter how many keys there are, and a prefix that no key
+    starts with (a dead prefix) is known as soon as it is typed.
+    """
+    root: SlashNode
+
+    def __init__(self, replace_dict: dict[str, str | tuple[int, str]]):
+        self.root = SlashNode()
+        self.replace_dict = replace_dict
+        self._help = {}
+        for key, value in replace_dict.items():
+            node = self.root
+            for char in key:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = SlashNode()
+                node = child
+            node.key = key
+            node.value = value
+
+    @staticmethod
+    def step(node: Optional[SlashNode], char: str) -> Optional[SlashNode]:
+        return None if node is None else node.children.get(char)
+
+    def find(self, prefix: str) -> Optional[SlashNode]:
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def completions(self, prefix: str, limit=10) -> list[str]:
+        """Up to limit keys that start with prefix, in depth-first order."""
+        node = self.find(prefix)
+        keys = []
+        stack = [] if node is None else [node]
+        while stack and len(keys) < limit:
+            node = stack.pop()
+            if node.key is not None:
+                keys.append(node.key)
+            stack.extend(reversed(node.children.values()))
+        return keys
+
+    def expand(self, text: str) -> str:
+        """Replace all slash commands in text that map to a string, like they are replaced while typing.
+
+        Commands that map to a number are left as they are.
+        """
+        if '\\' not in text:
+            return text
+        parts = []
+        copied = 0
+        i = text.find('\\')
+        while i != -1:
+            node = self.root
+            j = i + 1
+            while j < len(text) and text[j] != '\\' and not text[j].isspace():
+                node = node.children.get(text[j])
+                if node is None:
+                    break
+                j += 1
+                if node.key is not None:
+                    if isinstance(node.value, str):
+                        parts += [text[copied:i], node.value]
+                        copied = j
+                    break
+            i = text.find('\\', max(j, i + 1))
+        parts.append(text[copied:])
+        return ''.join(parts)
+
+    def help_lines(self, end='') -> list[str]:
+        """One line describing every key, built only once."""
+        lines = self._help.get(end)
+        if lines is None:
+            lines = self._help[end] = [f'{key} : {value[-1] if isinstance(value, tuple) else value}{end}'
+                                       for key, value in self.replace_dict.items()]
+        return lines.copy()
@@ -0,0 +1,44 @@
+import re
+from itertools import accumulate
+from cwcwidth import wcswidth
+
+# Every terminal sequence contains at least one of these, so text without them can skip sequence parsing
+_CONTROL = re.compile('[\x00-\x1f\x7f]')
+
+_widths: dict[str, int] = {}
+
+
+def has_control(text: str) -> bool:
+    return _CONTROL.search(text) is not None
+
+
+def char_width(char: str) -> int:
+    """Width of a single character as given by wcswidth, cached per code point."""
+    width = _widths.get(char)
+    if width is None:
+        width = _widths[char] = wcswidth(char)
+    return width
+
+
+def text_width(text: str) -> int:
+    """Width of text as given by wcswidth, so -1 if it contains non-printable characters."""
+    if text.isascii() and text.isprintable():
+        return len(text)
+    return wcswidth(text)
+
+
+def display_width(text: str) -> int:
+    """Width of text in which non-printable characters take up no columns."""
+    if text.isascii() and text.isprintable():
+        return len(text)
+    width = wcswidth(text)
+    if width >= 0:
+        return width
+    return sum(max(char_width(char), 0) for char in text)
+
+
+def cumulative_widths(text: str) -> list[int]:
+    """Display width of every prefix of text, the k-th entry is the width of text[:k + 1]."""
+    if text.isascii() and text.isprintable():
+        return list(range(1, len(text) + 1))
+    return list(accumulate(max(char_width(char), 0) for char in text))
@@ -0,0 +1,162 @@
+import re
+import textwrap
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from sancty.width import display_width, cumulative_widths
+
+_WORDSEP = textwrap.TextWrapper.wordsep_re
+# Text with any of these can contain sequences, tabs or line breaks, which is left to Terminal.wrap
+_SPECIAL = re.compile('[\x00-\x1f\x7f\x85\u2028\u2029]')
+
+
+class WrapCache:
+    """Paragraph-level wrap cache for the render array of a Renderer.
+
+    Wrapped paragraphs are stored by their joined text for the current width. On top of that the cache keeps
+    track of the last render array it produced, so that on the next rewrap all paragraphs that were not touched
+    since (and that are known to wrap to themselves) can be reused without joining or wrapping them again.
+    """
+    width: int | None
+    lines: list | None
+    ends: list[int]
+    stable: int
+    dirty_line: int
+
+    def __init__(self, max_entries=8192):
+        self.max_entries = max_entries
+        self.texts = OrderedDict()
+        self.width = None
+        self.lines = None
+        self.ends = []
+        self.stable = 0
+        self.dirty_line = 0
+
+    def reset(self, width):
+        self.texts.clear()
+        self.width = width
+        self.lines = None
+        self.ends = []
+        self.stable = 0
+        self.dirty_line = 0
+
+    def touch(self, line_index):
+        """Mark all lines starting at line_index as possibly changed."""
+        if line_index < self.dirty_line:
+            self.dirty_line = line_index
+
+    def clean_paragraphs(self, render_array, paragraph_ends, width) -> int:
+        """Number of leading paragraphs that can be reused from the previous rewrap."""
+        if width != self.width or render_array is not self.lines:
+            return 0
+        k = min(self.stable, bisect_left(self.ends, self.dirty_line), len(paragraph_ends))
+        # Paragraph ends are only ever appended or popped at the tail, so comparing the last shared end suffices
+        while k > 0 and paragraph_ends[k - 1] != self.ends[k - 1]:
+            k -= 1
+        return k
+
+    def wrap(self, text, wrap_fn) -> list[str]:
+        wrapped = self.texts.get(text)
+        if wrapped is None:
+            wrapped = tuple(wrap_fn(text))
+            self.texts[text] = wrapped
+            if len(self.texts) > self.max_entries:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(text)
+        return list(wrapped)
+
+    def wrap_all(self, texts, wrap_many) -> list[list[str]]:
+        """Wrapped lines of every text in texts, where wrap_many wraps all texts that are not cached at once."""
+        found = {}
+        for text in texts:
+            wrapped = self.texts.get(text)
+            if wrapped is not None:
+                self.texts.move_to_end(text)
+                found[text] = wrapped
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            for text, wrapped in zip(missing, wrap_many(missing)):
+                found[text] = self.texts[text] = tuple(wrapped)
+            while len(self.texts) > self.max_entries:
+                self.texts.popitem(last=False)
+        return [list(found[text]) for text in texts]
+
+    def store(self, lines, ends, stable, width):
+        self.width = width
+        self.lines = lines
+        self.ends = ends.copy()
+        self.stable = stable
+        self.dirty_line = len(lines)
+
+    def rows(self, render_array, width) -> int | None:
+        """Rows taken up by render_array at width, or None if it is not the array last produced at width."""
+        if width != self.width or render_array is not self.lines:
+            return None
+        # Every line was wrapped at this width, so all lines take up exactly one row
+        return len(render_array)
+
+
+class LineWrapper:
+    """Wraps text exactly like Terminal.wrap(text, width=width, drop_whitespace=False), without going through textwrap.
+
+    Every wrapped line is a piece of the text, so appending to an already wrapped paragraph only has to wrap its last
+    lines again, starting at the first line that begins with a complete word (see append_wrap).
+    """
+
+    def __init__(self, term):
+        self.term = term
+
+    def wrap(self, text, width) -> list[str]:
+        if _SPECIAL.search(text) is not None:
+            return self.term.wrap(text, width=width, drop_whitespace=False)
+        if width <= 0:
+            raise ValueError(f"Invalid wrap width {width}!")
+        if not text.strip():
+            return [''] if text else []
+        chunks = [chunk for chunk in _WORDSEP.split(text) if chunk]
+        chunks.reverse()
+        lines = []
+        while chunks:
+            line = []
+            line_width = 0
+            while chunks:
+                chunk_width = display_width(chunks[-1])
+                if line_width + chunk_width > width:
+                    break
+                line.append(chunks.pop())
+                line_width += chunk_width
+            if chunks and display_width(chunks[-1]) > width:
+                # Break the word after as many characters as still fit, but always make progress
+                chunk = chunks[-1]
+                idx = bisect_right(cumulative_widths(chunk), width - line_width)
+                if idx == 0 and not line:
+                    idx = 1
+                line.append(chunk[:idx])
+                chunks[-1] = chunk[idx:]
+            if line:
+                lines.append(''.join(line))
+        return lines
+
+    def append_wrap(self, text, lines, appended, width) -> tuple[int, list[str]]:
+        """Wrap text + appended, given the lines that text wraps to at width.
+
+        Returns the index of the first line that was wrapped again, together with the lines that replace all lines
+        starting there. Lines before a line that starts a word (after a space) which is followed by a space cannot
+        change by appending, so wrapping starts at the last such line and the cost does not depend on the length of
+        the paragraph.
+        """
+        if _SPECIAL.search(appended) is not None:
+            return 0, self.wrap(text + appended, width)
+        first = len(lines) - 1
+        followed_by_space = False
+        while first > 0:
+            line = lines[first]
+            followed_by_space = followed_by_space or ' ' in line
+            if followed_by_space and line[:1] != ' ' and lines[first - 1][-1:] == ' ':
+                break
+            first -= 1
+        tail = ''.join(lines[first:])
+        # Lines wrapped by Terminal.wrap are not always pieces of the text, but then the tail differs from it
+        if first == 0 or _SPECIAL.search(tail) is not None or not text.endswith(tail):
+            return 0, self.wrap(text + appended, width)
+        return first, self.wrap(tail + appended, width)
@@ -0,0 +1,28 @@
+from sancty.bench import WORKLOADS, run_workload, run_scaling, run_startup, run_wakeup, make_report, compare_reports
+
+
+def test_every_workload_runs_headless():
+    results = []
+    for renderer in ('document', 'legacy'):
+        for workload in WORKLOADS:
+            result = run_workload(renderer, workload, keys=150, width=30)
+            assert result['keys'] == 150
+            assert result['bytes'] > 0
+            results.append(result)
+    results += run_scaling('document', sizes=(5,), probe_keys=50)
+    report = make_report(results)
+    rows = compare_reports(report, report)
+    assert rows and all(ratio == 1 for *_values, ratio in rows)
+
+
+def test_startup_paints_opened_file():
+    result = run_startup('shm', runs=1)
+    assert result['keys'] == 1
+    assert 0 < result['p50_us'] < 10_000_000
+
+
+def test_wakeup_takes_every_batch():
+    result = run_wakeup(batches=20)
+    assert result['keys'] == 20 and result['p50_us'] > 0
+    result = run_wakeup(start_method='spawn', batches=5)
+    assert result['keys'] == 5 and result['wakeup'] == 'wait/spawn'
@@ -0,0 +1,26 @@
+import os
+import sys
+import json
+import subprocess
+import sancty
+
+
+def imported_after(code) -> set[str]:
+    """Modules that are imported in a new interpreter after running code."""
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(sancty.__file__)))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [package_parent, os.environ.get('PYTHONPATH')]))}
+    output = subprocess.run([sys.executable, '-c', f"{code}\nimport sys, json; print(json.dumps(list(sys.modules)))"],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return set(json.loads(output.splitlines()[-1]))
+
+
+def test_cli_imports_the_editor_once_it_runs():
+    modules = imported_after("import contextlib, sancty.cli\n"
+                             "with contextlib.suppress(SystemExit): sancty.cli.run(['--help'])")
+    assert not modules & {'sancty.run', 'sancty.server', 'sancty.editor', 'blessed', 'multiprocessing'}
+
+
+def test_editor_imports_files_and_processes_once_used():
+    modules = imported_after("import sancty.editor")
+    assert 'sancty.editor' in modules
+    assert not modules & {'sancty.journal', 'sancty.mapped', 'sancty.shm', 'concurrent.futures', 'multiprocessing'}
@@ -0,0 +1,133 @@
+import random
+import textwrap
+from sancty.document import Document, paragraphs_from_render
+from sancty.edits import Insert, Delete, Split, Join, apply_edits
+from sancty.wrap import LineWrapper
+
+
+def wrap(text, width):
+    return textwrap.wrap(text, width=width, drop_whitespace=False)
+
+
+def test_document_matches_list_model():
+    rnd = random.Random(0)
+    document = Document(wrap, 7)
+    model = ['']
+    for _ in range(2000):
+        op = rnd.random()
+        i = rnd.randrange(len(model))
+        if op < 0.4:
+            offset = rnd.randint(0, len(model[i]))
+            text = ''.join(rnd.choice('ab cd\n') for _ in range(rnd.randint(1, 12)))
+            document.insert_text(i, offset, text)
+            parts = text.split('\n')
+            current = model[i]
+            if len(parts) == 1:
+                model[i] = current[:offset] + text + current[offset:]
+            else:
+                model[i:i + 1] = [current[:offset] + parts[0]] + parts[1:-1] + [parts[-1] + current[offset:]]
+        elif op < 0.6:
+            document.join_paragraphs(i)
+            if i + 1 < len(model):
+                model[i:i + 2] = [model[i] + model[i + 1]]
+        elif op < 0.8:
+            offset = rnd.randint(0, len(model[i]))
+            document.split_paragraph(i, offset)
+            model[i:i + 1] = [model[i][:offset], model[i][offset:]]
+        elif op < 0.9 and len(model) > 1:
+            document.delete_paragraphs(i)
+            del model[i]
+        else:
+            document.set_width(rnd.randint(3, 12))
+
+        assert len(document) == len(model)
+        assert document.chars == sum(len(p) for p in model)
+    assert document.text() == '\n'.join(model)
+
+    lines = [line for p in model for line in (wrap(p, document.width) or [''])]
+    assert list(document.iter_lines()) == lines
+    assert document.rows == len(lines)
+    for i in range(len(model)):
+        row = document.row_of(i)
+        assert document.locate_row(row) == (i, 0)
+        assert document.char_offset(i) == sum(len(p) for p in model[:i])
+
+
+def test_append_matches_set_paragraph():
+    wrapper = LineWrapper(None)
+    document = Document(wrapper.wrap, 9, append_fn=wrapper.append_wrap)
+    expected = Document(wrapper.wrap, 9)
+    rnd = random.Random(1)
+    for _ in range(1000):
+        text = ''.join(rnd.choice('ab cd-') for _ in range(rnd.randint(1, 4)))
+        if rnd.random() < 0.05:
+            text += '\n'
+        document.append_text(text)
+        expected.set_paragraph(len(expected) - 1, expected.paragraph(len(expected) - 1) + text.rstrip('\n'))
+        if text.endswith('\n'):
+            expected.insert_paragraphs(len(expected), [''])
+        assert list(document.iter_lines()) == list(expected.iter_lines())
+        assert document.rows == expected.rows
+
+
+def test_render_round_trip():
+    document = Document(wrap, 5, ['hello world', '', 'abc'])
+    render_array, paragraph_ends = document.to_render()
+    assert paragraphs_from_render(render_array, paragraph_ends) == ['hello world', '', 'abc']
+
+
+def test_positions_round_trip():
+    rnd = random.Random(2)
+    paragraphs = ['x' + ''.join(rnd.choice('ab cd世') for _ in range(rnd.randint(0, 30))) for _ in range(50)]
+    document = Document(LineWrapper(None).wrap, 7, paragraphs)
+    for i, text in enumerate(paragraphs):
+        for offset in range(len(text) + 1):
+            row, col = document.position(i, offset)
+            assert document.locate_row(row)[0] == i
+            if offset < len(text) or col < 7:
+                assert document.locate_position(row, col) == (i, offset)
+
+
+def test_edits_match_flat_text_model():
+    rnd = random.Random(3)
+    for _ in range(200):
+        paragraphs = [''.join(rnd.choice('ab ') for _ in range(rnd.randint(0, 12))) for _ in range(rnd.randint(1, 5))]
+        document = Document(wrap, 5, paragraphs)
+        text = '\n'.join(paragraphs)
+        i = rnd.randrange(len(paragraphs))
+        cursor = (i, rnd.randint(0, len(paragraphs[i])))
+        flat_cursor = sum(len(p) + 1 for p in paragraphs[:i]) + cursor[1]
+        edits = []
+        for _ in range(rnd.randint(1, 6)):
+            current = text.split('\n')
+            j = rnd.randrange(len(current))
+            start = sum(len(p) + 1 for p in current[:j])
+            a, b = sorted(rnd.randint(0, len(current[j])) for _ in range(2))
+            match rnd.choice(['insert', 'delete', 'split', 'join']):
+                case 'insert':
+                    new = rnd.choice(['x', 'yz', 'q\nr'])
+                    edits.append(Insert(j, a, new))
+                    text = text[:start + a] + new + text[start + a:]
+                    if flat_cursor >= start + a:
+                        flat_cursor += len(new)
+                case 'delete':
+                    edits.append(Delete(j, a, b))
+                    text = text[:start + a] + text[start + b:]
+                    if flat_cursor > start + a:
+                        flat_cursor -= min(flat_cursor, start + b) - (start + a)
+                case 'split':
+                    edits.append(Split(j, a))
+                    text = text[:start + a] + '\n' + text[start + a:]
+                    if flat_cursor >= start + a:
+                        flat_cursor += 1
+                case 'join' if j + 1 < len(current):
+                    edits.append(Join(j))
+                    end = start + len(current[j])
+                    text = text[:end] + text[end + 1:]
+                    if flat_cursor > end:
+                        flat_cursor -= 1
+        cursor = apply_edits(document, edits, cursor)
+        assert document.text() == text
+        # Character offsets do not count newlines
+        assert document.char_offset(cursor[0]) + cursor[0] + cursor[1] == flat_cursor
+        assert list(document.iter_lines()) == [line for p in text.split('\n') for line in (wrap(p, 5) or [''])]
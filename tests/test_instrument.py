@@ -0,0 +1,33 @@
+import random
+from blessed.keyboard import Keystroke
+from sancty.bench import run_values
+from sancty.editor import DocumentRenderer
+from sancty.instrument import Histogram, Instrument
+from sancty.messages import Stamp
+from sancty.render import Renderer
+
+
+def test_histogram_relative_error():
+    histogram = Histogram()
+    values = sorted(random.Random(0).randint(0, 10 ** 9) for _ in range(10000))
+    for value in values:
+        histogram.record(value)
+    for fraction in (0.5, 0.9, 0.99):
+        exact = values[int(fraction * len(values)) - 1]
+        assert exact <= histogram.percentile(fraction) <= exact * (1 + 2 ** -4)
+    assert histogram.percentile(1.0) == values[-1]
+
+
+def test_stamps_are_recorded_by_both_renderers():
+    for renderer_cls in (DocumentRenderer, Renderer):
+        instrument = Instrument()
+        values = []
+        for word in ('hello', 'world'):
+            values += [Keystroke(char) for char in word]
+            values.append(Stamp([0] * len(word), 1, 0))
+        run_values(renderer_cls, values, instrument=instrument)
+        assert instrument.counters['keys'] == 10
+        assert instrument.counters['batches'] == 2
+        assert instrument.counters['bytes'] > 0
+        assert instrument.histograms['key_to_paint'].count == 10
+        assert not instrument.pending
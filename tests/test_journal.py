@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+import contextlib
+import random
+import textwrap
+import pytest
+from sancty.document import Document
+from sancty.editor import DocumentRenderer
+from sancty.edits import Insert, Delete, Split, Join, Replace
+from sancty.journal import Journal
+from sancty.mapped import MappedFile
+from sancty.bench import FakeTerminal, CountingStream, create_bench_renderer, make_workload, WORKLOADS
+
+
+def wrap(text, width):
+    return textwrap.wrap(text, width=width, drop_whitespace=False)
+
+
+def recovered(path) -> Document:
+    document = Document(wrap, 10)
+    journal = Journal(path)
+    journal.recover(document)
+    journal.close()
+    return document
+
+
+def test_recovers_what_the_renderer_did(tmp_path):
+    for k, workload in enumerate(WORKLOADS):
+        term = FakeTerminal(24, 30)
+        values = make_workload(workload, term, 400, seed=k)
+        path = str(tmp_path / f'{workload}.journal')
+        stream = CountingStream()
+        with contextlib.redirect_stdout(stream):
+            renderer = create_bench_renderer(DocumentRenderer)(term, values, stream, journal_path=path)
+            renderer.print_terminal()
+        assert recovered(path).text() == renderer.document.text()
+
+
+def test_torn_tail_compaction_and_rebase(tmp_path):
+    rnd = random.Random(0)
+    path = str(tmp_path / 'edits.journal')
+    document = Document(wrap, 10)
+    journal = Journal(path, compact_bytes=2000)
+    journal.start()
+    for n in range(600):
+        i = rnd.randrange(len(document))
+        offset = rnd.randint(0, len(document.paragraph(i)))
+        match n % 5:
+            case 0 | 1:
+                edit = Insert(i, offset, rnd.choice(['ab', 'é世', 'x\ny']))
+            case 2:
+                edit = Delete(i, rnd.randint(0, offset), offset)
+            case 3:
+                edit = Split(i, offset) if i + 1 == len(document) else Join(i)
+            case _:
+                edit = Replace(['start over', '']) if n % 200 == 4 else Insert(i, offset, ' ')
+        edit.apply(document, (0, 0))
+        journal.append(edit)
+        if journal.compaction_due():
+            journal.compact(document)
+            # Waits for the background thread to write the snapshot, so that the log stays bounded
+            journal.sync()
+    journal.close()
+    # Compaction kept the log bounded, with a single snapshot under it
+    assert os.path.getsize(path) < 4000
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.snapshot')]) == 1
+    assert recovered(path).text() == document.text()
+
+    # A record that was only partly written is dropped, and new edits go after the ones before it
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x05\x00')
+    copy = Document(wrap, 10)
+    journal = Journal(path)
+    journal.recover(copy)
+    assert copy.text() == document.text()
+    journal.append(Insert(0, 0, 'new '))
+    journal.close()
+    assert recovered(path).text() == 'new ' + document.text()
+
+    saved = tmp_path / 'saved.txt'
+    saved.write_text('saved text\n')
+    journal = Journal(path)
+    journal.recover(copy)
+    journal.rebase(str(saved))
+    journal.append(Insert(1, 0, 'more'))
+    journal.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.snapshot')]
+    assert recovered(path).text() == 'saved text\nmore'
+
+    saved.write_text('changed on disk\n')
+    with pytest.raises(ValueError):
+        recovered(path)
+
+
+def test_compaction_happens_in_the_background(tmp_path):
+    path = str(tmp_path / 'edits.journal')
+    document = Document(wrap, 10)
+    journal = Journal(path)
+    journal.start()
+    for k in range(50):
+        edit = Insert(k, 0, f'paragraph {k}\n')
+        edit.apply(document, (0, 0))
+        journal.append(edit)
+    snapshot_text = document.text()
+    files_locked = threading.Event()
+    release = threading.Event()
+
+    def lock_files():
+        with journal._file_lock:
+            files_locked.set()
+            release.wait(5)
+
+    locker = threading.Thread(target=lock_files)
+    locker.start()
+    files_locked.wait()
+    # Compacting does not wait for the files, and edits can go on while the snapshot has not been written
+    start = time.monotonic()
+    journal.compact(document)
+    for k in range(10):
+        edit = Insert(0, 0, f'{k} ')
+        edit.apply(document, (0, 0))
+        journal.append(edit)
+    assert time.monotonic() - start < 1
+    release.set()
+    locker.join()
+    journal.close()
+
+    snapshots = [name for name in os.listdir(tmp_path) if name.endswith('.snapshot')]
+    assert len(snapshots) == 1
+    assert (tmp_path / snapshots[0]).read_text() == snapshot_text
+    assert recovered(path).text() == document.text()
+
+
+def test_compaction_keeps_crlf_line_endings(tmp_path):
+    opened = tmp_path / 'crlf.txt'
+    opened.write_bytes(b'one\r\ntwo\r\nthree\r\nfour\r\n')
+    path = str(tmp_path / 'edits.journal')
+    document = Document(wrap, 10)
+    document.open(MappedFile(str(opened)))
+    journal = Journal(path)
+    journal.start(str(opened))
+    edit = Insert(0, 3, 'X')
+    edit.apply(document, (0, 0))
+    journal.append(edit)
+    # The paragraphs that were not loaded keep their '\r\n', so the snapshot has to be written with it as well
+    journal.compact(document, '\r\n')
+    journal.close()
+
+    snapshots = [name for name in os.listdir(tmp_path) if name.endswith('.snapshot')]
+    assert (tmp_path / snapshots[0]).read_bytes() == b'oneX\r\ntwo\r\nthree\r\nfour\r\n'
+    assert recovered(path).text() == 'oneX\ntwo\nthree\nfour\n'
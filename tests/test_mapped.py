@@ -0,0 +1,115 @@
+import io
+import random
+import textwrap
+from sancty.document import Document
+from sancty.mapped import MappedFile, save_document
+
+
+def wrap(text, width):
+    return textwrap.wrap(text, width=width, drop_whitespace=False)
+
+
+def write_file(path, text, newline='\n'):
+    path.write_bytes(text.replace('\n', newline).encode())
+    return str(path)
+
+
+def test_index_matches_split(tmp_path):
+    rnd = random.Random(0)
+    for k in range(50):
+        text = '\n'.join(''.join(rnd.choice('ab é世') for _ in range(rnd.randint(0, 20)))
+                         for _ in range(rnd.randint(1, 40)))
+        newline = '\r\n' if k % 2 else '\n'
+        source = MappedFile(write_file(tmp_path / f'{k}.txt', text, newline), chunk_size=rnd.choice([1, 5, 64]))
+        paragraphs = text.split('\n')
+        assert len(source) == len(paragraphs)
+        assert [source.paragraph(i) for i in range(len(source))] == paragraphs
+        if len(paragraphs) > 1:
+            assert source.newline == newline
+        source.close()
+    assert len(MappedFile(write_file(tmp_path / 'empty.txt', ''))) == 1
+
+
+def test_opened_document_loads_what_is_displayed(tmp_path):
+    text = '\n'.join(f'paragraph number {i}' for i in range(1000)) + '\n'
+    source = MappedFile(write_file(tmp_path / 'doc.txt', text), chunk_size=256)
+    document = Document(wrap, 8)
+    document.open(source)
+    assert not document.counted and len(document) < 1001
+    document.count_all()
+    # Every paragraph counts as a row until it is loaded
+    assert len(document) == document.rows == 1001
+    document.load_rows(500, 4)
+    lines = list(document.iter_lines(500))[:4]
+    assert lines == ['paragrap', 'h number', ' 500', 'paragrap']
+    assert document.rows == 1001 + 2 * 2
+    assert document.row_of(502) == 506
+    reference = Document(wrap, 8, text.split('\n'))
+    assert document.paragraph(999) == reference.paragraph(999)
+
+
+def test_save_streams_edited_document(tmp_path):
+    rnd = random.Random(1)
+    text = '\n'.join(' '.join(rnd.choice(['ab', 'cd', 'é']) for _ in range(rnd.randint(0, 10))) for _ in range(300))
+    for newline in ('\n', '\r\n'):
+        path = write_file(tmp_path / 'doc.txt', text, newline)
+        document = Document(wrap, 10)
+        document.open(MappedFile(path, chunk_size=128))
+        reference = Document(wrap, 10, text.split('\n'))
+
+        out = io.BytesIO()
+        document.write(out, newline)
+        assert out.getvalue() == text.replace('\n', newline).encode()
+
+        for _ in range(50):
+            i = rnd.randrange(len(reference))
+            offset = rnd.randint(0, len(reference.paragraph(i)))
+            edit = rnd.choice(['x', 'y\nz', '\n'])
+            assert document.insert_text(i, offset, edit) == reference.insert_text(i, offset, edit)
+            j = rnd.randrange(len(reference) - 1)
+            document.join_paragraphs(j)
+            reference.join_paragraphs(j)
+        save_path = str(tmp_path / 'saved.txt')
+        save_document(document, save_path, newline)
+        with open(save_path, 'rb') as f:
+            assert f.read() == reference.text().replace('\n', newline).encode()
+
+
+def depth(node) -> int:
+    deepest = 0
+    stack = [(node, 1)]
+    while stack:
+        node, level = stack.pop()
+        if node is not None:
+            deepest = max(deepest, level)
+            stack += [(node.left, level + 1), (node.right, level + 1)]
+    return deepest
+
+
+def test_loading_keeps_the_tree_balanced(tmp_path):
+    text = '\n'.join(f'line {i}' for i in range(20000))
+    document = Document(wrap, 40)
+    document.open(MappedFile(write_file(tmp_path / 'doc.txt', text)))
+    # Like paging down through the whole file, loading every row in order
+    for row in range(0, 18000, 20):
+        document.load_rows(row, 20)
+    document.insert_text(17990, 3, 'x\ny')
+    assert depth(document._root) < 100
+    assert document.paragraph(17991) == 'ye 17990'
+
+
+def test_opening_counts_what_is_displayed(tmp_path):
+    text = '\n'.join(f'paragraph number {i}' for i in range(10000))
+    source = MappedFile(write_file(tmp_path / 'doc.txt', text), chunk_size=1024)
+    chunks = -(-source.size // source.chunk_size)
+    document = Document(wrap, 40)
+    document.open(source)
+    document.load_rows(0, 24)
+    assert document.lines(0) == ['paragraph number 0']
+    # Only the chunks of the first screen are counted, and the paragraphs after them are added as they are needed
+    assert len(source._counts) <= 2 < chunks
+    assert not document.counted and 24 < len(document) < 10000
+    assert document.paragraph(5000) == 'paragraph number 5000'
+    assert len(source._counts) < chunks
+    assert list(document.iter_lines(9990)) == [f'paragraph number {i}' for i in range(9990, 10000)]
+    assert document.counted and len(document) == document.rows == 10000
@@ -0,0 +1,154 @@
+import os
+import codecs
+import random
+import signal
+import threading
+import time
+from blessed.keyboard import resolve_sequence
+from sancty.read import Reader, LatencyBatchPolicy
+from sancty.keys import KeyDecoder, read_keys
+from sancty.messages import Resize
+from sancty.bench import FakeTerminal
+
+MS = 1_000_000
+
+
+def test_latency_batch_policy():
+    policy = LatencyBatchPolicy(max_latency=0.01, max_batch=3, lag_step=0.002, lag_interval=0)
+    policy.added(0, 1)
+    # Keys are sent as soon as no more are available while the renderer keeps up
+    assert not policy.due(0, 1, idle=False)
+    assert policy.due(0, 1, idle=True)
+    policy.sent(0, lambda: 2)
+
+    # With two batches waiting to be rendered, the reader waits longer for more keys
+    policy.added(10 * MS, 1)
+    assert policy.timeout(11 * MS, 1) == 0.003
+    assert not policy.due(11 * MS, 1, idle=True)
+    assert policy.due(14 * MS, 1, idle=True)
+    assert policy.due(11 * MS, 3, idle=False)
+    policy.sent(14 * MS, lambda: 100)
+
+    # Keys never wait longer than the maximum latency
+    policy.added(20 * MS, 1)
+    assert not policy.due(29 * MS, 2, idle=True)
+    assert policy.due(30 * MS, 2, idle=False)
+
+
+def inkey_keys(term, text) -> list:
+    keys = []
+    while text:
+        key = resolve_sequence(text, term._keymap, term._keycodes)
+        keys.append(key)
+        text = text[len(key):]
+    return keys
+
+
+def test_key_decoder_matches_resolve_sequence():
+    term = FakeTerminal()
+    decoder = KeyDecoder(term)
+    rnd = random.Random(0)
+    pieces = ['a', 'é', '世', ' ', '\r', '\n', '\t', '\x7f', '\x08', '\x1b', '\x1b[', '\x1bOP', '\x03', *term._keymap]
+    for _ in range(200):
+        text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 30)))
+        keys, rest = decoder.decode(text, final=True)
+        expected = inkey_keys(term, text)
+        stop = next((k + 1 for k, key in enumerate(expected) if key.code == term.KEY_PASTE_BEGIN), len(expected))
+        assert [(str(key), key.code) for key in keys] == [(str(key), key.code) for key in expected[:stop]]
+        assert rest == ''.join(expected[stop:])
+
+    # A sequence that might still be completed is left for later
+    assert decoder.decode('ab\x1b[')[1] == '\x1b['
+    assert decoder.decode('ab\x1b[', final=True)[1] == ''
+
+
+def test_read_keys_drains_the_input():
+    term = FakeTerminal()
+    decoder = KeyDecoder(term)
+    read_fd, write_fd = os.pipe()
+    # A pipe stands in for the keyboard of a terminal
+    term._keyboard_fd = read_fd
+    term._keyboard_decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        os.write(write_fd, 'typed ahead\x1b[A'.encode() * 100 + '\x1b[200~pasted\x1b[201~é'.encode())
+        keys = read_keys(term, decoder, timeout=0)
+        assert len(keys) == 1200 + 1 and keys[-1].code == term.KEY_PASTE_BEGIN
+        assert term.read_paste() == 'pasted'
+        assert read_keys(term, decoder, timeout=0) == ['é']
+
+        # A lone escape is only decoded once nothing followed it within esc_delay
+        os.write(write_fd, b'\x1b')
+        keys = read_keys(term, decoder, timeout=0, esc_delay=0.01)
+        assert [key.code for key in keys] == [term.KEY_ESCAPE]
+        assert read_keys(term, decoder, timeout=0) == []
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+class RecordingReader(Reader):
+    exited = False
+    resizing = False
+
+    def __init__(self, term, **reader_options):
+        super().__init__(term, **reader_options)
+        self.events = []
+        self.sent_times = []
+
+    def resizing_set(self) -> None:
+        super().resizing_set()
+        self.events.append('resizing')
+
+    def resizing_clear(self) -> None:
+        super().resizing_clear()
+        self.events.append('resized')
+
+    def send_values(self, values) -> None:
+        self.events.append(list(values))
+        self.sent_times.append(time.monotonic())
+
+
+class HoldingPolicy(LatencyBatchPolicy):
+    """Holds keys for the whole maximum latency, even when no more keys are available."""
+
+    def target_latency(self) -> int:
+        return self.max_latency
+
+
+def test_resize_signals_are_debounced():
+    term = FakeTerminal(24, 80)
+    # A pseudo terminal stands in for the keyboard, so that it can be put in raw mode
+    keyboard_fd, read_fd = os.openpty()
+    term._keyboard_fd = read_fd
+    term._keyboard_decoder = codecs.getincrementaldecoder('utf-8')()
+    reader = RecordingReader(term, bracketed_paste=False, resize_debounce=0.1,
+                             batch_policy=HoldingPolicy(max_latency=0.05))
+    typed = []
+
+    def resize_twice():
+        time.sleep(0.05)
+        # Keys that are still held by the batch policy when the resize starts
+        os.write(keyboard_fd, b'ab')
+        time.sleep(0.01)
+        typed.append(time.monotonic())
+        term.resize(30, 100)
+        os.kill(os.getpid(), signal.SIGWINCH)
+        time.sleep(0.03)
+        os.kill(os.getpid(), signal.SIGWINCH)
+        time.sleep(0.3)
+        os.write(keyboard_fd, b'\x04')
+
+    thread = threading.Thread(target=resize_twice)
+    thread.start()
+    try:
+        reader.read_terminal()
+    finally:
+        thread.join()
+        os.close(read_fd)
+        os.close(keyboard_fd)
+    resizes = [event for event in reader.events if event not in ('resizing', 'resized', ['a', 'b'])]
+    assert len(resizes) == 1 and len(resizes[0]) == 1 and isinstance(resizes[0][0], Resize)
+    assert (resizes[0][0].height, resizes[0][0].width) == (30, 100)
+    # The keys are sent before the resize they were typed before, without waiting out the debounce window
+    assert reader.events == [['a', 'b'], 'resizing', resizes[0], 'resized']
+    assert reader.sent_times[0] - typed[0] < 0.05
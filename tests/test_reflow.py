@@ -0,0 +1,92 @@
+import io
+import random
+import contextlib
+import multiprocessing as mp
+from sancty.document import Document
+from sancty.reflow import Reflow, close_pool
+from sancty.wrap import LineWrapper
+from sancty.bench import FakeTerminal, run_values
+from sancty.bench.workloads import WORDS, WIDE_WORDS, typing, enter_key
+from sancty.editor import DocumentRenderer
+from sancty.render import Renderer, ReplaceRender
+from sancty.messages import Resize
+
+
+def test_parallel_reflow_matches_serial():
+    rnd = random.Random(0)
+    wrapper = LineWrapper(FakeTerminal(24, 30))
+    texts = [' '.join(rnd.choice(WORDS + WIDE_WORDS) for _ in range(rnd.randint(0, 40))) for _ in range(300)]
+    # Tabs are wrapped by the terminal, so in this process
+    texts[5] = 'a\ttab ' * 20
+    reflow = Reflow(workers=2, min_chars=0)
+    try:
+        assert reflow.chunks(texts, sum(map(len, texts)))[-1][1] == len(texts)
+        wrapped = reflow.wrap(texts, 17, lambda text: wrapper.wrap(text, 17))
+        assert wrapped == [wrapper.wrap(text, 17) for text in texts]
+
+        serial = Document(wrapper.wrap, 30, texts)
+        parallel = Document(wrapper.wrap, 30, texts, reflow_fn=lambda t, width: reflow.wrap(
+            t, width, lambda text: wrapper.wrap(text, width)))
+        for width in (11, 45):
+            serial.set_width(width)
+            parallel.set_width(width)
+            assert list(parallel.iter_lines()) == list(serial.iter_lines())
+            assert parallel.rows == serial.rows
+    finally:
+        close_pool()
+
+
+def test_renderers_reflow_in_parallel():
+    term = FakeTerminal(24, 40)
+    values = []
+    for i in range(60):
+        values += typing(term, 50, random.Random(i)) + [enter_key(term)]
+    values += [Resize(24, 25)] + typing(term, 20, random.Random(60)) + [Resize(24, 70)]
+    for renderer in (DocumentRenderer, Renderer):
+        serial = run_values(renderer, values, 24, 40, reflow_workers=1)
+        parallel = run_values(renderer, values, 24, 40, reflow_workers=2, reflow_min_chars=0)
+        assert parallel['bytes'] == serial['bytes']
+
+
+def test_replace_only_reflows_paragraphs_that_are_not_cached():
+    term = FakeTerminal(24, 40)
+    renderer = Renderer(term, reflow_workers=2, reflow_min_chars=0)
+    sent = []
+    reflow_wrap = renderer.reflower.wrap
+
+    def wrap(texts, width, wrap_fn):
+        sent.append(list(texts))
+        return reflow_wrap(texts, width, wrap_fn)
+
+    renderer.reflower.wrap = wrap
+    rnd = random.Random(0)
+    paragraphs = [' '.join(rnd.choice(WORDS) for _ in range(30)) + f' {i}' for i in range(50)] + ['']
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            render_array, paragraph_ends = renderer.render_current(
+                [''], [], replace=ReplaceRender(paragraphs, list(range(50))))
+            edited = paragraphs.copy()
+            edited[10] = 'edited'
+            replaced = renderer.render_current(render_array, paragraph_ends,
+                                               replace=ReplaceRender(edited, list(range(50))))
+            expected = Renderer(term, reflow_workers=1).render_current(
+                [''], [], replace=ReplaceRender(edited, list(range(50))))
+        assert replaced == expected
+        # The other paragraphs were cached by the first replace
+        assert sent[-1] == ['edited']
+    finally:
+        close_pool()
+
+
+def wrap_in_daemon(queue):
+    queue.put(Reflow(workers=2, min_chars=0).wrap(['a b c'] * 4, 3, lambda text: text.split()))
+
+
+def test_daemonic_processes_reflow_serially():
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=wrap_in_daemon, args=(queue,), daemon=True)
+    process.start()
+    # Daemonic processes cannot start the pool, so the paragraphs are wrapped with the function that is passed
+    assert queue.get(timeout=10) == [['a', 'b', 'c']] * 4
+    process.join()
@@ -0,0 +1,281 @@
+import io
+import random
+import time
+import contextlib
+import pytest
+from blessed.terminal import WINSZ
+from blessed.keyboard import Keystroke
+from sancty.patch_blessed import Terminal
+from sancty.render import Renderer
+from sancty.editor import DocumentRenderer
+from sancty.document import paragraphs_from_render
+from sancty.messages import Paste
+from sancty.instrument import Instrument
+from sancty.edits import Insert, Split
+from sancty.bench import create_bench_renderer, CountingStream, FakeTerminal, make_workload
+from sancty.bench.workloads import keys_of, enter_key
+from sancty.wrap import LineWrapper
+
+
+class SizedTerminal(Terminal):
+    def _height_and_width(self):
+        return WINSZ(ws_row=24, ws_col=20, ws_xpixel=0, ws_ypixel=0)
+
+
+def render(renderer, render_array, paragraph_ends, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return renderer.render_current(render_array, paragraph_ends, **kwargs)
+
+
+def test_rewrap_cache_matches_full_rewrap():
+    term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+    renderer = Renderer(term)
+    render_array, paragraph_ends = [''], []
+    for i in range(30):
+        for char in f"paragraph {i} with some words":
+            render_array, paragraph_ends = render(renderer, render_array, paragraph_ends, val=char)
+        paragraph_ends.append(len(render_array) - 1)
+        render_array, paragraph_ends = render(renderer, render_array, paragraph_ends, rewrap=True)
+    assert renderer.wrap_cache.stable == 30
+
+    fresh = Renderer(term)
+    expected = render(fresh, list(render_array), list(paragraph_ends), rewrap=True)
+    assert render(renderer, render_array, paragraph_ends, rewrap=True) == expected
+
+
+def test_line_wrapper_matches_term_wrap():
+    term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+    wrapper = LineWrapper(term)
+    rnd = random.Random(0)
+    pieces = ['a', 'b', ' ', ' ', '-', '--', '日', 'é', 'x' * 12, '\t', term.red]
+    for _ in range(500):
+        text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 40)))
+        appended = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 3)))
+        width = rnd.randint(2, 14)
+        lines = wrapper.wrap(text, width)
+        assert lines == term.wrap(text, width=width, drop_whitespace=False)
+        first, tail = wrapper.append_wrap(text, lines, appended, width)
+        assert lines[:first] + tail == term.wrap(text + appended, width=width, drop_whitespace=False)
+
+
+def test_paste_is_rendered_at_once():
+    values = [Keystroke(char) for char in 'abc '] + [Paste('one \\hi\ntwo\n\nthree')]
+    for renderer_cls in (Renderer, DocumentRenderer):
+        for paste_slash in (False, True):
+            term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+            stream = CountingStream()
+            with contextlib.redirect_stdout(stream):
+                renderer = create_bench_renderer(renderer_cls)(term, list(values), stream, replace_dict={'hi': 'HI'},
+                                                               paste_slash=paste_slash)
+                renderer.print_terminal()
+            if renderer_cls is DocumentRenderer:
+                text = renderer.document.text()
+            else:
+                # The paste was the last value, so the last rewrap holds the whole text
+                cache = renderer.wrap_cache
+                text = '\n'.join(paragraphs_from_render(cache.lines, cache.ends))
+            assert text == ('abc one HI' if paste_slash else 'abc one \\hi') + '\ntwo\n\nthree'
+
+
+def test_viewport_paints_only_visible_rows():
+    term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+    page_up = Keystroke('\x1b[5~', term.KEY_PGUP, 'KEY_PGUP')
+    text = '\n'.join(f'line {i}' for i in range(100))
+    stream = CountingStream()
+    with contextlib.redirect_stdout(stream):
+        renderer = create_bench_renderer(DocumentRenderer)(term, [Paste(text), page_up], stream, viewport=True)
+        renderer.print_terminal()
+    lines = list(renderer.document.iter_lines())
+    # Scrolled up one page from the end, keeping one row of the previous page in view
+    assert renderer.top == 100 - 24 - 23
+    assert renderer.painter.frame == lines[renderer.top:renderer.top + 24]
+
+    renderer.values.append(Keystroke('x'))
+    with contextlib.redirect_stdout(stream):
+        renderer.print_terminal()
+    # Typing brings the cursor back into view
+    assert renderer.top == 100 - 24
+    assert renderer.painter.frame == lines[-24:-1] + ['line 99x']
+
+
+def test_cursor_edits_in_the_middle():
+    term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+    left = Keystroke('\x1b[D', term.KEY_LEFT, 'KEY_LEFT')
+    up = Keystroke('\x1b[A', term.KEY_UP, 'KEY_UP')
+    down = Keystroke('\x1b[B', term.KEY_DOWN, 'KEY_DOWN')
+    home = Keystroke('\x1b[H', term.KEY_HOME, 'KEY_HOME')
+    end = Keystroke('\x1b[F', term.KEY_END, 'KEY_END')
+    delete = Keystroke('\x1b[3~', term.KEY_DELETE, 'KEY_DELETE')
+    backspace = Keystroke('\x7f', term.KEY_BACKSPACE, 'KEY_BACKSPACE')
+    enter = Keystroke('\r', term.KEY_ENTER, 'KEY_ENTER')
+    values = ([Keystroke(char) for char in 'first line'] + [enter] + [Keystroke(char) for char in 'second']
+              + [up, home, delete, Keystroke('F'), left, left, backspace, down, end, Keystroke('!')])
+    stream = CountingStream()
+    with contextlib.redirect_stdout(stream):
+        renderer = create_bench_renderer(DocumentRenderer)(term, values, stream)
+        renderer.print_terminal()
+    assert renderer.document.text() == 'First line\nsecond!'
+    assert renderer.cursor == (1, 7)
+    assert renderer.painter.frame == ['First line', 'second!']
+    assert (renderer.painter.cursor_row, renderer.painter.cursor_col) == (1, 7)
+
+
+def test_slash_edits_apply_at_the_cursor():
+    def slash_edit_fn(control_num, view, cursor):
+        if control_num == 2:
+            return None
+        i, offset = cursor
+        return [Insert(i, offset, view.paragraph(0).upper()), Split(i, 0)]
+
+    def special_slash_fn(_control_num, render_array, paragraph_ends):
+        return render_array + ['legacy'], paragraph_ends + [len(render_array) - 1]
+
+    replace_dict = {'up': (1, "Insert the first paragraph in capitals"), 'old': (2, "Legacy command")}
+    for renderer_cls in (Renderer, DocumentRenderer):
+        term = SizedTerminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+        values = keys_of('top') + [enter_key(term)] + keys_of('next \\up\\old')
+        stream = CountingStream()
+        with contextlib.redirect_stdout(stream):
+            renderer = create_bench_renderer(renderer_cls)(term, list(values), stream, replace_dict=replace_dict,
+                                                           special_slash_fn=special_slash_fn,
+                                                           slash_edit_fn=slash_edit_fn)
+            renderer.print_terminal()
+        if renderer_cls is DocumentRenderer:
+            text = renderer.document.text()
+        else:
+            cache = renderer.wrap_cache
+            text = '\n'.join(paragraphs_from_render(cache.lines, cache.ends))
+        assert text == 'top\n\nnext TOP\nlegacy'
+
+
+class RecordingStream(CountingStream):
+    def __init__(self):
+        super().__init__()
+        self.written = []
+
+    def write(self, text) -> int:
+        self.written.append(text)
+        return super().write(text)
+
+
+def test_paint_modes_show_the_same_screen():
+    pyte = pytest.importorskip('pyte')
+
+    def replay(workload, paint_mode):
+        term = FakeTerminal(24, 40)
+        stream = RecordingStream()
+        with contextlib.redirect_stdout(stream):
+            renderer = create_bench_renderer(DocumentRenderer)(term, make_workload(workload, term, 600, seed=1),
+                                                               stream, paint_mode=paint_mode, viewport=True)
+            renderer.print_terminal()
+        screen = pyte.Screen(40, 24)
+        pyte.Stream(screen).feed(''.join(stream.written))
+        return renderer, screen, stream.bytes_written
+
+    # Resizes are left out, the emulator cannot follow the size of the terminal
+    for workload in ('typing', 'enter', 'backspace', 'wide', 'slash', 'cursor', 'paste'):
+        diff, diff_screen, diff_bytes = replay(workload, 'diff')
+        full, full_screen, full_bytes = replay(workload, 'full')
+        frame = [row.rstrip() for row in diff.painter.frame]
+        # The emulator drops emoji modifiers, so wide text can only be compared between the paint modes
+        if workload != 'wide':
+            assert [row.rstrip() for row in diff_screen.display] == frame + [''] * (24 - len(frame))
+            assert (diff_screen.cursor.y, diff_screen.cursor.x) == (diff.painter.cursor_row, diff.painter.cursor_col)
+        assert full_screen.display == diff_screen.display
+        assert (full_screen.cursor.y, full_screen.cursor.x) == (diff_screen.cursor.y, diff_screen.cursor.x)
+        assert diff.painter.bytes_written == diff_bytes < full_bytes == full.painter.bytes_written
+
+
+class StatusAt(Instrument):
+    """Writes a status line at the given paints only."""
+
+    def __init__(self, paints):
+        super().__init__()
+        self.paints = paints
+        self.calls = 0
+
+    def status_due(self) -> bool:
+        self.calls += 1
+        return self.calls in self.paints
+
+    def status_line(self) -> str:
+        return f'status {self.calls}'
+
+
+def test_status_line_is_painted_over():
+    pyte = pytest.importorskip('pyte')
+    for paint_mode in ('diff', 'full'):
+        for workload, keys, viewport in (('typing', 600, True), ('enter', 300, True), ('cursor', 600, True),
+                                         ('typing', 250, False)):
+            term = FakeTerminal(8, 40)
+            stream = RecordingStream()
+            instrument = StatusAt({1, 5, 20, 60, 150})
+            with contextlib.redirect_stdout(stream):
+                renderer = create_bench_renderer(DocumentRenderer)(
+                    term, make_workload(workload, term, keys, seed=2), stream, paint_mode=paint_mode,
+                    viewport=viewport, instrument=instrument)
+                renderer.print_terminal()
+            screen = pyte.Screen(40, 8)
+            pyte.Stream(screen).feed(''.join(stream.written))
+            frame_rows = renderer.frame_rows()
+            top, visible = renderer.viewport_rows(frame_rows, renderer.cursor_position()[0])
+            frame = list(renderer.document.iter_lines(top))[:visible]
+            assert [row.rstrip() for row in screen.display] == [row.rstrip() for row in frame] + [''] * (8 - visible)
+
+
+class BurstRenderer(DocumentRenderer):
+    """Queues each burst of values at once, the next one as soon as the previous one has been painted."""
+
+    def __init__(self, term, bursts, **renderer_options):
+        super().__init__(term, **renderer_options)
+        self.bursts = bursts
+        self.queued = []
+        self.queued_bursts = 0
+        self.handed_out = 0
+        self.paints = []
+
+    def has_exited(self) -> bool:
+        return not self.bursts and not self.queued and self.last_paint > self.handed_out
+
+    def is_resizing(self) -> bool:
+        return False
+
+    def update_values(self, values) -> tuple[bool, list]:
+        if not self.queued and self.bursts and len(self.paints) >= self.queued_bursts:
+            self.queued = self.bursts.pop(0)
+            self.queued_bursts += 1
+        if self.queued:
+            values.append(self.queued.pop(0))
+            self.handed_out = time.perf_counter()
+        return not self.queued, values
+
+    def wait_values(self, timeout) -> None:
+        time.sleep(timeout)
+
+    def paint(self, from_row=None):
+        super().paint(from_row)
+        self.paints.append((self.last_paint, list(self.painter.frame)))
+
+
+def test_bursts_are_painted_as_one_frame():
+    for coalesce in (True, False):
+        term = FakeTerminal(24, 40)
+        stream = CountingStream()
+        with contextlib.redirect_stdout(stream):
+            renderer = BurstRenderer(term, [keys_of('hello'), keys_of(' world')], coalesce=coalesce)
+            renderer.print_terminal()
+        frames = [frame for _, frame in renderer.paints]
+        if coalesce:
+            assert frames == [['hello'], ['hello world']]
+        else:
+            text = 'hello world'
+            assert frames == [[text[:n]] for n in range(1, len(text) + 1)]
+
+    term = FakeTerminal(24, 40)
+    with contextlib.redirect_stdout(CountingStream()):
+        renderer = BurstRenderer(term, [keys_of('hello'), keys_of(' world')], max_fps=20)
+        renderer.print_terminal()
+    (first, _), (second, frame) = renderer.paints
+    # The second burst arrives right after the first frame, but is only painted a frame interval later
+    assert second - first >= 1 / 20
+    assert frame == ['hello world']
@@ -0,0 +1,139 @@
+import os
+import codecs
+import signal
+import asyncio
+import contextlib
+import pytest
+from blessed.keyboard import Keystroke
+from sancty.run_async import AsyncReader, create_async_renderer
+from sancty.editor import DocumentRenderer
+from sancty.render import Renderer
+from sancty.messages import Paste, Resize
+from sancty.bench import FakeTerminal, CountingStream
+from sancty.document import Document
+from sancty.journal import Journal
+
+
+async def read_through_pipe():
+    term = FakeTerminal(24, 80)
+    read_fd, write_fd = os.pipe()
+    # A pipe stands in for the keyboard of a terminal
+    term._keyboard_fd = read_fd
+    term._keyboard_decoder = codecs.getincrementaldecoder('utf-8')()
+    queue = asyncio.Queue()
+    exit_event = asyncio.Event()
+    resizing = asyncio.Event()
+    reader = AsyncReader(term, queue, exit_event, resizing, bracketed_paste=False, resize_debounce=0.05)
+    task = asyncio.create_task(reader.read_terminal_async())
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.sleep(0.01)
+        os.write(write_fd, 'ab\x1b[200~one\r\n'.encode())
+        start = loop.time()
+        await asyncio.sleep(0.1)
+        # The loop keeps running while the rest of the paste has not arrived
+        assert loop.time() - start < 0.5
+        assert [str(val) for val in await queue.get()] == ['a', 'b'] and queue.empty()
+        os.write(write_fd, 'two\x1b[201~c'.encode())
+        await asyncio.sleep(0.05)
+        values = await queue.get()
+        assert isinstance(values[0], Paste) and values[0].text == 'one\ntwo' and values[1:] == ['c']
+
+        # Signals within the debounce window end in a single resize, once the size settled
+        term.resize(30, 100)
+        os.kill(os.getpid(), signal.SIGWINCH)
+        await asyncio.sleep(0.02)
+        assert resizing.is_set()
+        os.kill(os.getpid(), signal.SIGWINCH)
+        await asyncio.sleep(0.2)
+        resizes = [await queue.get()]
+        assert queue.empty() and not resizing.is_set()
+        assert len(resizes[0]) == 1 and isinstance(resizes[0][0], Resize)
+        assert (resizes[0][0].height, resizes[0][0].width) == (30, 100)
+
+        os.write(write_fd, b'\x04')
+        await asyncio.wait_for(task, 5)
+        assert exit_event.is_set()
+    finally:
+        task.cancel()
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_async_reader_reads_pastes_and_resizes_without_blocking():
+    asyncio.run(read_through_pipe())
+
+
+class CountingRenderer(DocumentRenderer):
+    paints = 0
+
+    def paint(self, from_row=None):
+        self.paints += 1
+        super().paint(from_row)
+
+
+async def render_batch(coalesce):
+    queue = asyncio.Queue()
+    exit_event = asyncio.Event()
+    renderer = create_async_renderer(CountingRenderer)(FakeTerminal(24, 80), queue, exit_event, asyncio.Event(),
+                                                       coalesce=coalesce)
+    queue.put_nowait([Keystroke(char) for char in 'abc'])
+    task = asyncio.create_task(renderer.print_terminal_async())
+    await asyncio.sleep(0.05)
+    exit_event.set()
+    queue.put_nowait([])
+    await asyncio.wait_for(task, 5)
+    return renderer
+
+
+def test_async_renderer_coalesces_only_when_asked():
+    with contextlib.redirect_stdout(CountingStream()):
+        coalesced = asyncio.run(render_batch(True))
+        separate = asyncio.run(render_batch(False))
+    assert coalesced.document.text() == separate.document.text() == 'abc'
+    assert (coalesced.paints, separate.paints) == (1, 3)
+
+
+def test_async_renderer_needs_a_document_renderer():
+    with pytest.raises(TypeError):
+        create_async_renderer(Renderer)
+
+
+async def type_into_journal(path):
+    term = FakeTerminal(24, 80)
+    read_fd, write_fd = os.pipe()
+    term._keyboard_fd = read_fd
+    term._keyboard_decoder = codecs.getincrementaldecoder('utf-8')()
+    queue = asyncio.Queue()
+    exit_event = asyncio.Event()
+    resizing = asyncio.Event()
+    reader = AsyncReader(term, queue, exit_event, resizing, bracketed_paste=False)
+    renderer = create_async_renderer(DocumentRenderer)(term, queue, exit_event, resizing, journal_path=path)
+    renderer.journal.compact_bytes = 200
+    tasks = asyncio.gather(reader.read_terminal_async(), renderer.print_terminal_async())
+    try:
+        for word in ('journaled ', 'while ', 'typing ', 'in ', 'the ', 'asyncio ', 'runtime'):
+            os.write(write_fd, word.encode())
+            await asyncio.sleep(0.02)
+        os.write(write_fd, b'\x04')
+        await asyncio.wait_for(tasks, 5)
+    finally:
+        tasks.cancel()
+        os.close(read_fd)
+        os.close(write_fd)
+    return renderer
+
+
+def test_async_runtime_journals_edits(tmp_path):
+    path = str(tmp_path / 'edits.journal')
+    with contextlib.redirect_stdout(CountingStream()):
+        renderer = asyncio.run(type_into_journal(path))
+    assert renderer.document.text() == 'journaled while typing in the asyncio runtime'
+    # The log was compacted while idle, and every edit was written out on exit
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.snapshot')]
+    assert renderer.journal._thread is None or not renderer.journal._thread.is_alive()
+    document = Document(renderer.wrap_paragraph, 80)
+    journal = Journal(path)
+    journal.recover(document)
+    journal.close()
+    assert document.text() == renderer.document.text()
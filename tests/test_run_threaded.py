@@ -0,0 +1,49 @@
+import threading
+import contextlib
+from sancty.deps_types import Event, QueueEmpty, tm
+from sancty.run_threaded import KeyQueue, ThreadRenderer
+from sancty.bench import FakeTerminal, CountingStream
+from sancty.bench.workloads import keys_of, enter_key
+
+
+def test_key_queue_hands_over_batches():
+    queue = KeyQueue(capacity=2)
+    first, second = ['a'], ['b']
+    queue.put(first)
+    queue.put(second)
+    # A full queue makes the producer wait until the consumer took a batch
+    producer = threading.Thread(target=queue.put, args=(['c'],))
+    producer.start()
+    producer.join(0.05)
+    assert producer.is_alive() and queue.qsize() == 2
+    assert queue.get() is first
+    producer.join()
+    assert queue.get(block=False) is second and queue.get(block=False) == ['c']
+    try:
+        queue.get(block=False)
+        assert False
+    except QueueEmpty:
+        pass
+    assert not queue.wait(0.01)
+    queue.close()
+    assert queue.wait()
+
+
+def test_renderer_thread_renders_batches():
+    term = FakeTerminal(24, 30)
+    queue = KeyQueue()
+    exit_event = Event()
+    with contextlib.redirect_stdout(CountingStream()):
+        renderer = ThreadRenderer(term, queue, exit_event, Event())
+        thread = threading.Thread(target=renderer.print_terminal)
+        thread.start()
+        for k in range(50):
+            queue.put(keys_of(f'line {k}') + [enter_key(term)])
+        queue.put(keys_of('end'))
+        for _ in range(1000):
+            if renderer.document.paragraph(len(renderer.document) - 1) == 'end':
+                break
+            tm.sleep(0.01)
+        renderer.do_exit()
+        thread.join()
+    assert renderer.document.text() == ''.join(f'line {k}\n' for k in range(50)) + 'end'
@@ -0,0 +1,198 @@
+import os
+import json
+import signal
+import socket
+import contextlib
+import multiprocessing as mp
+from sancty.deps_types import tm
+from sancty.server import SessionTerminal, SessionReader, FrameReader, encode_frame, serve, request_stats, KEYS, \
+    HELLO, SIZE, _SIZE, _FRAME
+from sancty.messages import Paste
+from sancty.bench import run_sessions
+
+
+def test_session_reader_decodes_split_input():
+    term = SessionTerminal(24, 80)
+    reader = SessionReader(term)
+    frames = FrameReader()
+    data = encode_frame(KEYS, 'ab\x1b[A\x1b[200~one\r\ntwo\x1b[201~é'.encode())
+    values = []
+    # Frames, escape sequences, the paste end marker and characters all arrive in pieces
+    for k in range(len(data)):
+        for _kind, payload in frames.feed(data[k:k + 1]):
+            values += reader.feed(payload, 0)
+    assert [str(val) for val in values[:2]] == ['a', 'b']
+    assert values[2].code == term.KEY_UP
+    assert isinstance(values[3], Paste) and values[3].text == 'one\ntwo'
+    assert values[4] == 'é' and len(values) == 5
+
+    # A lone escape is only a key of its own once nothing followed it in time
+    assert reader.feed(b'\x1b', 1.0) == [] and not reader.exited
+    assert reader.expire(1.0) == [] and not reader.exited
+    reader.expire(1.0 + reader.esc_delay)
+    assert reader.exited
+
+
+def test_sessions_share_workers():
+    result = run_sessions(sessions=12, workers=2, rounds=20)
+    assert result['keys'] == 12 * 20
+    assert result['bytes'] > 0 and result['rss_per_session_bytes'] > 0
+
+
+@contextlib.contextmanager
+def serving(path, **options):
+    server = mp.get_context('fork').Process(target=serve, args=(path, 1), kwargs=options)
+    server.start()
+    try:
+        while not os.path.exists(path):
+            tm.sleep(0.01)
+        yield server
+    finally:
+        os.kill(server.pid, signal.SIGINT)
+        server.join()
+
+
+def start_session(path, **hello) -> socket.socket:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(5.0)
+    client.connect(path)
+    client.sendall(encode_frame(HELLO, json.dumps({'kind': 'session', 'rows': 24, 'cols': 80, **hello}).encode()))
+    return client
+
+
+def read_until(client, text: bytes) -> bytes:
+    """Everything the server sent until text arrived, or until the session ended."""
+    data = b''
+    while text not in data:
+        chunk = client.recv(1 << 16)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_bad_hellos_only_close_their_connection(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    with serving(path) as server:
+        # A client that is slow to send its hello does not hold up the others
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(path)
+        slow.sendall(encode_frame(HELLO, b'{"kind": "session"}')[:3])
+        for payload in [b'not json', b'[1, 2]', b'{"rows": "many"}', b'\xff']:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.settimeout(5.0)
+            client.connect(path)
+            client.sendall(encode_frame(HELLO, payload))
+            assert b'hello' in read_until(client, b'never')
+            client.close()
+        with start_session(path) as client:
+            assert b'Welcome' in read_until(client, b'Welcome')
+            client.sendall(encode_frame(KEYS, b'abc'))
+            assert b'abc' in read_until(client, b'abc')
+            assert request_stats(path)['session_count'] == 1
+        slow.close()
+        assert server.is_alive()
+
+
+def test_failing_session_only_closes_itself(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    with serving(path, root=str(tmp_path)) as server:
+        with start_session(path) as other, start_session(path, save_path=str(tmp_path / 'missing' / 'a.txt')) as client:
+            assert b'Welcome' in read_until(other, b'Welcome')
+            assert b'CTRL+S' in read_until(client, b'CTRL+S')
+            # Saving to a directory that does not exist fails, which ends this session only
+            client.sendall(encode_frame(KEYS, b'abc\x13'))
+            data = read_until(client, b'never')
+            assert b'Session stopped' in data and b'FileNotFoundError' in data
+            other.sendall(encode_frame(KEYS, b'xyz'))
+            assert b'xyz' in read_until(other, b'xyz')
+            assert request_stats(path)['session_count'] == 1
+        assert server.is_alive()
+
+
+def test_oversized_frames_stop_their_session(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    with serving(path) as server:
+        with start_session(path) as other, start_session(path) as client:
+            assert b'Welcome' in read_until(other, b'Welcome')
+            assert b'Welcome' in read_until(client, b'Welcome')
+            # The header alone is enough, the worker does not wait for the payload it announces
+            client.sendall(_FRAME.pack(KEYS, (1 << 32) - 1) + b'abc')
+            data = read_until(client, b'never')
+            assert b'Session stopped' in data and b'longer than' in data
+            other.sendall(encode_frame(KEYS, b'xyz'))
+            assert b'xyz' in read_until(other, b'xyz')
+        # A hello is limited the same way
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(5.0)
+        client.connect(path)
+        client.sendall(_FRAME.pack(HELLO, 1 << 30))
+        assert b'longer than' in read_until(client, b'never')
+        client.close()
+        assert server.is_alive()
+
+
+def test_stats_clients_do_not_hold_up_the_server(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    with serving(path) as server:
+        # A stats client that never reads its reply
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(path)
+        idle.sendall(encode_frame(HELLO, json.dumps({'kind': 'stats'}).encode()))
+        with start_session(path) as client:
+            assert b'Welcome' in read_until(client, b'Welcome')
+            client.sendall(encode_frame(KEYS, b'abc'))
+            assert b'abc' in read_until(client, b'abc')
+            stats = request_stats(path)
+            assert stats['session_count'] == 1 and stats['workers'][0]['sessions'][0]['keys'] == 3
+        idle.close()
+        assert server.is_alive()
+
+
+def children(pid) -> list[int]:
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def test_sessions_reflow_in_parallel(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    for reflow_workers in (None, 2):
+        options = {'reflow_min_chars': 0} if reflow_workers is None else {'reflow_workers': reflow_workers,
+                                                                          'reflow_min_chars': 0}
+        with serving(path, renderer_options=options) as server:
+            with start_session(path, cols=40) as client:
+                assert b'Welcome' in read_until(client, b'Welcome')
+                client.sendall(encode_frame(KEYS, b'\x1b[200~' + b'\n'.join([b'some words to wrap again'] * 50) +
+                                            b'\x1b[201~zz'))
+                assert b'zz' in read_until(client, b'zz')
+                client.sendall(encode_frame(SIZE, _SIZE.pack(24, 15)) + encode_frame(KEYS, b'yy'))
+                data = read_until(client, b'yy')
+                assert b'yy' in data and b'Session stopped' not in data
+                # Workers only start a pool of their own when asked to
+                [worker] = children(server.pid)
+                assert len(children(worker)) == (0 if reflow_workers is None else reflow_workers)
+
+
+def test_sessions_only_use_files_under_root(tmp_path):
+    path = str(tmp_path / 'sancty.sock')
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'a.txt').write_text('under root')
+    (root / 'link').symlink_to(tmp_path)
+    with serving(path):
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        with start_session(path, open_path=str(root / 'a.txt')) as client:
+            assert b'does not open or save files' in read_until(client, b'never')
+    with serving(path, root=str(root)):
+        for outside in [str(tmp_path / 'b.txt'), '../b.txt', str(root / 'link' / 'b.txt')]:
+            with start_session(path, save_path=outside) as client:
+                assert b'is outside of' in read_until(client, b'never')
+        # Relative paths are taken from root
+        with start_session(path, open_path='a.txt', save_path='sub/../c.txt') as client:
+            assert b'under root' in read_until(client, b'under root')
+            client.sendall(encode_frame(KEYS, b'\x13'))
+            deadline = tm.monotonic() + 5.0
+            while not (root / 'c.txt').exists() and tm.monotonic() < deadline:
+                tm.sleep(0.01)
+        assert (root / 'c.txt').read_text() == 'under root'
+        assert not (tmp_path / 'b.txt').exists()
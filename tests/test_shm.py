@@ -0,0 +1,38 @@
+import threading
+from blessed.keyboard import Keystroke
+from sancty.shm import ShmTransport
+
+
+def test_shm_queue_round_trip():
+    transport = ShmTransport(capacity=256)
+    try:
+        queue = transport.queue
+        queue.put([Keystroke('a'), Keystroke('\r', 343, 'KEY_ENTER'), ('other', 1)])
+        values = queue.get()
+        assert values == ['a', '\r', ('other', 1)]
+        assert values[1].code == 343 and values[1].name == 'KEY_ENTER'
+        assert queue.qsize() == 0
+
+        # Larger than the buffer, so it is written in fragments as the consumer reads them
+        producer = threading.Thread(target=queue.put, args=([Keystroke('b' * 1000)],))
+        producer.start()
+        assert queue.get(block=True) == ['b' * 1000]
+        producer.join()
+
+        # Waiting returns once a batch can be taken, or after the timeout, and blocks in between instead of checking
+        # the ring over and over
+        checks = []
+        get = queue._get
+        queue._get = lambda offset: checks.append(offset) or get(offset)
+        assert not queue.wait(0.2)
+        assert len(checks) < 10
+        del queue._get
+        producer = threading.Timer(0.01, queue.put, args=([Keystroke('c')],))
+        producer.start()
+        assert queue.wait(5.0) and queue.get() == ['c']
+        producer.join()
+
+        transport.exit_event.set()
+        assert transport.exit_event.is_set() and not transport.resizing_event.is_set()
+    finally:
+        transport.close()
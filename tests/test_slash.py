@@ -0,0 +1,33 @@
+import io
+from sancty.patch_blessed import Terminal
+from sancty.render import Renderer
+from sancty.slash import SlashTrie
+
+
+def test_trie_completions_and_dead_prefixes():
+    trie = SlashTrie({'alpha': 'a', 'alps': 'b', 'beta': (3, "Beta")})
+    node = trie.root
+    for char in 'alp':
+        node = trie.step(node, char)
+    assert node is not None and node.key is None
+    assert trie.step(trie.step(node, 's'), 'x') is None
+    assert trie.completions('al') == ['alpha', 'alps']
+    assert trie.completions('x') == []
+    assert trie.help_lines() == ['alpha : a', 'alps : b', 'beta : Beta']
+
+
+def test_renderer_matches_like_dict_lookup():
+    term = Terminal(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+    replace_dict = {f'snippet{i}': f'text {i}' for i in range(20000)}
+    renderer = Renderer(term, replace_dict=replace_dict)
+    for slash_text in ['\\', '\\s', '\\snippet1', '\\snippet12', '\\snippet12x', '\\snippet123', '\\clr', '\\cl']:
+        expected = renderer.replace_dict.get(slash_text.lstrip('\\'))
+        assert renderer.slash_replace(slash_text) == expected
+    completions = renderer.slash_completions('\\snippet1999', limit=20)
+    assert sorted(completions) == ['snippet1999'] + [f'snippet1999{i}' for i in range(10)]
+    assert len(renderer.slash_completions('\\snippet1', limit=5)) == 5
+
+
+def test_expand_pasted_text():
+    trie = SlashTrie({'hi': 'HELLO', 'clr': (-1, "Clears all text")})
+    assert trie.expand('a \\hi b\\hix \\clr \\nope \\\\hi') == 'a HELLO bHELLOx \\clr \\nope \\HELLO'
@@ -0,0 +1,30 @@
+import io
+import random
+import blessed
+from sancty.patch_blessed import Terminal
+from sancty.width import cumulative_widths, display_width, text_width
+
+
+def make_terminal(cls):
+    return cls(kind='xterm-256color', force_styling=True, stream=io.StringIO())
+
+
+def test_widths():
+    assert text_width('abc') == 3
+    assert text_width('日本') == 4
+    assert text_width('a\x01') == -1
+    assert display_width('a\x01') == 1
+    assert cumulative_widths('ab') == [1, 2]
+    assert cumulative_widths('a日é') == [1, 3, 4, 4]
+
+
+def test_wrap_matches_blessed():
+    term = make_terminal(Terminal)
+    blessed_term = make_terminal(blessed.Terminal)
+    rnd = random.Random(0)
+    for _ in range(300):
+        text = ''.join(rnd.choice('ab cd-ef  \t日本é́') for _ in range(rnd.randint(0, 60)))
+        width = rnd.randint(2, 12)
+        assert term.wrap(text, width, drop_whitespace=False) == blessed_term.wrap(text, width, drop_whitespace=False)
+        assert term.wrap(text, width) == blessed_term.wrap(text, width)
+    assert term.length(term.red('日本')) == 4